@@ -0,0 +1,99 @@
+"""Storage throughput benchmark.
+
+Measures put/get/delete throughput of a storage backend with concurrent
+requests. By default it runs fully offline against an in-process moto S3
+server (pip install "moto[server]"), so the S3 code path used for R2 can be
+measured without credentials:
+
+    python benchmark_storage.py --backend moto --size-kb 512 --count 200 --concurrency 16
+    python benchmark_storage.py --backend local
+    python benchmark_storage.py --backend env   # whatever server.py is configured with
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from storage import LocalStorage, MemoryStorage, S3Storage, StorageBackend
+
+async def run_phase(name: str, count: int, concurrency: int, total_bytes: int, operation):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await operation(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    mb = total_bytes / (1024 * 1024)
+    print(f"{name:>7}: {count} objects in {elapsed:.2f}s  "
+          f"{count / elapsed:8.1f} obj/s  {mb / elapsed:8.1f} MB/s")
+
+async def benchmark(storage: StorageBackend, size: int, count: int, concurrency: int):
+    payload = os.urandom(size)
+    prefix = f"benchmark/{uuid.uuid4().hex[:8]}"
+    keys = [f"{prefix}/{i}.bin" for i in range(count)]
+    await storage.start()
+    try:
+        print(f"backend={storage.name} size={size // 1024}KB count={count} concurrency={concurrency}")
+        await run_phase("put", count, concurrency, size * count,
+                        lambda i: storage.put_bytes(keys[i], payload))
+        await run_phase("get", count, concurrency, size * count,
+                        lambda i: storage.get_bytes(keys[i]))
+
+        start = time.perf_counter()
+        failed = await storage.delete_many(keys)
+        print(f" delete: {count} objects in {time.perf_counter() - start:.2f}s ({len(failed)} failed)")
+    finally:
+        await storage.close()
+
+def moto_storage(port: int):
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    boto3.client(
+        "s3", endpoint_url=endpoint, region_name="us-east-1",
+        aws_access_key_id="test", aws_secret_access_key="test"
+    ).create_bucket(Bucket="benchmark")
+    storage = S3Storage(
+        bucket="benchmark", endpoint_url=endpoint, region="us-east-1",
+        access_key_id="test", secret_access_key="test"
+    )
+    return storage, server
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark storage backend throughput")
+    parser.add_argument("--backend", choices=["moto", "local", "memory", "env"], default="moto")
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--moto-port", type=int, default=5055)
+    args = parser.parse_args()
+
+    server = None
+    if args.backend == "moto":
+        storage, server = moto_storage(args.moto_port)
+    elif args.backend == "local":
+        storage = LocalStorage(Path(tempfile.mkdtemp(prefix="storage-bench-")))
+    elif args.backend == "memory":
+        storage = MemoryStorage()
+    else:
+        from server import storage
+
+    try:
+        asyncio.run(benchmark(storage, args.size_kb * 1024, args.count, args.concurrency))
+    finally:
+        if server:
+            server.stop()
+
+if __name__ == "__main__":
+    main()
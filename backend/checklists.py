@@ -0,0 +1,179 @@
+"""Checklist PDFs (ESTADOS COSTURA / AVIOS COSTURA) for bases.
+
+The layout lives here once and is used both when a single checklist is
+generated and when all of them are regenerated. Rendering is deterministic
+(ReportLab's invariant mode drops the creation date and random document
+ID), so the same title, base name and items always give the same bytes;
+checklist_render_hash() identifies that input so unchanged checklists can
+skip rendering altogether. The row skeleton shared by every item is a
+form XObject referenced per row rather than redrawn.
+"""
+import hashlib
+import json
+import signal
+from io import BytesIO
+from typing import List
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+# Bump when the layout below changes so cached checklists are re-rendered
+CHECKLIST_LAYOUT_VERSION = 2
+
+# Content is drawn in an A6 area at the top-left of an A4 page
+PAGE_WIDTH, PAGE_HEIGHT = A4
+A6_WIDTH = 105 * mm
+A6_HEIGHT = 148 * mm
+LEFT_MARGIN = 5 * mm
+TOP_START = PAGE_HEIGHT - 8 * mm
+A6_BOTTOM = PAGE_HEIGHT - A6_HEIGHT
+
+def init_render_worker():
+    """Process pool initializer: Ctrl+C is handled by the server, which
+    shuts the pool down, not by each render worker"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def is_avios_checklist(title: str) -> bool:
+    return "AVIOS" in title.upper()
+
+def checklist_render_hash(title: str, base_name: str, items: List[str]) -> str:
+    """Hash of everything that affects the rendered PDF"""
+    payload = [CHECKLIST_LAYOUT_VERSION, title, base_name, list(items)]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()
+
+# The row skeleton (checkbox, date and signature lines, separator) is the
+# same for every item: it is defined once per document as a form XObject
+# and placed per row, so only the item names are drawn row by row
+ROW_FORM = "checklist_row"
+ROW_HEIGHT = 8 * mm
+# Rows are drawn around their baseline (y = 0) and placed with translate
+ROW_BOTTOM = -5 * mm
+ROW_TOP = 4 * mm
+
+def _draw_rows(c: canvas.Canvas, y: float, bottom: float, items: List[str], max_chars: int):
+    """Place the row form and item name for each item from y down, starting
+    a new page whenever a row would go below bottom"""
+    c.saveState()
+    c.translate(0, y)
+    for item_name in items:
+        if y < bottom:
+            c.restoreState()
+            c.showPage()
+            y = PAGE_HEIGHT - 15 * mm
+            c.saveState()
+            c.translate(0, y)
+        c.doForm(ROW_FORM)
+        # Item name - BOLD
+        c.setFont("Helvetica-Bold", 8)
+        c.setFillColorRGB(0, 0, 0)
+        c.drawString(LEFT_MARGIN, 0, item_name[:max_chars])
+        c.translate(0, -ROW_HEIGHT)
+        y -= ROW_HEIGHT
+    c.restoreState()
+
+def _define_avios_row(c: canvas.Canvas):
+    c.beginForm(ROW_FORM, lowerx=0, lowery=ROW_BOTTOM, upperx=A6_WIDTH, uppery=ROW_TOP)
+    # Checkbox
+    c.setStrokeColorRGB(0, 0, 0)
+    c.setLineWidth(0.5)
+    c.rect(71 * mm, -1.5 * mm, 3.5 * mm, 3.5 * mm)
+
+    # Row separator line (light gray)
+    c.setStrokeColorRGB(0.75, 0.75, 0.75)
+    c.setLineWidth(0.3)
+    c.line(LEFT_MARGIN, -4.5 * mm, A6_WIDTH - 5 * mm, -4.5 * mm)
+    c.endForm()
+
+def _define_estados_row(c: canvas.Canvas):
+    c.beginForm(ROW_FORM, lowerx=0, lowery=ROW_BOTTOM, upperx=A6_WIDTH, uppery=ROW_TOP)
+    # Checkbox (empty square)
+    c.setStrokeColorRGB(0, 0, 0)
+    c.setLineWidth(0.5)
+    c.rect(36 * mm, -1.5 * mm, 3 * mm, 3 * mm)
+
+    # Date field
+    c.setFont("Helvetica", 7)
+    c.setFillColorRGB(0, 0, 0)
+    c.drawString(45 * mm, 0, "___/___/____")
+
+    # Entregado por and Firma (dotted lines)
+    c.setDash(1, 1)
+    c.line(65 * mm, -1 * mm, 85 * mm, -1 * mm)
+    c.line(90 * mm, -1 * mm, A6_WIDTH - 5 * mm, -1 * mm)
+
+    # Row separator line (light gray)
+    c.setDash()
+    c.setStrokeColorRGB(0.75, 0.75, 0.75)
+    c.setLineWidth(0.3)
+    c.line(LEFT_MARGIN, -4.5 * mm, A6_WIDTH - 5 * mm, -4.5 * mm)
+    c.endForm()
+
+def _draw_avios(c: canvas.Canvas, items: List[str]):
+    # Cantidad field
+    c.drawString(LEFT_MARGIN, TOP_START - 14 * mm, "Cantidad: ____________________")
+
+    # Table header
+    y = TOP_START - 24 * mm
+    c.setFont("Helvetica-Bold", 8)
+    c.drawString(LEFT_MARGIN, y, "AVIOS")
+    c.drawString(70 * mm, y, "CHECK")
+    c.setStrokeColorRGB(0.4, 0.4, 0.4)
+    c.setLineWidth(0.5)
+    c.line(LEFT_MARGIN, y - 2 * mm, A6_WIDTH - 5 * mm, y - 2 * mm)
+
+    footer_y = A6_BOTTOM + 20 * mm
+    _define_avios_row(c)
+    # Leave space for footer
+    _draw_rows(c, y - 7 * mm, footer_y + 15 * mm, items, 35)
+
+    # Footer section (within A6 area)
+    c.setFont("Helvetica", 7)
+    c.setFillColorRGB(0, 0, 0)
+    c.drawString(LEFT_MARGIN, footer_y, "Recibido por:")
+    c.setDash(1, 1)
+    c.setStrokeColorRGB(0, 0, 0)
+    c.setLineWidth(0.3)
+    c.line(22 * mm, footer_y - 1 * mm, 55 * mm, footer_y - 1 * mm)
+    c.setDash()
+    c.drawString(LEFT_MARGIN, footer_y - 10 * mm, "Fecha: ___/___/____")
+    c.drawString(50 * mm, footer_y - 10 * mm, "Firma:")
+    c.setDash(1, 1)
+    c.line(62 * mm, footer_y - 11 * mm, A6_WIDTH - 5 * mm, footer_y - 11 * mm)
+
+def _draw_estados(c: canvas.Canvas, items: List[str]):
+    # Table header
+    y = TOP_START - 14 * mm
+    c.setFont("Helvetica-Bold", 7)
+    c.drawString(LEFT_MARGIN, y, "ITEM")
+    c.drawString(35 * mm, y, "CHECK")
+    c.drawString(45 * mm, y, "FECHA")
+    c.drawString(65 * mm, y, "ENTREGADO POR")
+    c.drawString(90 * mm, y, "FIRMA")
+    c.setStrokeColorRGB(0.4, 0.4, 0.4)
+    c.setLineWidth(0.5)
+    c.line(LEFT_MARGIN, y - 2 * mm, A6_WIDTH - 5 * mm, y - 2 * mm)
+
+    _define_estados_row(c)
+    _draw_rows(c, y - 7 * mm, A6_BOTTOM + 5 * mm, items, 18)
+
+def render_checklist_pdf(title: str, base_name: str, items: List[str]) -> bytes:
+    """Render a checklist; AVIOS titles get the avios layout, others estados"""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4, invariant=1)
+
+    # Title - centered within A6 width
+    c.setFont("Helvetica-Bold", 12)
+    c.drawCentredString(A6_WIDTH / 2, TOP_START, title)
+
+    # Model name
+    c.setFont("Helvetica", 8)
+    c.drawString(LEFT_MARGIN, TOP_START - 8 * mm, f"Modelo: {base_name}")
+
+    if is_avios_checklist(title):
+        _draw_avios(c, items)
+    else:
+        _draw_estados(c, items)
+
+    c.save()
+    return buffer.getvalue()
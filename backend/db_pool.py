@@ -0,0 +1,97 @@
+"""Database connection pool with usage metrics.
+
+MetricsQueuePool is SQLAlchemy's asyncio queue pool (the default for async
+engines) timing every checkout: the wait for a free connection plus any
+pre-ping or new connection it needs. Pool timeouts ("QueuePool limit ...
+reached") are counted as well. pool_status() reports those numbers together
+with the pool's current occupancy.
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Recent checkout waits kept for percentiles
+WAIT_WINDOW = 1000
+
+class PoolMetrics:
+    """Checkout counters and recent wait times"""
+
+    def __init__(self, window: int = WAIT_WINDOW):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self._waits.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            checkouts, timeouts = self.checkouts, self.timeouts
+            total_wait, max_wait = self.total_wait, self.max_wait
+
+        def percentile(p: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2)
+
+        attempts = checkouts + timeouts
+        return {
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "wait_ms": {
+                "avg": round(total_wait / attempts * 1000, 2) if attempts else None,
+                "max": round(max_wait * 1000, 2),
+                # Over the last WAIT_WINDOW checkouts
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+            },
+        }
+
+class MetricsQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool recording checkout waits and timeouts.
+
+    The metrics live on the class so they survive pool.recreate() (after
+    dispose() or an invalidation); a process has a single engine.
+    """
+    metrics = PoolMetrics()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return connection
+
+def pool_status(pool: MetricsQueuePool) -> dict:
+    """Current occupancy and settings of pool plus its checkout metrics"""
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        # Connections open beyond size (negative while the pool isn't full yet)
+        "overflow": pool.overflow(),
+        "max_overflow": pool._max_overflow,
+        "timeout": pool.timeout(),
+        "recycle": pool._recycle,
+        "pre_ping": pool._pre_ping,
+        **pool.metrics.snapshot(),
+    }
@@ -0,0 +1,243 @@
+"""Maintenance commands for the backend.
+
+Usage:
+    python manage.py gc-storage [--dry-run] [--grace-hours 24] [--batch-size 500] [--bundle-max-age-days 30]
+    python manage.py generate-previews
+    python manage.py worker
+    python manage.py migrate [--status]
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import List, Set, Tuple
+
+from sqlalchemy import select, delete, func
+
+from migrations import migration_status, run_migrations
+from server import (
+    engine, async_session, Base, DB_SCHEMA, storage, storage_key_from_path, presigned_url_cache,
+    enqueue_preview, process_previews, PREVIEW_BATCH_SIZE, job_worker, storage_deletion_worker,
+    BaseDB, ModeloDB, MuestraBaseDB, FichaDB, TizadoDB, StorageObjectDB, FilePreviewDB, BundleCacheDB,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("manage")
+
+# Columns holding stored file paths: (column, is_array)
+FILE_REFERENCE_COLUMNS = [
+    (BaseDB.patron_archivo, False),
+    (BaseDB.fichas_archivos, True),
+    (BaseDB.tizados_archivos, True),
+    (ModeloDB.fichas_archivos, True),
+    (MuestraBaseDB.archivo_costos, False),
+    (FichaDB.archivo, False),
+    (TizadoDB.archivo_tizado, False),
+]
+
+async def stored_file_paths(session):
+    """Yield every stored file path referenced by an entity row"""
+    for column, is_array in FILE_REFERENCE_COLUMNS:
+        value = func.unnest(column) if is_array else column
+        result = await session.stream_scalars(select(value).where(column.isnot(None)))
+        async for file_path in result:
+            if file_path:
+                yield file_path
+
+# ============ gc-storage ============
+
+async def prune_bundle_cache(max_age: timedelta, dry_run: bool) -> int:
+    """Drop cached ZIP bundles not downloaded within max_age; their objects
+    are then unreferenced and collected by the scan."""
+    async with async_session() as session:
+        stale = BundleCacheDB.last_used_at < datetime.now(timezone.utc) - max_age
+        if dry_run:
+            return await session.scalar(select(func.count()).select_from(BundleCacheDB).where(stale))
+        result = await session.execute(delete(BundleCacheDB).where(stale))
+        await session.commit()
+        return result.rowcount
+
+async def referenced_storage_keys(cutoff: datetime) -> Tuple[Set[str], Set[str]]:
+    """Every storage key referenced by a row (and the previews of those
+    files) or by a cached bundle, plus keys whose reference count changed
+    after cutoff (uploads whose entity row may not be committed yet).
+    
+    Also returns the file names of references that don't map to a
+    "category/filename" key: whatever category they live in, objects with
+    those names are kept rather than guessed about.
+    """
+    keys = set()
+    unmapped = set()
+    async with async_session() as session:
+        async for file_path in stored_file_paths(session):
+            key = storage_key_from_path(file_path)
+            keys.add(key)
+            if "/" not in key:
+                logger.warning(f"Reference without a category, keeping every object named {key}: {file_path}")
+                unmapped.add(key)
+        result = await session.execute(
+            select(FilePreviewDB.source_key, FilePreviewDB.thumb_path, FilePreviewDB.medium_path)
+        )
+        for source_key, *preview_paths in result.all():
+            if source_key in keys:
+                keys.update(storage_key_from_path(p) for p in preview_paths if p)
+        result = await session.stream_scalars(select(BundleCacheDB.file_path))
+        async for file_path in result:
+            keys.add(storage_key_from_path(file_path))
+        result = await session.stream_scalars(
+            select(StorageObjectDB.key).where(StorageObjectDB.updated_at >= cutoff)
+        )
+        async for key in result:
+            keys.add(key)
+    return keys, unmapped
+
+async def delete_orphans(keys: List[str], cutoff: datetime) -> int:
+    """Delete a batch of unreferenced objects and their reference rows.
+
+    Reference rows are locked while the objects are deleted so an upload of
+    the same content waits and then re-uploads instead of reusing an object
+    that is about to disappear. Rows touched after cutoff are left alone.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(StorageObjectDB.key, StorageObjectDB.updated_at)
+            .where(StorageObjectDB.key.in_(keys))
+            .with_for_update()
+        )
+        recent = {key for key, updated_at in result.all() if updated_at >= cutoff}
+        batch = [key for key in keys if key not in recent]
+        for key in batch:
+            presigned_url_cache.invalidate(key)
+        failed = set(await storage.delete_many(batch))
+        deleted = [key for key in batch if key not in failed]
+        if deleted:
+            await session.execute(delete(StorageObjectDB).where(StorageObjectDB.key.in_(deleted)))
+            # Their previews become orphans too and go in the next run
+            await session.execute(delete(FilePreviewDB).where(FilePreviewDB.source_key.in_(deleted)))
+        await session.commit()
+    for key in failed:
+        logger.error(f"Could not delete {key}")
+    return len(deleted)
+
+async def gc_storage(dry_run: bool, grace_hours: float, batch_size: int, bundle_max_age_days: float):
+    """Delete stored objects no row references, older than the grace period.
+
+    The bucket listing (or the UPLOADS_DIR walk) is streamed and compared
+    against the in-memory set of referenced keys; orphans are deleted in
+    batches as they are found.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+    await storage.start()
+    try:
+        pruned = await prune_bundle_cache(timedelta(days=bundle_max_age_days), dry_run)
+        if pruned:
+            logger.info(f"{pruned} cached bundles unused for {bundle_max_age_days:g} days "
+                        f"{'would be dropped' if dry_run else 'dropped'}")
+        referenced, unmapped = await referenced_storage_keys(cutoff)
+        logger.info(f"{len(referenced)} referenced keys, scanning {storage.name} storage "
+                    f"for orphans older than {cutoff.isoformat()}")
+
+        scanned = orphans = deleted = 0
+        batch = []
+        async for key, last_modified in storage.list_objects():
+            scanned += 1
+            if key in referenced or key.rsplit("/", 1)[-1] in unmapped or last_modified >= cutoff:
+                continue
+            orphans += 1
+            if dry_run:
+                print(f"would delete {key} (modified {last_modified.isoformat()})")
+                continue
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += await delete_orphans(batch, cutoff)
+                batch = []
+        if batch:
+            deleted += await delete_orphans(batch, cutoff)
+
+        if dry_run:
+            print(f"Dry run: {scanned} objects scanned, {orphans} unreferenced would be deleted")
+        else:
+            print(f"{scanned} objects scanned, {orphans} unreferenced, {deleted} deleted")
+    finally:
+        await storage.close()
+        await engine.dispose()
+
+# ============ generate-previews ============
+
+async def generate_previews():
+    """Queue previews for every stored file that has none yet and render them"""
+    await storage.start()
+    try:
+        async with async_session() as session:
+            paths = {p async for p in stored_file_paths(session)}
+        for file_path in paths:
+            await enqueue_preview(file_path)
+        logger.info(f"{len(paths)} stored files checked, rendering queued previews")
+        rendered = 0
+        while True:
+            claimed = await process_previews()
+            rendered += claimed
+            if claimed < PREVIEW_BATCH_SIZE:
+                break
+        print(f"{rendered} previews processed")
+    finally:
+        await storage.close()
+        await engine.dispose()
+
+# ============ worker ============
+
+async def run_worker():
+    """Run queued jobs (and the storage deletions they schedule) until stopped"""
+    await storage.start()
+    logger.info(f"Job worker started ({storage.name} storage)")
+    try:
+        await asyncio.gather(job_worker(), storage_deletion_worker())
+    finally:
+        await storage.close()
+        await engine.dispose()
+
+# ============ migrate ============
+
+async def migrate(status_only: bool):
+    """Apply pending schema migrations, or list them with their state"""
+    try:
+        if not status_only:
+            applied = await run_migrations(engine, DB_SCHEMA, Base.metadata)
+            print(f"{len(applied)} migrations applied" + (f": {', '.join(map(str, applied))}" if applied else ""))
+        for version, name, done in await migration_status(engine, DB_SCHEMA):
+            print(f"{version:04d} {'applied' if done else 'pending':8} {name}")
+    finally:
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend maintenance commands")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    gc_parser = subcommands.add_parser("gc-storage", help="Delete stored files no longer referenced")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    gc_parser.add_argument("--grace-hours", type=float, default=24,
+                           help="Keep unreferenced objects newer than this (default: 24)")
+    gc_parser.add_argument("--batch-size", type=int, default=500, help="Objects deleted per batch (default: 500)")
+    gc_parser.add_argument("--bundle-max-age-days", type=float, default=30,
+                           help="Drop cached ZIP bundles not downloaded for this long (default: 30)")
+
+    subcommands.add_parser("generate-previews", help="Render missing previews for already stored files")
+    subcommands.add_parser("worker", help="Run queued background jobs")
+    migrate_parser = subcommands.add_parser("migrate", help="Apply pending schema migrations")
+    migrate_parser.add_argument("--status", action="store_true", help="Only list migrations and whether they are applied")
+
+    args = parser.parse_args()
+    if args.command == "gc-storage":
+        asyncio.run(gc_storage(args.dry_run, args.grace_hours, args.batch_size, args.bundle_max_age_days))
+    elif args.command == "generate-previews":
+        asyncio.run(generate_previews())
+    elif args.command == "worker":
+        try:
+            asyncio.run(run_worker())
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "migrate":
+        asyncio.run(migrate(args.status))
+
+if __name__ == "__main__":
+    main()
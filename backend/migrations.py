@@ -0,0 +1,167 @@
+"""Versioned schema migrations.
+
+Applied versions are recorded in <schema>.schema_migrations. Every run
+takes a PostgreSQL advisory lock first, so several app processes starting
+at once (or `manage.py migrate` alongside them) apply each migration once.
+
+Version 1 is the baseline: create_all() with the current models, plus the
+statements that bring databases created before it to the same schema. Since
+create_all() always reflects the latest models, later migrations must be
+idempotent (IF NOT EXISTS) so they are no-ops on databases the baseline
+created from scratch.
+
+Migrations run in a transaction together with their schema_migrations row,
+except non-transactional ones (CREATE INDEX CONCURRENTLY can't run inside a
+transaction): those run statement by statement and are recorded at the end,
+so an interrupted run is simply retried from the start.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import MetaData, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+MIGRATIONS_TABLE = "schema_migrations"
+# While another process holds the migration lock, retry taking it this often
+LOCK_POLL_SECONDS = 1
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[AsyncConnection, str, MetaData], Awaitable[None]]
+    transactional: bool = True
+
+async def create_index_concurrently(conn: AsyncConnection, schema: str, name: str, table: str,
+                                    columns: str, using: Optional[str] = None):
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS, first dropping an invalid
+    index of that name left behind by an interrupted build"""
+    valid = await conn.scalar(text(
+        "SELECT i.indisvalid FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = :schema AND c.relname = :name"
+    ), {"schema": schema, "name": name})
+    if valid is False:
+        logging.warning(f"Dropping invalid index {schema}.{name} before rebuilding it")
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.{name}"))
+    method = f" USING {using}" if using else ""
+    await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {schema}.{table}{method} ({columns})"))
+
+# ============ Migrations ============
+
+async def baseline(conn: AsyncConnection, schema: str, metadata: MetaData):
+    await conn.run_sync(metadata.create_all)
+    # Columns added to existing tables before migrations existed
+    await conn.execute(text(f"ALTER TABLE {schema}.checklist_pdfs ADD COLUMN IF NOT EXISTS catalogo_version TIMESTAMPTZ"))
+
+# Tables listed with "WHERE activo = ... ORDER BY orden"
+ORDERED_TABLES = [
+    "marcas", "tipos_producto", "entalles", "telas", "hilos", "estados_costura", "avios_costura",
+    "muestras_base", "bases", "modelos", "fichas", "tizados",
+]
+
+# (index name, table, columns, method)
+INDEXES_0002: List[Tuple[str, str, str, Optional[str]]] = [
+    # Foreign keys
+    ("ix_modelos_base_id", "modelos", "base_id", None),
+    ("ix_modelos_hilo_id", "modelos", "hilo_id", None),
+    ("ix_bases_muestra_base_id", "bases", "muestra_base_id", None),
+    ("ix_muestras_base_marca_id", "muestras_base", "marca_id", None),
+    ("ix_muestras_base_tipo_producto_id", "muestras_base", "tipo_producto_id", None),
+    ("ix_muestras_base_entalle_id", "muestras_base", "entalle_id", None),
+    ("ix_muestras_base_tela_id", "muestras_base", "tela_id", None),
+    # Catalog ids of bases, looked up with @> (array containment)
+    ("ix_bases_estados_costura_ids", "bases", "estados_costura_ids", "gin"),
+    ("ix_bases_avios_costura_ids", "bases", "avios_costura_ids", "gin"),
+    # Audit log, newest first, optionally filtered by entity or user
+    ("ix_audit_logs_created_at", "audit_logs", "created_at DESC", None),
+    ("ix_audit_logs_entidad_created_at", "audit_logs", "entidad, created_at DESC", None),
+    ("ix_audit_logs_usuario_id_created_at", "audit_logs", "usuario_id, created_at DESC", None),
+    ("ix_audit_logs_entidad_id", "audit_logs", "entidad_id", None),
+] + [
+    index
+    for table in ORDERED_TABLES
+    for index in [
+        (f"ix_{table}_orden", table, "orden", None),
+        (f"ix_{table}_activo_orden", table, "activo, orden", None),
+    ]
+]
+
+async def add_missing_indexes(conn: AsyncConnection, schema: str, metadata: MetaData):
+    for name, table, columns, using in INDEXES_0002:
+        await create_index_concurrently(conn, schema, name, table, columns, using)
+
+async def storage_deletion_released_flag(conn: AsyncConnection, schema: str, metadata: MetaData):
+    await conn.execute(text(
+        f"ALTER TABLE {schema}.storage_deletions ADD COLUMN IF NOT EXISTS reference_released BOOLEAN DEFAULT false"
+    ))
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", baseline),
+    Migration(2, "indexes for foreign keys, ordering and audit log", add_missing_indexes, transactional=False),
+    Migration(3, "storage_deletions.reference_released", storage_deletion_released_flag),
+]
+
+# ============ Runner ============
+
+async def acquire_migration_lock(conn: AsyncConnection, key: str):
+    """Take the advisory lock, polling rather than blocking: a session
+    blocked in pg_advisory_lock() sits in a transaction that CREATE INDEX
+    CONCURRENTLY in the lock holder would wait for, deadlocking both"""
+    waiting = False
+    while not await conn.scalar(text("SELECT pg_try_advisory_lock(hashtext(:key))"), {"key": key}):
+        if not waiting:
+            logging.info("Waiting for migrations running in another process")
+            waiting = True
+        await asyncio.sleep(LOCK_POLL_SECONDS)
+
+async def applied_versions(conn: AsyncConnection, schema: str) -> Dict[int, str]:
+    result = await conn.execute(text(f"SELECT version, name FROM {schema}.{MIGRATIONS_TABLE}"))
+    return dict(result.all())
+
+async def run_migrations(engine: AsyncEngine, schema: str, metadata: MetaData,
+                         migrations: List[Migration] = MIGRATIONS) -> List[int]:
+    """Apply pending migrations in version order. Returns the versions applied."""
+    applied = []
+    lock_key = f"migrations:{schema}"
+    async with engine.connect() as lock_conn:
+        # Autocommit: holds the session-level lock and runs the
+        # non-transactional migrations
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await acquire_migration_lock(lock_conn, lock_key)
+        try:
+            await lock_conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+            await lock_conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {schema}.{MIGRATIONS_TABLE} ("
+                "version INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, "
+                "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            ))
+            done = await applied_versions(lock_conn, schema)
+            record = text(f"INSERT INTO {schema}.{MIGRATIONS_TABLE} (version, name) VALUES (:version, :name)")
+            for migration in sorted(migrations, key=lambda m: m.version):
+                if migration.version in done:
+                    continue
+                logging.info(f"Applying migration {migration.version}: {migration.name}")
+                params = {"version": migration.version, "name": migration.name}
+                if migration.transactional:
+                    async with engine.begin() as conn:
+                        await migration.apply(conn, schema, metadata)
+                        await conn.execute(record, params)
+                else:
+                    await migration.apply(lock_conn, schema, metadata)
+                    await lock_conn.execute(record, params)
+                applied.append(migration.version)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": lock_key})
+    return applied
+
+async def migration_status(engine: AsyncEngine, schema: str,
+                           migrations: List[Migration] = MIGRATIONS) -> List[Tuple[int, str, bool]]:
+    """(version, name, applied) for every known migration"""
+    async with engine.connect() as conn:
+        exists = await conn.scalar(text("SELECT to_regclass(:table)"), {"table": f"{schema}.{MIGRATIONS_TABLE}"})
+        done = await applied_versions(conn, schema) if exists else {}
+    return [(m.version, m.name, m.version in done) for m in sorted(migrations, key=lambda m: m.version)]
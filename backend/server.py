@@ -1,28 +1,51 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, UploadFile, File, Form, Depends
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, UploadFile, File, Form, Depends, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Boolean, Integer, Float, Text, DateTime, select, update, delete, func, text
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
+from sqlalchemy import String, Boolean, Integer, BigInteger, Float, Text, DateTime, select, update, delete, func, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 import shutil
-import boto3
-from botocore.config import Config
+import asyncio
+import base64
+import hashlib
+import json
+import tempfile
+import time
+import re
+import mimetypes
+import multiprocessing
+import threading
+import anyio
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict
+from storage import StorageBackend, StorageError, S3Storage, LocalStorage, MemoryStorage, key_from_path
+from zip_stream import ZipEntry, archive_size, compression_for_name, stream_zip
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from io import BytesIO
-from reportlab.lib.pagesizes import A6
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # PDF previews and checklist printing are unavailable without it
+    pdfium = None
+# PDFium is not thread-safe: every call from worker threads holds this lock
+pdfium_lock = threading.Lock()
+from PIL import Image, ImageOps
+from db_pool import MetricsQueuePool, pool_status
+from migrations import run_migrations
+from checklists import checklist_render_hash, init_render_worker, render_checklist_pdf
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -42,6 +65,14 @@ security = HTTPBearer()
 UPLOADS_DIR = ROOT_DIR / "uploads"
 UPLOADS_DIR.mkdir(exist_ok=True)
 
+# Upload limits. Files are streamed in chunks of UPLOAD_CHUNK_SIZE, which is
+# also the multipart part size for R2 (parts must be at least 5 MB).
+MAX_UPLOAD_SIZE_MB = int(os.environ.get('MAX_UPLOAD_SIZE_MB', '200'))
+MAX_UPLOAD_SIZE = MAX_UPLOAD_SIZE_MB * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE_MB', '8')) * 1024 * 1024
+# Max files pushed to storage at the same time by multi-file upload endpoints
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', '4'))
+
 # PostgreSQL Configuration
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 DB_SCHEMA = os.environ.get('DB_SCHEMA', 'muestra')
@@ -56,8 +87,27 @@ if '?sslmode=' in DATABASE_URL:
 elif '&sslmode=' in DATABASE_URL:
     DATABASE_URL = DATABASE_URL.replace('&sslmode=disable', '').replace('&sslmode=require', '')
 
+# Connection pool: DB_POOL_SIZE connections kept open, up to DB_MAX_OVERFLOW
+# more at peaks, waiting DB_POOL_TIMEOUT seconds for a free one. Connections
+# are pinged before use and replaced after DB_POOL_RECYCLE seconds, so a
+# database failover or restart doesn't leave stale ones behind.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
 # Create async engine
-engine = create_async_engine(DATABASE_URL, echo=False)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    poolclass=MetricsQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING
+)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 # Cloudflare R2 Configuration
@@ -67,18 +117,40 @@ R2_SECRET_ACCESS_KEY = os.environ.get('R2_SECRET_ACCESS_KEY')
 R2_BUCKET_NAME = os.environ.get('R2_BUCKET_NAME', 'muestras')
 R2_ENDPOINT = f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com" if R2_ACCOUNT_ID else None
 
-# Initialize R2 client
-r2_client = None
-if R2_ACCOUNT_ID and R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY:
-    r2_client = boto3.client(
-        's3',
-        endpoint_url=R2_ENDPOINT,
-        aws_access_key_id=R2_ACCESS_KEY_ID,
-        aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-        config=Config(signature_version='s3v4'),
-        region_name='auto'
-    )
-    logging.info(f"R2 client initialized for bucket: {R2_BUCKET_NAME}")
+# R2 client tuning (connection pool, timeouts and retries)
+R2_MAX_POOL_CONNECTIONS = int(os.environ.get('R2_MAX_POOL_CONNECTIONS', '50'))
+R2_CONNECT_TIMEOUT = float(os.environ.get('R2_CONNECT_TIMEOUT', '5'))
+R2_READ_TIMEOUT = float(os.environ.get('R2_READ_TIMEOUT', '60'))
+R2_MAX_ATTEMPTS = int(os.environ.get('R2_MAX_ATTEMPTS', '3'))
+
+R2_CONFIGURED = bool(R2_ACCOUNT_ID and R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY)
+
+# Storage backend: "s3" (R2 or any S3-compatible endpoint), "local" or
+# "memory". Defaults to s3 when R2 credentials are set, local otherwise.
+# STORAGE_ENDPOINT_URL overrides the R2 endpoint, e.g. to point at a moto or
+# MinIO server.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3' if R2_CONFIGURED else 'local')
+STORAGE_ENDPOINT_URL = os.environ.get('STORAGE_ENDPOINT_URL') or R2_ENDPOINT
+
+def create_storage() -> StorageBackend:
+    """Build the configured storage backend (connections open on startup)"""
+    if STORAGE_BACKEND == 's3':
+        return S3Storage(
+            bucket=R2_BUCKET_NAME,
+            endpoint_url=STORAGE_ENDPOINT_URL,
+            access_key_id=R2_ACCESS_KEY_ID,
+            secret_access_key=R2_SECRET_ACCESS_KEY,
+            max_pool_connections=R2_MAX_POOL_CONNECTIONS,
+            connect_timeout=R2_CONNECT_TIMEOUT,
+            read_timeout=R2_READ_TIMEOUT,
+            max_attempts=R2_MAX_ATTEMPTS,
+            part_size=UPLOAD_CHUNK_SIZE,
+        )
+    if STORAGE_BACKEND == 'memory':
+        return MemoryStorage()
+    return LocalStorage(UPLOADS_DIR)
+
+storage = create_storage()
 
 # Create the main app
 app = FastAPI()
@@ -290,6 +362,93 @@ class AuditLogDB(Base):
     detalles: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON con cambios
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
+class StorageObjectDB(Base):
+    """Reference count for content-addressed stored objects (objetos/<sha256><ext>)"""
+    __tablename__ = "storage_objects"
+    __table_args__ = {"schema": DB_SCHEMA}
+    
+    key: Mapped[str] = mapped_column(String(500), primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(64), nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, default=0)
+    content_type: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    ref_count: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class StorageDeletionDB(Base):
+    """Outbox of stored files to delete once the transaction that dropped them commits"""
+    __tablename__ = "storage_deletions"
+    __table_args__ = {"schema": DB_SCHEMA}
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    file_path: Mapped[str] = mapped_column(String(500), nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # The file's reference was already released by an earlier attempt whose
+    # storage delete failed: retries only delete the object if still unused
+    reference_released: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class FilePreviewDB(Base):
+    """Preview images rendered for a stored PDF or image (one row per source object)"""
+    __tablename__ = "file_previews"
+    __table_args__ = {"schema": DB_SCHEMA}
+    
+    source_key: Mapped[str] = mapped_column(String(500), primary_key=True)
+    estado: Mapped[str] = mapped_column(String(20), default="PENDIENTE", index=True)  # PENDIENTE, EN_PROCESO, LISTO, ERROR, OMITIDO
+    thumb_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    medium_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class JobDB(Base):
+    """Long-running operation executed by a job worker outside the HTTP request"""
+    __tablename__ = "jobs"
+    __table_args__ = {"schema": DB_SCHEMA}
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tipo: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
+    estado: Mapped[str] = mapped_column(String(20), default="PENDIENTE", index=True)  # PENDIENTE, EN_PROCESO, COMPLETADO, ERROR
+    params: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON
+    progreso_actual: Mapped[int] = mapped_column(Integer, default=0)
+    progreso_total: Mapped[int] = mapped_column(Integer, default=0)
+    resultado: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    usuario_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+class ChecklistPdfDB(Base):
+    """Render hash of the checklist PDF currently stored for a base ficha"""
+    __tablename__ = "checklist_pdfs"
+    __table_args__ = {"schema": DB_SCHEMA}
+    
+    base_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    nombre: Mapped[str] = mapped_column(String(255), primary_key=True)
+    render_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    file_path: Mapped[str] = mapped_column(String(500), nullable=False)
+    # Catalog version rendered: latest updated_at of the estados/avios used
+    catalogo_version: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class BundleCacheDB(Base):
+    """ZIP bundles already built, keyed by the hash of their file manifest"""
+    __tablename__ = "bundle_cache"
+    __table_args__ = {"schema": DB_SCHEMA}
+    
+    manifest_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    scope: Mapped[str] = mapped_column(String(100), index=True)  # e.g. modelo:<id>
+    file_path: Mapped[str] = mapped_column(String(500), nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    last_used_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
 # ============ Pydantic Schemas ============
 
 class MarcaCreate(BaseModel):
@@ -581,13 +740,16 @@ async def get_admin_user(current_user: UsuarioDB = Depends(get_current_user)) ->
 
 # ============ Database Initialization ============
 
+# Apply pending schema migrations at startup. Disable to run them only with
+# `python manage.py migrate` (e.g. as a deploy step before starting the app).
+MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+
 async def init_db():
-    """Create schema and tables if they don't exist"""
-    async with engine.begin() as conn:
-        # Create schema if not exists
-        await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {DB_SCHEMA}"))
-        # Create all tables
-        await conn.run_sync(Base.metadata.create_all)
+    """Apply pending schema migrations and create the default admin user"""
+    if MIGRATE_ON_STARTUP:
+        applied = await run_migrations(engine, DB_SCHEMA, Base.metadata)
+        if applied:
+            logging.info(f"Applied migrations: {', '.join(map(str, applied))}")
     logging.info(f"Database initialized with schema: {DB_SCHEMA}")
     
     # Create default admin user if not exists
@@ -606,9 +768,41 @@ async def init_db():
             await session.commit()
             logging.info("Default admin user created: admin/admin123")
 
+# Long-running workers started with the app (storage deletions, previews, jobs)
+background_tasks: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup():
+    await storage.start()
+    logging.info(f"Storage backend: {storage.name}")
     await init_db()
+    background_tasks.append(asyncio.create_task(storage_deletion_worker()))
+    background_tasks.append(asyncio.create_task(preview_worker()))
+    if JOBS_IN_PROCESS:
+        background_tasks.append(asyncio.create_task(job_worker()))
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    # Let bundle uploads in flight finish before closing the storage client
+    await asyncio.gather(*bundle_store_tasks, return_exceptions=True)
+    if checklist_pool is not None:
+        checklist_pool.shutdown(wait=False, cancel_futures=True)
+    await storage.close()
+
+# No free database connection within DB_POOL_TIMEOUT: a retryable 503
+# instead of a 500 with the QueuePool error
+@app.exception_handler(SQLAlchemyTimeoutError)
+async def db_pool_timeout_handler(request: Request, exc: SQLAlchemyTimeoutError):
+    logging.warning(f"Database pool exhausted: {engine.pool.status()}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servidor ocupado, intente nuevamente"},
+        headers={"Retry-After": "5"}
+    )
 
 # CORS
 app.add_middleware(
@@ -621,121 +815,783 @@ app.add_middleware(
 
 # ============ FILE UPLOAD HELPER ============
 
-async def save_upload_file(file: UploadFile, subfolder: str, custom_name: str = None) -> str:
-    """Save uploaded file to R2 (or local if R2 not configured)
+async def save_upload_file(file: UploadFile, subfolder: str, custom_name: str = None, session: Optional[AsyncSession] = None) -> str:
+    """Save uploaded file to the configured storage backend
+    
+    Files are stored content-addressed: the upload is hashed (SHA-256) while
+    streaming and kept under objetos/<sha256><ext>. If that object is already
+    stored the PUT is skipped and only its reference count goes up.
     
     Args:
         file: The uploaded file
-        subfolder: Category folder (costos, patrones, etc.)
-        custom_name: Optional custom name for the file (without extension)
+        subfolder: Category folder (costos, patrones, etc.). Only used for logging,
+            identical content is shared across categories
+        custom_name: Optional custom name for the file. Display names are kept
+            by the callers, the stored key only depends on the content
+        session: The caller's session, when the returned path is saved in a
+            row. The reference is only kept if session commits, otherwise it
+            is released after UPLOAD_GUARD_SECONDS
     """
-    ext = Path(file.filename).suffix if file.filename else ""
-    
-    # Use custom name if provided, otherwise use original filename (sanitized)
-    if custom_name and custom_name.strip():
-        # Sanitize custom name: remove special chars, keep alphanumeric, spaces, hyphens, underscores
-        safe_name = "".join(c for c in custom_name if c.isalnum() or c in (' ', '-', '_')).strip()
-        safe_name = safe_name.replace(' ', '_')
-        if not safe_name:
-            safe_name = str(uuid.uuid4())
-    else:
-        # Use original filename without extension, sanitized
-        original_name = Path(file.filename).stem if file.filename else str(uuid.uuid4())
-        safe_name = "".join(c for c in original_name if c.isalnum() or c in (' ', '-', '_')).strip()
-        safe_name = safe_name.replace(' ', '_')
-        if not safe_name:
-            safe_name = str(uuid.uuid4())
-    
-    # Add UUID suffix to avoid collisions
-    file_id = str(uuid.uuid4())[:8]
-    filename = f"{safe_name}_{file_id}{ext}"
-    key = f"{subfolder}/{filename}"
-    
-    if r2_client:
-        try:
-            file_content = await file.read()
-            content_type = file.content_type or 'application/octet-stream'
-            r2_client.put_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=key,
-                Body=file_content,
-                ContentType=content_type
-            )
-            return f"r2://{key}"
-        except Exception as e:
-            logging.error(f"Error uploading to R2: {e}")
-            raise HTTPException(status_code=500, detail=f"Error al subir archivo: {str(e)}")
-    else:
-        folder = UPLOADS_DIR / subfolder
-        folder.mkdir(exist_ok=True)
-        file_path = folder / filename
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        return f"{subfolder}/{filename}"
-
-def get_r2_presigned_url(key: str, expiration: int = 3600) -> str:
+    file_path, guard_id = await store_upload_file(file, subfolder, session is not None)
+    if session is not None:
+        await keep_stored_files(session, [guard_id])
+    return file_path
+
+async def store_upload_file(file: UploadFile, subfolder: str, guarded: bool) -> Tuple[str, Optional[str]]:
+    """Store an upload content-addressed. Returns (file_path, guard entry id)"""
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise upload_too_large_error()
+    
+    sha256, size = await hash_upload_file(file)
+    key = content_addressed_key(sha256, file.filename)
+    content_type = file.content_type or 'application/octet-stream'
+    
+    async def write_object():
+        await file.seek(0)
+        await storage.put_stream(key, read_upload_chunks(file), content_type)
+    
+    try:
+        guard_id = await store_content_addressed(key, sha256, size, content_type, write_object, guarded)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error uploading {subfolder} file to storage: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al subir archivo: {str(e)}")
+    return storage.to_path(key), guard_id
+
+async def save_upload_files(files: List[UploadFile], subfolder: str, nombres: List[str], session: Optional[AsyncSession] = None) -> Tuple[List[str], List[str]]:
+    """Save several uploads concurrently, at most UPLOAD_CONCURRENCY at a time.
+    
+    Returns (file_paths, display names) in the same order as files. If any
+    upload fails the others are cancelled, the ones already stored are deleted
+    and the first error is raised. session is handled as in save_upload_file.
+    """
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    custom_names = [nombres[i] if i < len(nombres) and nombres[i] else None for i in range(len(files))]
+    
+    async def save_one(file: UploadFile) -> Tuple[str, Optional[str]]:
+        async with semaphore:
+            return await store_upload_file(file, subfolder, session is not None)
+    
+    tasks = []
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for file in files:
+                tasks.append(tg.create_task(save_one(file)))
+    except BaseExceptionGroup as eg:
+        uploaded = [t.result() for t in tasks if t.done() and not t.cancelled() and t.exception() is None]
+        await asyncio.gather(*(delete_r2_file(file_path, guard_id) for file_path, guard_id in uploaded))
+        raise eg.exceptions[0]
+    
+    file_paths = [t.result()[0] for t in tasks]
+    if session is not None:
+        await keep_stored_files(session, [t.result()[1] for t in tasks])
+    new_nombres = [
+        custom_name or file.filename or file_path.split('/')[-1]
+        for file, custom_name, file_path in zip(files, custom_names, file_paths)
+    ]
+    return file_paths, new_nombres
+
+# ============ CONTENT-ADDRESSED STORAGE ============
+
+CAS_PREFIX = "objetos"
+
+def content_addressed_key(sha256: str, original_filename: Optional[str]) -> str:
+    ext = Path(original_filename).suffix.lower() if original_filename else ""
+    return f"{CAS_PREFIX}/{sha256}{ext}"
+
+async def hash_upload_file(file: UploadFile) -> Tuple[str, int]:
+    """Hash an upload in chunks (enforcing MAX_UPLOAD_SIZE) and rewind it"""
+    hasher = hashlib.sha256()
+    size = 0
+    async for chunk in read_upload_chunks(file):
+        await asyncio.to_thread(hasher.update, chunk)
+        size += len(chunk)
+    await file.seek(0)
+    return hasher.hexdigest(), size
+
+# A reference taken for a row that isn't saved yet is released after this
+# long unless the row's transaction commits first (see keep_stored_files)
+UPLOAD_GUARD_SECONDS = int(os.environ.get('UPLOAD_GUARD_SECONDS', '900'))
+
+async def store_content_addressed(key: str, sha256: str, size: int, content_type: str, write_object, guarded: bool = False) -> Optional[str]:
+    """Take a reference on a content-addressed key and write it if missing.
+    
+    The reference is taken first so a concurrent delete of the last reference
+    (which holds the row lock while deleting) can't remove the object after we
+    decided to reuse it. On failure the reference is released again.
+    
+    With guarded, a deletion entry due in UPLOAD_GUARD_SECONDS is committed
+    together with the reference and its id returned: the caller keeps the
+    reference by deleting that entry (keep_stored_files) in the transaction
+    that saves the path, so it is released if that transaction never commits.
+    """
+    now = datetime.now(timezone.utc)
+    stmt = pg_insert(StorageObjectDB).values(
+        key=key, sha256=sha256, size=size, content_type=content_type,
+        ref_count=1, created_at=now, updated_at=now
+    ).on_conflict_do_update(
+        index_elements=[StorageObjectDB.key],
+        set_={"ref_count": StorageObjectDB.ref_count + 1, "updated_at": now}
+    )
+    guard_id = None
+    async with async_session() as session:
+        await session.execute(stmt)
+        if guarded:
+            guard = StorageDeletionDB(file_path=key, next_attempt_at=now + timedelta(seconds=UPLOAD_GUARD_SECONDS))
+            session.add(guard)
+            await session.flush()
+            guard_id = guard.id
+        await session.commit()
+    
+    try:
+        if await storage.exists(key):
+            logging.info(f"Duplicate content, reusing stored object: {key}")
+        else:
+            await write_object()
+    except BaseException:
+        await delete_r2_file(key, guard_id)
+        raise
+    await enqueue_preview(key)
+    return guard_id
+
+async def keep_stored_files(session: AsyncSession, guard_ids: List[Optional[str]]):
+    """Keep the references of guarded stores once session commits"""
+    guard_ids = [guard_id for guard_id in guard_ids if guard_id]
+    if not guard_ids:
+        return
+    result = await session.execute(delete(StorageDeletionDB).where(StorageDeletionDB.id.in_(guard_ids)))
+    if result.rowcount != len(guard_ids):
+        # The guard was already processed: the reference is gone
+        raise HTTPException(status_code=500, detail="La subida expiró antes de guardarse, intente nuevamente")
+
+def upload_too_large_error() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"El archivo excede el tamaño máximo de {MAX_UPLOAD_SIZE_MB} MB")
+
+async def read_upload_chunks(file: UploadFile):
+    """Yield the uploaded file in UPLOAD_CHUNK_SIZE chunks, enforcing MAX_UPLOAD_SIZE"""
+    total = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_UPLOAD_SIZE:
+            raise upload_too_large_error()
+        yield chunk
+
+# Presigned download URLs are cached per key and reused until
+# PRESIGNED_URL_REUSE_FRACTION of their lifetime has passed, so the redirect
+# still has plenty of validity left when a browser or proxy caches it.
+PRESIGNED_URL_EXPIRATION = int(os.environ.get('PRESIGNED_URL_EXPIRATION', '3600'))
+PRESIGNED_URL_CACHE_SIZE = int(os.environ.get('PRESIGNED_URL_CACHE_SIZE', '5000'))
+PRESIGNED_URL_REUSE_FRACTION = 0.8
+
+class PresignedUrlCache:
+    """LRU cache of presigned GET URLs keyed by storage key"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[Tuple[str, int]]:
+        """Return (url, seconds it can still be reused) or None if missing/stale"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        url, reuse_until = entry
+        remaining = int(reuse_until - time.monotonic())
+        if remaining <= 0:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return url, remaining
+    
+    def put(self, key: str, url: str, lifetime: int):
+        self._entries[key] = (url, time.monotonic() + lifetime * PRESIGNED_URL_REUSE_FRACTION)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+presigned_url_cache = PresignedUrlCache(PRESIGNED_URL_CACHE_SIZE)
+
+async def get_r2_presigned_download(key: str) -> Tuple[Optional[str], int]:
+    """Return a (possibly cached) presigned URL and how long it may be cached"""
+    if not storage.supports_presigned_urls:
+        return None, 0
+    key = key_from_path(key)
+    cached = presigned_url_cache.get(key)
+    if cached:
+        return cached
+    try:
+        url = await storage.presigned_get_url(key, PRESIGNED_URL_EXPIRATION)
+    except Exception as e:
+        logging.error(f"Error generating presigned URL: {e}")
+        return None, 0
+    presigned_url_cache.put(key, url, PRESIGNED_URL_EXPIRATION)
+    return url, int(PRESIGNED_URL_EXPIRATION * PRESIGNED_URL_REUSE_FRACTION)
+
+async def get_r2_presigned_url(key: str, expiration: int = PRESIGNED_URL_EXPIRATION) -> str:
     """Generate a presigned URL for R2 file access"""
-    if not r2_client:
+    if not storage.supports_presigned_urls:
         return None
-    try:
-        if key.startswith("r2://"):
-            key = key[5:]
-        url = r2_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': R2_BUCKET_NAME, 'Key': key},
-            ExpiresIn=expiration
-        )
+    if expiration == PRESIGNED_URL_EXPIRATION:
+        url, _ = await get_r2_presigned_download(key)
         return url
+    try:
+        return await storage.presigned_get_url(key_from_path(key), expiration)
     except Exception as e:
         logging.error(f"Error generating presigned URL: {e}")
         return None
 
-def delete_r2_file(file_path: str) -> bool:
-    """Delete a file from R2 storage"""
-    if not file_path:
-        print(f"[R2 DELETE] Skipped - empty file path")
-        return True
+async def delete_r2_file(file_path: str, guard_id: Optional[str] = None) -> bool:
+    """Release a stored file, deleting it from storage with its last reference.
     
+    If the reference was released but the object couldn't be deleted, the
+    deletion is queued in the outbox, in the same transaction, to be retried
+    without releasing the reference again. For a reference taken with a guard
+    entry (store_content_addressed), the entry is deleted in that transaction
+    too; if the worker already processed it the reference is gone and is not
+    released again.
+    """
     try:
-        # Extract the key from the path
-        if file_path.startswith("r2://"):
-            key = file_path[5:]
-        else:
-            key = file_path
-        
-        if r2_client:
-            print(f"[R2 DELETE] Deleting from R2: {key}")
-            r2_client.delete_object(Bucket=R2_BUCKET_NAME, Key=key)
-            print(f"[R2 DELETE] SUCCESS - Deleted: {key}")
-            logging.info(f"Deleted file from R2: {key}")
-            return True
-        else:
-            # Local storage fallback
-            local_path = UPLOADS_DIR / key
-            print(f"[R2 DELETE] Local mode - Deleting: {local_path}")
-            if local_path.exists():
-                local_path.unlink()
-                print(f"[R2 DELETE] SUCCESS - Deleted local: {local_path}")
-                logging.info(f"Deleted local file: {local_path}")
-            else:
-                print(f"[R2 DELETE] File not found locally: {local_path}")
-            return True
+        async with async_session() as session:
+            if guard_id is not None:
+                result = await session.execute(delete(StorageDeletionDB).where(StorageDeletionDB.id == guard_id))
+                if result.rowcount == 0:
+                    return True
+            done, released = await release_stored_file(session, file_path)
+            if not done and released:
+                session.add(StorageDeletionDB(
+                    file_path=file_path, attempts=1, reference_released=True,
+                    next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=STORAGE_DELETION_BACKOFF_SECONDS)
+                ))
+            await session.commit()
+            return done
     except Exception as e:
         print(f"[R2 DELETE] ERROR deleting {file_path}: {e}")
         logging.error(f"Error deleting file {file_path}: {e}")
         return False
 
-def delete_multiple_r2_files(file_paths: List[str]) -> bool:
-    """Delete multiple files from R2 storage"""
-    if not file_paths:
-        return True
+async def release_stored_file(session: AsyncSession, file_path: str, reference_released: bool = False) -> Tuple[bool, bool]:
+    """Release one reference to a stored file and delete the object with the last one.
+    
+    Runs in the caller's transaction, which must commit it together with
+    whatever records the release (the outbox row), so a reference is never
+    released twice. Content-addressed objects are only removed when their
+    reference count drops to zero; the row stays locked while the object is
+    deleted so a concurrent upload of the same content waits and re-uploads
+    it. Keys without a reference row (older uploads) are deleted directly.
+    
+    Returns (done, released). released is True once the reference is given
+    up, even if deleting the object failed (the row is then kept with
+    ref_count 0). Retries must pass reference_released=True: by then the
+    same content may have been uploaded again (ref_count back above 0), and
+    the object must be kept instead of losing another reference.
+    """
+    if not file_path:
+        print(f"[R2 DELETE] Skipped - empty file path")
+        return True, True
+    
+    key = storage_key_from_path(file_path)
+    result = await session.execute(
+        select(StorageObjectDB).where(StorageObjectDB.key == key).with_for_update()
+    )
+    obj = result.scalar_one_or_none()
+    if reference_released:
+        if obj is not None and obj.ref_count > 0:
+            print(f"[R2 DELETE] Kept {key}: uploaded again since its reference was released")
+            return True, True
+    elif obj is not None and obj.ref_count > 1:
+        obj.ref_count -= 1
+        obj.updated_at = datetime.now(timezone.utc)
+        print(f"[R2 DELETE] Kept shared object {key} ({obj.ref_count} references left)")
+        return True, True
     
-    success = True
+    deleted = await delete_storage_object(key)
+    if deleted:
+        await delete_file_previews(session, key)
+    if obj is not None:
+        if deleted:
+            await session.delete(obj)
+        else:
+            obj.ref_count = 0
+            obj.updated_at = datetime.now(timezone.utc)
+    return deleted, True
+
+async def delete_storage_object(key: str) -> bool:
+    """Delete an object from storage regardless of references"""
+    try:
+        presigned_url_cache.invalidate(key)
+        print(f"[R2 DELETE] Deleting from {storage.name} storage: {key}")
+        await storage.delete(key)
+        print(f"[R2 DELETE] SUCCESS - Deleted: {key}")
+        logging.info(f"Deleted file from {storage.name} storage: {key}")
+        return True
+    except Exception as e:
+        print(f"[R2 DELETE] ERROR deleting {key}: {e}")
+        logging.error(f"Error deleting file {key}: {e}")
+        return False
+
+# ============ STORAGE DELETION OUTBOX ============
+# Handlers don't delete files inline: schedule_file_deletion adds outbox rows
+# to the caller's session, so the deletion commits (or rolls back) together
+# with the row change. After commit the worker is woken and deletes them in
+# batches, retrying failures with exponential backoff.
+
+STORAGE_DELETION_BATCH_SIZE = int(os.environ.get('STORAGE_DELETION_BATCH_SIZE', '100'))
+STORAGE_DELETION_POLL_SECONDS = float(os.environ.get('STORAGE_DELETION_POLL_SECONDS', '30'))
+STORAGE_DELETION_MAX_ATTEMPTS = int(os.environ.get('STORAGE_DELETION_MAX_ATTEMPTS', '10'))
+STORAGE_DELETION_BACKOFF_SECONDS = 5
+# Deletions of a batch run at the same time; each uses its own pooled
+# connection, so keep this well below DB_POOL_SIZE
+STORAGE_DELETION_CONCURRENCY = int(os.environ.get('STORAGE_DELETION_CONCURRENCY', '4'))
+STORAGE_DELETION_MAX_BACKOFF_SECONDS = 3600
+
+storage_deletion_wakeup = asyncio.Event()
+
+def schedule_file_deletion(session: AsyncSession, *file_paths: Optional[str]):
+    """Queue stored files for deletion when session commits"""
+    now = datetime.now(timezone.utc)
     for file_path in file_paths:
-        if not delete_r2_file(file_path):
-            success = False
-    return success
+        if file_path:
+            session.add(StorageDeletionDB(file_path=file_path, next_attempt_at=now))
+            session.info["storage_deletions_pending"] = True
+
+@event.listens_for(Session, "after_commit")
+def _wake_storage_deletion_worker(session):
+    if session.info.pop("storage_deletions_pending", False):
+        storage_deletion_wakeup.set()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_storage_deletion_wakeup(session):
+    session.info.pop("storage_deletions_pending", None)
+
+async def process_storage_deletions() -> int:
+    """Delete one batch of due outbox entries. Returns how many were claimed.
+    
+    Each entry is processed in its own transaction (at most
+    STORAGE_DELETION_CONCURRENCY at a time): it is claimed with FOR UPDATE
+    SKIP LOCKED, so several workers (or app instances) never process the same
+    deletion twice, and the reference is released in the transaction that
+    deletes or reschedules the entry.
+    """
+    now = datetime.now(timezone.utc)
+    async with async_session() as session:
+        result = await session.execute(
+            select(StorageDeletionDB.id)
+            .where(StorageDeletionDB.next_attempt_at <= now)
+            .order_by(StorageDeletionDB.next_attempt_at)
+            .limit(STORAGE_DELETION_BATCH_SIZE)
+        )
+        entry_ids = result.scalars().all()
+    if not entry_ids:
+        return 0
+    
+    slots = asyncio.Semaphore(STORAGE_DELETION_CONCURRENCY)
+    
+    async def process(entry_id: str) -> bool:
+        async with slots:
+            return await process_storage_deletion(entry_id, now)
+    
+    return sum(await asyncio.gather(*(process(entry_id) for entry_id in entry_ids)))
+
+async def process_storage_deletion(entry_id: str, now: datetime) -> bool:
+    """Claim and process one due outbox entry. Returns False if another
+    worker has it or it is no longer due."""
+    async with async_session() as session:
+        result = await session.execute(
+            select(StorageDeletionDB)
+            .where(StorageDeletionDB.id == entry_id, StorageDeletionDB.next_attempt_at <= now)
+            .with_for_update(skip_locked=True)
+        )
+        entry = result.scalar_one_or_none()
+        if entry is None:
+            return False
+        try:
+            deleted, released = await release_stored_file(session, entry.file_path, entry.reference_released)
+        except Exception as e:
+            logging.error(f"Error deleting file {entry.file_path}: {e}")
+            await session.rollback()
+            entry = await session.get(StorageDeletionDB, entry_id, with_for_update=True)
+            if entry is None:
+                return True
+            deleted, released = False, entry.reference_released
+        if deleted:
+            await session.delete(entry)
+            await session.commit()
+            return True
+        entry.reference_released = released
+        entry.attempts += 1
+        entry.last_error = "delete failed"
+        if entry.attempts >= STORAGE_DELETION_MAX_ATTEMPTS:
+            # gc-storage picks up whatever is left behind
+            logging.error(f"Giving up deleting {entry.file_path} after {entry.attempts} attempts")
+            await session.delete(entry)
+        else:
+            backoff = min(STORAGE_DELETION_BACKOFF_SECONDS * 2 ** (entry.attempts - 1), STORAGE_DELETION_MAX_BACKOFF_SECONDS)
+            entry.next_attempt_at = now + timedelta(seconds=backoff)
+        await session.commit()
+        return True
+
+async def storage_deletion_worker():
+    """Background task: process the outbox when woken after a commit, and
+    periodically for retries that became due."""
+    while True:
+        try:
+            while await process_storage_deletions() >= STORAGE_DELETION_BATCH_SIZE:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Storage deletion worker error: {e}")
+        try:
+            await asyncio.wait_for(storage_deletion_wakeup.wait(), timeout=STORAGE_DELETION_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        storage_deletion_wakeup.clear()
+
+# ============ FILE PREVIEWS ============
+# Uploaded PDFs (first page) and images get WebP previews so the UI can show
+# what a file is without downloading it. Previews are rendered by a background
+# worker and stored next to the original as <key>.<variant>.webp; since keys
+# are content-addressed they never change and are served with immutable
+# caching.
+
+PREVIEW_VARIANTS = {"thumb": 320, "medium": 1024}  # variant -> longest side in px
+PREVIEW_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+PREVIEW_MAX_SOURCE_SIZE = int(os.environ.get('PREVIEW_MAX_SOURCE_MB', '50')) * 1024 * 1024
+PREVIEW_BATCH_SIZE = int(os.environ.get('PREVIEW_BATCH_SIZE', '4'))
+PREVIEW_MAX_ATTEMPTS = 3
+# A row EN_PROCESO for this long belongs to a worker that stopped
+PREVIEW_STALE_SECONDS = 300
+PREVIEW_POLL_SECONDS = 60
+PREVIEW_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+preview_wakeup = asyncio.Event()
+
+def preview_supported(key: str) -> bool:
+    ext = Path(key).suffix.lower()
+    if ext == ".pdf":
+        return pdfium is not None
+    return ext in PREVIEW_IMAGE_EXTENSIONS
+
+def render_previews(data: bytes, ext: str) -> dict:
+    """Render every PREVIEW_VARIANTS size as WebP bytes (runs in a thread)"""
+    largest = max(PREVIEW_VARIANTS.values())
+    if ext == ".pdf":
+        with pdfium_lock:
+            pdf = pdfium.PdfDocument(data)
+            try:
+                page = pdf[0]
+                width, height = page.get_size()
+                image = page.render(scale=largest / max(width, height)).to_pil()
+            finally:
+                pdf.close()
+    else:
+        image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    
+    previews = {}
+    for variant, max_side in PREVIEW_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, "WEBP", quality=80, method=4)
+        previews[variant] = buffer.getvalue()
+    return previews
+
+async def enqueue_preview(file_path: str):
+    """Queue preview generation for a stored file if it is a PDF or image"""
+    key = storage_key_from_path(file_path)
+    if not preview_supported(key):
+        return
+    async with async_session() as session:
+        await session.execute(
+            pg_insert(FilePreviewDB).values(source_key=key, estado="PENDIENTE")
+            .on_conflict_do_nothing(index_elements=[FilePreviewDB.source_key])
+        )
+        await session.commit()
+    preview_wakeup.set()
+
+async def claim_previews() -> List[FilePreviewDB]:
+    """Mark a batch of queued rows EN_PROCESO and commit, so they are rendered
+    outside any transaction. Rows left EN_PROCESO by a worker that stopped
+    are claimed again after PREVIEW_STALE_SECONDS; every claim counts as an
+    attempt."""
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=PREVIEW_STALE_SECONDS)
+    async with async_session() as session:
+        result = await session.execute(
+            select(FilePreviewDB)
+            .where(
+                (FilePreviewDB.estado == "PENDIENTE")
+                | ((FilePreviewDB.estado == "EN_PROCESO") & (FilePreviewDB.updated_at < stale))
+            )
+            .order_by(FilePreviewDB.created_at)
+            .limit(PREVIEW_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        items = result.scalars().all()
+        for item in items:
+            item.estado = "EN_PROCESO"
+            item.attempts += 1
+            item.updated_at = now
+        await session.commit()
+        return items
+
+async def generate_preview(key: str) -> dict:
+    """Render and store the previews of a source object; returns the values
+    to record on its row"""
+    size = await storage.size(key)
+    if size is None or size > PREVIEW_MAX_SOURCE_SIZE:
+        return {"estado": "OMITIDO"}
+    data = await storage.get_bytes(key)
+    previews = await asyncio.to_thread(render_previews, data, Path(key).suffix.lower())
+    paths = {}
+    for variant, content in previews.items():
+        preview_key = f"{key}.{variant}.webp"
+        await storage.put_bytes(preview_key, content, "image/webp", cache_control=PREVIEW_CACHE_CONTROL)
+        paths[variant] = storage.to_path(preview_key)
+    return {"estado": "LISTO", "thumb_path": paths["thumb"], "medium_path": paths["medium"], "last_error": None}
+
+async def finish_preview(key: str, values: dict):
+    """Record the outcome on a claimed row. If the source was deleted while
+    rendering (its row is gone), the previews just stored are deleted too."""
+    async with async_session() as session:
+        result = await session.execute(
+            update(FilePreviewDB)
+            .where(FilePreviewDB.source_key == key, FilePreviewDB.estado == "EN_PROCESO")
+            .values(**values, updated_at=datetime.now(timezone.utc))
+        )
+        # Not updated but still there: another worker claimed it after it went stale
+        removed = result.rowcount == 0 and await session.get(FilePreviewDB, key) is None
+        await session.commit()
+    if removed:
+        orphans = [storage_key_from_path(values[attr]) for attr in ("thumb_path", "medium_path") if values.get(attr)]
+        if orphans and await storage.delete_many(orphans):
+            logging.error(f"Error deleting previews of removed file {key}")
+
+async def process_previews() -> int:
+    """Generate previews for one batch of queued rows. Returns how many were claimed"""
+    items = await claim_previews()
+    for item in items:
+        try:
+            values = await generate_preview(item.source_key)
+        except Exception as e:
+            logging.error(f"Error generating preview for {item.source_key}: {e}")
+            values = {
+                "estado": "ERROR" if item.attempts >= PREVIEW_MAX_ATTEMPTS else "PENDIENTE",
+                "last_error": str(e)[:1000],
+            }
+        await finish_preview(item.source_key, values)
+    return len(items)
+
+async def preview_worker():
+    """Background task: render queued previews when woken, polling as a fallback"""
+    while True:
+        try:
+            while await process_previews() >= PREVIEW_BATCH_SIZE:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Preview worker error: {e}")
+        try:
+            await asyncio.wait_for(preview_wakeup.wait(), timeout=PREVIEW_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        preview_wakeup.clear()
+
+async def delete_file_previews(session: AsyncSession, key: str):
+    """Delete the previews of a source object that is being removed from storage"""
+    result = await session.execute(select(FilePreviewDB).where(FilePreviewDB.source_key == key))
+    item = result.scalar_one_or_none()
+    if item is None:
+        return
+    preview_keys = [storage_key_from_path(p) for p in (item.thumb_path, item.medium_path) if p]
+    for preview_key in preview_keys:
+        presigned_url_cache.invalidate(preview_key)
+    failed = await storage.delete_many(preview_keys)
+    if failed:
+        logging.error(f"Error deleting previews {failed}")
+    await session.delete(item)
+
+async def load_previews(session: AsyncSession, file_paths) -> dict:
+    """Map stored file paths to their ready previews: {path: {"thumb": path, "medium": path}}"""
+    keys = {storage_key_from_path(p): p for p in file_paths if p}
+    if not keys:
+        return {}
+    result = await session.execute(
+        select(FilePreviewDB)
+        .where(FilePreviewDB.source_key.in_(keys.keys()), FilePreviewDB.estado == "LISTO")
+    )
+    return {
+        keys[item.source_key]: {"thumb": item.thumb_path, "medium": item.medium_path}
+        for item in result.scalars().all()
+    }
+
+# ============ JOBS ============
+# Long operations (e.g. regenerating every checklist) are queued in the jobs
+# table and run by a job worker: in the app process (JOBS_IN_PROCESS) and/or
+# `python manage.py worker`. Jobs are claimed with FOR UPDATE SKIP LOCKED;
+# a running job refreshes heartbeat_at, and one whose heartbeat goes stale
+# (its worker died) is claimed again, up to JOB_MAX_ATTEMPTS times.
+
+JOBS_IN_PROCESS = os.environ.get('JOBS_IN_PROCESS', 'true').lower() in ('1', 'true', 'yes')
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '5'))
+JOB_HEARTBEAT_SECONDS = 30
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '300'))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+JOB_ACTIVE_STATES = ("PENDIENTE", "EN_PROCESO")
+
+# tipo -> async handler(params, progress) returning a JSON-serializable result;
+# progress(actual, total) is awaited to report progress
+JOB_HANDLERS: dict = {}
+
+job_wakeup = asyncio.Event()
+
+def serialize_job(job: JobDB) -> dict:
+    return {
+        "id": job.id,
+        "tipo": job.tipo,
+        "estado": job.estado,
+        "progreso_actual": job.progreso_actual,
+        "progreso_total": job.progreso_total,
+        "resultado": json.loads(job.resultado) if job.resultado else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+async def enqueue_job(tipo: str, params: Optional[dict] = None, usuario_id: Optional[str] = None,
+                      reuse_running: bool = True) -> Tuple[JobDB, bool]:
+    """Queue a job, or return an equal one (same type and params) that is
+    still pending, or already running if reuse_running. Returns (job, created)."""
+    params_json = json.dumps(params, ensure_ascii=False, default=str, sort_keys=True) if params else None
+    states = JOB_ACTIVE_STATES if reuse_running else ("PENDIENTE",)
+    async with async_session() as session:
+        # Serializes concurrent enqueues of the same type
+        await session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:tipo))"), {"tipo": f"job:{tipo}"})
+        result = await session.execute(
+            select(JobDB).where(
+                JobDB.tipo == tipo, JobDB.estado.in_(states),
+                JobDB.params == params_json if params_json else JobDB.params.is_(None)
+            ).limit(1)
+        )
+        existing = result.scalar_one_or_none()
+        if existing is not None:
+            return existing, False
+        job = JobDB(tipo=tipo, estado="PENDIENTE", usuario_id=usuario_id, params=params_json)
+        session.add(job)
+        await session.commit()
+    job_wakeup.set()
+    return job, True
+
+async def claim_job() -> Optional[JobDB]:
+    """Claim the oldest pending job, or a running one whose worker stopped
+    sending heartbeats. Jobs out of attempts are failed instead."""
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=JOB_STALE_SECONDS)
+    async with async_session() as session:
+        while True:
+            result = await session.execute(
+                select(JobDB)
+                .where((JobDB.estado == "PENDIENTE") | ((JobDB.estado == "EN_PROCESO") & (JobDB.heartbeat_at < stale)))
+                .order_by(JobDB.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalar_one_or_none()
+            if job is None:
+                return None
+            if job.attempts >= JOB_MAX_ATTEMPTS:
+                logging.error(f"Job {job.id} ({job.tipo}) interrupted {job.attempts} times, giving up")
+                job.estado = "ERROR"
+                job.error = "El proceso se interrumpió demasiadas veces"
+                job.finished_at = now
+                await session.commit()
+                continue
+            job.estado = "EN_PROCESO"
+            job.attempts += 1
+            job.started_at = now
+            job.heartbeat_at = now
+            await session.commit()
+            return job
+
+async def update_job(job_id: str, **values):
+    async with async_session() as session:
+        await session.execute(update(JobDB).where(JobDB.id == job_id).values(**values))
+        await session.commit()
+
+async def run_job(job: JobDB):
+    """Run a claimed job with its handler, recording progress and outcome"""
+    handler = JOB_HANDLERS.get(job.tipo)
+    if handler is None:
+        await update_job(job.id, estado="ERROR", error=f"Tipo de trabajo desconocido: {job.tipo}",
+                         finished_at=datetime.now(timezone.utc))
+        return
+    
+    async def progress(actual: int, total: int):
+        await update_job(job.id, progreso_actual=actual, progreso_total=total,
+                         heartbeat_at=datetime.now(timezone.utc))
+    
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            await update_job(job.id, heartbeat_at=datetime.now(timezone.utc))
+    
+    logging.info(f"Running job {job.id} ({job.tipo})")
+    beating = asyncio.create_task(heartbeat())
+    try:
+        params = json.loads(job.params) if job.params else {}
+        resultado = await handler(params, progress)
+    except asyncio.CancelledError:
+        # Worker shutting down: leave it EN_PROCESO so it's claimed again once stale
+        raise
+    except Exception as e:
+        logging.error(f"Job {job.id} ({job.tipo}) failed: {e}")
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        await update_job(job.id, estado="ERROR", error=detail, finished_at=datetime.now(timezone.utc))
+    else:
+        await update_job(job.id, estado="COMPLETADO", finished_at=datetime.now(timezone.utc),
+                         resultado=json.dumps(resultado, ensure_ascii=False, default=str))
+    finally:
+        beating.cancel()
+
+async def prune_jobs():
+    """Delete finished jobs older than JOB_RETENTION_DAYS"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=JOB_RETENTION_DAYS)
+    async with async_session() as session:
+        await session.execute(delete(JobDB).where(JobDB.finished_at < cutoff))
+        await session.commit()
+
+async def job_worker():
+    """Run queued jobs one at a time; wakes up on enqueue (same process) or
+    every JOB_POLL_SECONDS."""
+    last_prune = 0.0
+    while True:
+        try:
+            while (job := await claim_job()) is not None:
+                await run_job(job)
+            if time.monotonic() - last_prune > 3600:
+                await prune_jobs()
+                last_prune = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Job worker error: {e}")
+        try:
+            await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        job_wakeup.clear()
 
 # ============ Helper Functions ============
 
@@ -905,27 +1761,449 @@ async def delete_usuario(user_id: str, current_user: UsuarioDB = Depends(get_adm
         await session.commit()
         return {"message": "Usuario eliminado"}
 
+# ============ ADMIN ============
+
+@api_router.get("/admin/db-pool")
+async def get_db_pool_status(current_user: UsuarioDB = Depends(get_admin_user)):
+    """Database pool occupancy (checked out, idle, overflow), settings and
+    checkout wait times and timeouts since the process started"""
+    return pool_status(engine.pool)
+
+# ============ LOCAL FILE SERVING ============
+
+# Stored filenames are unique (UUID suffix) or content-addressed, so a given
+# URL never changes content and can be cached forever.
+LOCAL_FILE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+LOCAL_FILE_CHUNK_SIZE = 256 * 1024
+SHA256_NAME_RE = re.compile(r"^[0-9a-f]{64}$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def local_file_etag(file_path: Path, stat_result: os.stat_result) -> str:
+    """Strong ETag: the content hash for content-addressed objects,
+    otherwise size and mtime (filenames are never reused)."""
+    if file_path.parent.name == CAS_PREFIX and SHA256_NAME_RE.match(file_path.stem):
+        return f'"{file_path.stem}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single "bytes=start-end" range into (start, end) inclusive.
+    
+    Returns None for headers we don't handle (multiple ranges, other units)
+    so the full file is sent instead. Raises ValueError if unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+class LocalFileResponse(Response):
+    """File response for local storage with ETag/304, single Range requests
+    and a zero-copy path when the ASGI server supports it."""
+    
+    def __init__(self, file_path: Path, request: Request):
+        stat_result = file_path.stat()
+        size = stat_result.st_size
+        etag = local_file_etag(file_path, stat_result)
+        media_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+        super().__init__(status_code=200, media_type=media_type)
+        self.path = file_path
+        self.offset = 0
+        self.count = size
+        self.send_body = request.method != "HEAD"
+        
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["cache-control"] = LOCAL_FILE_CACHE_CONTROL
+        self.headers["accept-ranges"] = "bytes"
+        
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and self._etag_matches(if_none_match, etag):
+            self.status_code = 304
+            self.count = 0
+            del self.headers["content-type"]
+            return
+        
+        range_header = request.headers.get("range")
+        if range_header and self._if_range_allows(request.headers.get("if-range"), etag, stat_result):
+            try:
+                byte_range = parse_byte_range(range_header, size)
+            except ValueError:
+                self.status_code = 416
+                self.count = 0
+                self.headers["content-range"] = f"bytes */{size}"
+                self.headers["content-length"] = "0"
+                return
+            if byte_range:
+                start, end = byte_range
+                self.status_code = 206
+                self.offset = start
+                self.count = end - start + 1
+                self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(self.count)
+    
+    @staticmethod
+    def _etag_matches(header: str, etag: str) -> bool:
+        candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+        return "*" in candidates or etag in candidates
+    
+    @staticmethod
+    def _if_range_allows(if_range: Optional[str], etag: str, stat_result: os.stat_result) -> bool:
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == etag
+        try:
+            return parsedate_to_datetime(if_range).timestamp() >= int(stat_result.st_mtime)
+        except (TypeError, ValueError):
+            return False
+    
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        zerocopy = "http.response.zerocopy" in scope.get("extensions", {})
+        async with await anyio.open_file(self.path, "rb") as file:
+            if zerocopy:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file.wrapped,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+            await file.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await file.read(min(LOCAL_FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
 # ============ FILE ROUTES ============
 
+UPLOAD_CATEGORIES = ["costos", "patrones", "imagenes", "fichas", "tizados", "fichas_bases", "tizados_bases", "fichas_modelos"]
+
 @api_router.post("/upload/{category}")
 async def upload_file(category: str, file: UploadFile = File(...), custom_name: str = Form(None)):
-    allowed_categories = ["costos", "patrones", "imagenes", "fichas", "tizados", "fichas_bases", "tizados_bases", "fichas_modelos"]
-    if category not in allowed_categories:
+    if category not in UPLOAD_CATEGORIES:
         raise HTTPException(status_code=400, detail="Categoría no válida")
     file_path = await save_upload_file(file, category, custom_name)
     return {"file_path": file_path, "filename": file.filename}
 
-@api_router.get("/files/{category}/{filename}")
-async def get_file(category: str, filename: str):
+# ============ DIRECT UPLOADS (presigned PUT to R2) ============
+
+PRESIGNED_UPLOAD_EXPIRATION = int(os.environ.get('PRESIGNED_UPLOAD_EXPIRATION', '3600'))
+
+# (entidad, campo) -> (model, storage category, file attribute, display-name attribute)
+# Fields with a display-name attribute are arrays that get appended to; the
+# rest hold a single file that gets replaced.
+UPLOAD_TARGETS = {
+    ("base", "patron"): (BaseDB, "patrones", "patron_archivo", None),
+    ("base", "fichas"): (BaseDB, "fichas_bases", "fichas_archivos", "fichas_nombres"),
+    ("base", "tizados"): (BaseDB, "tizados_bases", "tizados_archivos", "tizados_nombres"),
+    ("modelo", "fichas"): (ModeloDB, "fichas_modelos", "fichas_archivos", "fichas_nombres"),
+    ("muestra_base", "costos"): (MuestraBaseDB, "costos", "archivo_costos", None),
+    ("ficha", "archivo"): (FichaDB, "fichas", "archivo", None),
+    ("tizado", "archivo"): (TizadoDB, "tizados", "archivo_tizado", None),
+}
+
+class UploadIntentRequest(BaseModel):
+    entidad: str
+    entidad_id: str
+    campo: str
+    filename: str
+    size: int
+    sha256: str  # hex digest of the content, computed by the browser
+    content_type: Optional[str] = None
+    custom_name: Optional[str] = None
+
+class UploadCompletePart(BaseModel):
+    part_number: int
+    etag: str
+
+class UploadCompleteRequest(BaseModel):
+    upload_token: str
+    parts: List[UploadCompletePart] = []
+
+def get_upload_target(entidad: str, campo: str):
+    target = UPLOAD_TARGETS.get((entidad, campo))
+    if not target:
+        raise HTTPException(status_code=400, detail="Destino de subida no válido")
+    return target
+
+@api_router.post("/uploads/intent")
+async def create_upload_intent(data: UploadIntentRequest, current_user: UsuarioDB = Depends(get_current_user)):
+    """Return presigned PUT URLs so the browser uploads straight to R2.
+    
+    Uploads are content-addressed like the multipart/form-data ones: the key
+    is objetos/<sha256><ext> for the hash the browser declares. Content that
+    is already stored gets stored=True and nothing to upload; the single PUT
+    URL only accepts content with that hash. Files larger than one chunk get
+    a multipart plan with one presigned URL per part. When R2 is not
+    configured the response has direct=False and the client should use the
+    regular multipart/form-data endpoints instead.
+    """
+    model, category, _, _ = get_upload_target(data.entidad, data.campo)
+    if not storage.supports_presigned_urls:
+        return {"direct": False}
+    if data.size <= 0:
+        raise HTTPException(status_code=400, detail="Tamaño de archivo inválido")
+    if data.size > MAX_UPLOAD_SIZE:
+        raise upload_too_large_error()
+    sha256 = data.sha256.lower()
+    if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+        raise HTTPException(status_code=400, detail="Hash SHA-256 inválido")
+    
+    key = content_addressed_key(sha256, data.filename)
+    async with async_session() as session:
+        result = await session.execute(select(model.id).where(model.id == data.entidad_id))
+        if result.scalar_one_or_none() is None:
+            raise HTTPException(status_code=404, detail="No encontrado")
+        ref_count = await session.scalar(select(StorageObjectDB.ref_count).where(StorageObjectDB.key == key))
+    
+    content_type = data.content_type or 'application/octet-stream'
+    token_data = {
+        "typ": "upload",
+        "key": key,
+        "sha256": sha256,
+        "entidad": data.entidad,
+        "entidad_id": data.entidad_id,
+        "campo": data.campo,
+        "size": data.size,
+        "content_type": content_type,
+        "nombre": data.custom_name or data.filename,
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=PRESIGNED_UPLOAD_EXPIRATION),
+    }
+    response = {"direct": True, "file_path": storage.to_path(key), "expires_in": PRESIGNED_UPLOAD_EXPIRATION}
+    
+    if ref_count:
+        logging.info(f"Duplicate content, skipping direct upload: {key}")
+        response["stored"] = True
+    elif data.size <= UPLOAD_CHUNK_SIZE:
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        response["url"] = await storage.presigned_put_url(key, content_type, PRESIGNED_UPLOAD_EXPIRATION, checksum)
+        response["headers"] = {"Content-Type": content_type, "x-amz-checksum-sha256": checksum}
+    else:
+        upload_id = await storage.create_multipart_upload(key, content_type)
+        token_data["upload_id"] = upload_id
+        part_count = (data.size + UPLOAD_CHUNK_SIZE - 1) // UPLOAD_CHUNK_SIZE
+        response["upload_id"] = upload_id
+        response["part_size"] = UPLOAD_CHUNK_SIZE
+        response["parts"] = [
+            {
+                "part_number": part_number,
+                "url": await storage.presigned_part_url(key, upload_id, part_number, PRESIGNED_UPLOAD_EXPIRATION),
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+    
+    response["upload_token"] = jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
+    return response
+
+@api_router.post("/uploads/complete")
+async def complete_upload(data: UploadCompleteRequest, current_user: UsuarioDB = Depends(get_current_user)):
+    """Verify a direct upload landed in R2 and attach it to its entity
+    
+    The reference on the content-addressed object is taken in the transaction
+    that attaches it, and its row stays locked until then, so the object
+    can't be deleted in between and concurrent completes of the same content
+    are serialized.
+    """
+    if not storage.supports_presigned_urls:
+        raise HTTPException(status_code=400, detail="Subida directa no disponible")
+    try:
+        token = jwt.decode(data.upload_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=400, detail="Token de subida inválido o expirado")
+    if token.get("typ") != "upload" or not token.get("sha256"):
+        raise HTTPException(status_code=400, detail="Token de subida inválido o expirado")
+    
+    key = token["key"]
+    model, _, archivo_attr, nombres_attr = get_upload_target(token["entidad"], token["campo"])
+    file_path = storage.to_path(key)
+    nombre = token["nombre"]
+    async with async_session() as session:
+        result = await session.execute(select(model).where(model.id == token["entidad_id"]))
+        item = result.scalar_one_or_none()
+        if not item:
+            await abort_direct_upload(token)
+            raise HTTPException(status_code=404, detail="No encontrado")
+        current = getattr(item, archivo_attr)
+        if nombres_attr:
+            attached = any(
+                (archivo, n) == (file_path, nombre)
+                for archivo, n in zip(current or [], getattr(item, nombres_attr) or [])
+            )
+        else:
+            attached = current == file_path
+        if attached:
+            # Token used again: the file is already attached (and must not
+            # be scheduled for deletion as the value it replaces)
+            raise HTTPException(status_code=409, detail="La subida ya fue completada")
+        
+        now = datetime.now(timezone.utc)
+        ref_count = await session.scalar(
+            pg_insert(StorageObjectDB).values(
+                key=key, sha256=token["sha256"], size=token["size"], content_type=token["content_type"],
+                ref_count=1, created_at=now, updated_at=now
+            ).on_conflict_do_update(
+                index_elements=[StorageObjectDB.key],
+                set_={"ref_count": StorageObjectDB.ref_count + 1, "updated_at": now}
+            ).returning(StorageObjectDB.ref_count)
+        )
+        await finish_direct_upload(token, data.parts, first_reference=ref_count == 1)
+        
+        if nombres_attr:
+            setattr(item, archivo_attr, list(current or []) + [file_path])
+            setattr(item, nombres_attr, list(getattr(item, nombres_attr) or []) + [nombre])
+        else:
+            schedule_file_deletion(session, current)
+            setattr(item, archivo_attr, file_path)
+        item.updated_at = now
+        await session.commit()
+    await enqueue_preview(file_path)
+    return {"file_path": file_path, "nombre": nombre}
+
+async def finish_direct_upload(token: dict, parts: List[UploadCompletePart], first_reference: bool):
+    """Make sure the object of a direct upload is stored with the declared content.
+    
+    Objects that already had references were verified when first stored:
+    a pending multipart copy is aborted instead of overwriting them. The
+    first reference verifies size and SHA-256 by reading the object back,
+    deleting it on mismatch (nothing else references it).
+    """
+    key = token["key"]
+    if token.get("upload_id"):
+        if not first_reference and await storage.exists(key):
+            await abort_direct_upload(token)
+        else:
+            parts = sorted(parts, key=lambda p: p.part_number)
+            if not parts:
+                raise HTTPException(status_code=400, detail="Faltan las partes de la subida")
+            try:
+                await storage.complete_multipart_upload(
+                    key, token["upload_id"],
+                    [{'ETag': p.etag, 'PartNumber': p.part_number} for p in parts]
+                )
+            except Exception as e:
+                logging.error(f"Error completing multipart upload {key}: {e}")
+                raise HTTPException(status_code=400, detail="No se pudo completar la subida")
+    
+    try:
+        if not first_reference:
+            stored = await storage.size(key)
+        else:
+            stored = await hash_stored_object(key)
+    except FileNotFoundError:
+        stored = None
+    except Exception as e:
+        logging.error(f"Error checking direct upload {key}: {e}")
+        raise HTTPException(status_code=500, detail="No se pudo verificar la subida")
+    if stored is None:
+        raise HTTPException(status_code=404, detail="El archivo no fue subido")
+    if first_reference and stored != (token["sha256"], token["size"]):
+        await delete_storage_object(key)
+        raise HTTPException(status_code=400, detail="El contenido del archivo no coincide con el declarado")
+
+async def hash_stored_object(key: str) -> Tuple[str, int]:
+    """SHA-256 and size of a stored object, read in chunks"""
+    hasher = hashlib.sha256()
+    size = 0
+    async for chunk in storage.iter_chunks(key, UPLOAD_CHUNK_SIZE):
+        await asyncio.to_thread(hasher.update, chunk)
+        size += len(chunk)
+    return hasher.hexdigest(), size
+
+async def abort_direct_upload(token: dict):
+    """Drop the parts of a multipart direct upload that won't be completed"""
+    if token.get("upload_id"):
+        try:
+            await storage.abort_multipart_upload(token["key"], token["upload_id"])
+        except Exception as e:
+            logging.warning(f"Error aborting multipart upload {token['key']}: {e}")
+
+@api_router.api_route("/files/{category}/{filename}", methods=["GET", "HEAD"])
+async def get_file(category: str, filename: str, request: Request):
     key = f"{category}/{filename}"
-    if r2_client:
-        presigned_url = get_r2_presigned_url(key)
+    if storage.supports_presigned_urls:
+        presigned_url, max_age = await get_r2_presigned_download(key)
         if presigned_url:
-            return RedirectResponse(url=presigned_url)
-    file_path = UPLOADS_DIR / category / filename
-    if not file_path.exists():
+            return RedirectResponse(
+                url=presigned_url,
+                headers={"Cache-Control": f"public, max-age={max_age}"}
+            )
+    try:
+        file_path = storage.local_path(key)
+        if file_path is None:
+            content = await storage.get_bytes(key)
+            media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            return Response(content=content, media_type=media_type)
+    except (StorageError, FileNotFoundError):
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
-    return FileResponse(file_path)
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    return LocalFileResponse(file_path, request)
+
+MAX_PRESIGN_BATCH = 500
+
+class PresignRequest(BaseModel):
+    paths: List[str]
+
+def storage_key_from_path(file_path: str) -> str:
+    """Normalize a stored path (r2:// key, relative key or legacy absolute
+    local path) to a storage key like "category/filename".
+    
+    Absolute paths from an older UPLOADS_DIR keep their last two parts, the
+    category and the file name, so they still name the same object.
+    """
+    file_path = key_from_path(file_path)
+    path = Path(file_path)
+    if path.is_absolute():
+        try:
+            return path.relative_to(UPLOADS_DIR).as_posix()
+        except ValueError:
+            return "/".join(path.parts[1:][-2:])
+    return file_path
+
+@api_router.post("/files/presign")
+async def presign_files(data: PresignRequest):
+    """Resolve many stored paths to download URLs in one call.
+    
+    R2 objects get (cached) presigned URLs; local files get their
+    /api/files/... URL. expires_in is how long every returned URL stays valid.
+    """
+    if len(data.paths) > MAX_PRESIGN_BATCH:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_PRESIGN_BATCH} archivos por solicitud")
+    
+    urls = {}
+    expires_in = PRESIGNED_URL_EXPIRATION
+    for file_path in dict.fromkeys(data.paths):
+        if not file_path:
+            continue
+        key = storage_key_from_path(file_path)
+        url = None
+        if storage.supports_presigned_urls:
+            url, max_age = await get_r2_presigned_download(key)
+            expires_in = min(expires_in, max_age)
+        urls[file_path] = url or f"/api/files/{key}"
+    return {"urls": urls, "expires_in": expires_in}
 
 # ============ DASHBOARD ============
 
@@ -1307,12 +2585,15 @@ async def update_estado_costura(item_id: str, data: EstadoCosturaCreate):
         item = result.scalar_one_or_none()
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
+        renamed = item.nombre != data.nombre
         item.nombre = data.nombre
         item.activo = data.activo
         item.updated_at = datetime.now(timezone.utc)
         await session.commit()
         await session.refresh(item)
-        return EstadoCostura.model_validate(item)
+    if renamed:
+        await queue_catalog_regeneration("ESTADOS COSTURA", item_id)
+    return EstadoCostura.model_validate(item)
 
 @api_router.delete("/estados-costura/{item_id}")
 async def delete_estado_costura(item_id: str):
@@ -1323,7 +2604,8 @@ async def delete_estado_costura(item_id: str):
             raise HTTPException(status_code=404, detail="No encontrado")
         await session.delete(item)
         await session.commit()
-        return {"message": "Eliminado correctamente"}
+    await queue_catalog_regeneration("ESTADOS COSTURA", item_id)
+    return {"message": "Eliminado correctamente"}
 
 @api_router.put("/reorder/estados-costura")
 async def reorder_estados_costura(items: List[dict]):
@@ -1368,12 +2650,15 @@ async def update_avio_costura(item_id: str, data: AvioCosturaCreate):
         item = result.scalar_one_or_none()
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
+        renamed = item.nombre != data.nombre
         item.nombre = data.nombre
         item.activo = data.activo
         item.updated_at = datetime.now(timezone.utc)
         await session.commit()
         await session.refresh(item)
-        return AvioCostura.model_validate(item)
+    if renamed:
+        await queue_catalog_regeneration("AVIOS COSTURA", item_id)
+    return AvioCostura.model_validate(item)
 
 @api_router.delete("/avios-costura/{item_id}")
 async def delete_avio_costura(item_id: str):
@@ -1384,7 +2669,8 @@ async def delete_avio_costura(item_id: str):
             raise HTTPException(status_code=404, detail="No encontrado")
         await session.delete(item)
         await session.commit()
-        return {"message": "Eliminado correctamente"}
+    await queue_catalog_regeneration("AVIOS COSTURA", item_id)
+    return {"message": "Eliminado correctamente"}
 
 @api_router.put("/reorder/avios-costura")
 async def reorder_avios_costura(items: List[dict]):
@@ -1481,9 +2767,8 @@ async def delete_muestra_base(item_id: str, current_user: UsuarioDB = Depends(ge
         # Log audit before delete with full data
         await log_audit(session, current_user, "ELIMINAR", "Muestra Base", item.id, item.n_muestra or item.nombre, detalles={"datos_completos": serialize_db_item(item)})
         
-        # Delete associated file from R2
-        if item.archivo_costos:
-            delete_r2_file(item.archivo_costos)
+        # Delete associated file from storage once the delete commits
+        schedule_file_deletion(session, item.archivo_costos)
         
         await session.delete(item)
         await session.commit()
@@ -1502,11 +2787,10 @@ async def upload_archivo_costos(item_id: str, file: UploadFile = File(...)):
         item = result.scalar_one_or_none()
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
-        # Delete old file if exists
-        if item.archivo_costos:
-            delete_r2_file(item.archivo_costos)
         # Use original filename
-        file_path = await save_upload_file(file, "costos", None)
+        file_path = await save_upload_file(file, "costos", None, session)
+        # Delete old file if exists
+        schedule_file_deletion(session, item.archivo_costos)
         item.archivo_costos = file_path
         item.updated_at = datetime.now(timezone.utc)
         await session.commit()
@@ -1520,7 +2804,7 @@ async def delete_archivo_costos(item_id: str):
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
         if item.archivo_costos:
-            delete_r2_file(item.archivo_costos)
+            schedule_file_deletion(session, item.archivo_costos)
             item.archivo_costos = None
             item.updated_at = datetime.now(timezone.utc)
             await session.commit()
@@ -1555,10 +2839,20 @@ async def get_bases(search: str = "", activo: Optional[bool] = None):
         entalles_result = await session.execute(select(EntalloDB))
         entalles_dict = {e.id: e.nombre for e in entalles_result.scalars().all()}
         
+        previews = await load_previews(session, [
+            p for base in bases
+            for p in [base.patron_archivo, *(base.fichas_archivos or []), *(base.tizados_archivos or [])]
+        ])
+        
         # Build response with tizados_relacionados
         response = []
         for base in bases:
             base_dict = BaseModel_.model_validate(base).model_dump()
+            base_dict["previews"] = {
+                p: previews[p]
+                for p in [base.patron_archivo, *(base.fichas_archivos or []), *(base.tizados_archivos or [])]
+                if p in previews
+            }
             tizados_rel = [
                 {"id": t.id, "nombre": t.nombre}
                 for t in all_tizados 
@@ -1639,13 +2933,10 @@ async def delete_base(item_id: str, current_user: UsuarioDB = Depends(get_curren
         # Log audit before delete with full data
         await log_audit(session, current_user, "ELIMINAR", "Base", item.id, item.nombre, detalles={"datos_completos": serialize_db_item(item)})
         
-        # Delete all associated files from R2
-        if item.patron_archivo:
-            delete_r2_file(item.patron_archivo)
-        if item.fichas_archivos:
-            delete_multiple_r2_files(item.fichas_archivos)
-        if item.tizados_archivos:
-            delete_multiple_r2_files(item.tizados_archivos)
+        # Delete all associated files from storage once the delete commits
+        schedule_file_deletion(session, item.patron_archivo, *(item.fichas_archivos or []), *(item.tizados_archivos or []))
+        await drop_bundle_cache(session, f"base:{item.id}")
+        await session.execute(delete(ChecklistPdfDB).where(ChecklistPdfDB.base_id == item.id))
         
         await session.delete(item)
         await session.commit()
@@ -1665,7 +2956,9 @@ async def upload_patron(base_id: str, file: UploadFile = File(...)):
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
         # Use original filename
-        file_path = await save_upload_file(file, "patrones", None)
+        file_path = await save_upload_file(file, "patrones", None, session)
+        # Delete the replaced file once the change commits
+        schedule_file_deletion(session, item.patron_archivo)
         item.patron_archivo = file_path
         item.updated_at = datetime.now(timezone.utc)
         await session.commit()
@@ -1681,20 +2974,8 @@ async def upload_fichas(base_id: str, files: List[UploadFile] = File(...), nombr
         if not files:
             raise HTTPException(status_code=400, detail="Se requiere al menos un archivo")
         
-        file_paths = []
-        new_nombres = []
-        for i, file in enumerate(files):
-            # Use custom name if provided, otherwise use original filename
-            custom_name = nombres[i] if i < len(nombres) and nombres[i] else None
-            file_path = await save_upload_file(file, "fichas_bases", custom_name)
-            file_paths.append(file_path)
-            
-            # Store the display name
-            if custom_name:
-                new_nombres.append(custom_name)
-            else:
-                # Use original filename as display name
-                new_nombres.append(file.filename or file_path.split('/')[-1])
+        # Custom names are used when provided, otherwise the original filename
+        file_paths, new_nombres = await save_upload_files(files, "fichas_bases", nombres, session)
         
         item.fichas_archivos = (item.fichas_archivos or []) + file_paths
         item.fichas_nombres = (item.fichas_nombres or []) + new_nombres
@@ -1716,9 +2997,8 @@ async def delete_ficha(base_id: str, file_index: int):
         if file_index < 0 or file_index >= len(fichas):
             raise HTTPException(status_code=400, detail="Índice inválido")
         
-        # Delete file from R2
-        file_to_delete = fichas[file_index]
-        delete_r2_file(file_to_delete)
+        # Delete file from storage once the change commits
+        schedule_file_deletion(session, fichas[file_index])
         
         # Remove from arrays
         item.fichas_archivos = fichas[:file_index] + fichas[file_index+1:]
@@ -1748,12 +3028,11 @@ async def upload_ficha_checklist(base_id: str, file: UploadFile = File(...), nom
                 break
         
         # Save the new file
-        file_path = await save_upload_file(file, "fichas_bases", nombre)
+        file_path = await save_upload_file(file, "fichas_bases", nombre, session)
         
         if existing_index is not None:
-            # Update existing - delete old file first
-            old_file = fichas[existing_index]
-            delete_r2_file(old_file)
+            # Update existing - delete old file after commit
+            schedule_file_deletion(session, fichas[existing_index])
             fichas[existing_index] = file_path
             item.fichas_archivos = fichas
         else:
@@ -1778,379 +3057,390 @@ async def generate_checklist_pdf(base_id: str, request: GenerateChecklistRequest
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
         
-        base_name = item.nombre or "Base"
-        
-        # Generate PDF using ReportLab
-        buffer = BytesIO()
-        # A4 size page, but content in A6 area (top-left corner)
-        from reportlab.lib.pagesizes import A4
-        page_width_a4 = A4[0]  # 210mm
-        page_height_a4 = A4[1]  # 297mm
-        c = canvas.Canvas(buffer, pagesize=A4)
-        
-        # A6 content area dimensions
-        a6_width = 105 * mm
-        a6_height = 148 * mm
-        
-        # Check if it's AVIOS COSTURA or ESTADOS COSTURA
-        is_avios = "AVIOS" in request.title.upper()
-        
-        # Content starts at top-left of A4, within A6 bounds
-        left_margin = 5 * mm
-        top_start = page_height_a4 - 8 * mm  # Start from top of A4
-        
-        # Title - centered within A6 width
-        c.setFont("Helvetica-Bold", 12)
-        c.drawCentredString(a6_width / 2, top_start, request.title)
-        
-        # Model name
-        c.setFont("Helvetica", 8)
-        c.drawString(left_margin, top_start - 8 * mm, f"Modelo: {base_name}")
-        
-        if is_avios:
-            # AVIOS COSTURA PDF FORMAT
-            # Cantidad field
-            c.drawString(left_margin, top_start - 14 * mm, "Cantidad: ____________________")
-            
-            # Table header
-            y = top_start - 24 * mm
-            c.setFont("Helvetica-Bold", 8)
-            c.drawString(left_margin, y, "AVIOS")
-            c.drawString(70 * mm, y, "CHECK")
-            
-            # Header line
-            c.setStrokeColorRGB(0.4, 0.4, 0.4)
-            c.setLineWidth(0.5)
-            c.line(left_margin, y - 2 * mm, a6_width - 5 * mm, y - 2 * mm)
-            
-            # Items
-            y -= 7 * mm
-            
-            # Calculate footer position (bottom of A6 area)
-            a6_bottom = page_height_a4 - a6_height
-            footer_y = a6_bottom + 20 * mm
-            
-            for item_name in request.items:
-                if y < footer_y + 15 * mm:  # Leave space for footer
-                    c.showPage()
-                    y = page_height_a4 - 15 * mm
-                
-                # Item name - BOLD
-                c.setFont("Helvetica-Bold", 8)
-                c.setFillColorRGB(0, 0, 0)
-                c.drawString(left_margin, y, item_name[:35])
-                
-                # Checkbox
-                c.setStrokeColorRGB(0, 0, 0)
-                c.setLineWidth(0.5)
-                c.rect(71 * mm, y - 1.5 * mm, 3.5 * mm, 3.5 * mm)
-                
-                # Row separator line (light gray)
-                c.setStrokeColorRGB(0.75, 0.75, 0.75)
-                c.setLineWidth(0.3)
-                c.line(left_margin, y - 4.5 * mm, a6_width - 5 * mm, y - 4.5 * mm)
-                
-                y -= 8 * mm
-            
-            # Footer section (within A6 area)
-            c.setFont("Helvetica", 7)
-            c.setFillColorRGB(0, 0, 0)
-            
-            # Recibido por
-            c.drawString(left_margin, footer_y, "Recibido por:")
-            c.setDash(1, 1)
-            c.setStrokeColorRGB(0, 0, 0)
-            c.line(22 * mm, footer_y - 1 * mm, 55 * mm, footer_y - 1 * mm)
-            
-            # Fecha
-            c.setDash()
-            c.drawString(left_margin, footer_y - 10 * mm, "Fecha: ___/___/____")
-            
-            # Firma
-            c.drawString(50 * mm, footer_y - 10 * mm, "Firma:")
-            c.setDash(1, 1)
-            c.line(62 * mm, footer_y - 11 * mm, a6_width - 5 * mm, footer_y - 11 * mm)
-        
-        else:
-            # ESTADOS COSTURA PDF FORMAT
-            # Table header
-            y = top_start - 14 * mm
-            c.setFont("Helvetica-Bold", 7)
-            c.drawString(left_margin, y, "ITEM")
-            c.drawString(35 * mm, y, "CHECK")
-            c.drawString(45 * mm, y, "FECHA")
-            c.drawString(65 * mm, y, "ENTREGADO POR")
-            c.drawString(90 * mm, y, "FIRMA")
-            
-            # Header line
-            c.setStrokeColorRGB(0.4, 0.4, 0.4)
-            c.setLineWidth(0.5)
-            c.line(left_margin, y - 2 * mm, a6_width - 5 * mm, y - 2 * mm)
-            
-            # Items
-            y -= 7 * mm
-            
-            # Calculate A6 bottom boundary
-            a6_bottom = page_height_a4 - a6_height
-            
-            for item_name in request.items:
-                if y < a6_bottom + 5 * mm:
-                    c.showPage()
-                    y = page_height_a4 - 15 * mm
-                
-                # Item name - BOLD and larger font
-                c.setFont("Helvetica-Bold", 8)
-                c.setFillColorRGB(0, 0, 0)
-                c.drawString(left_margin, y, item_name[:18])
-                
-                # Checkbox (empty square)
-                c.setStrokeColorRGB(0, 0, 0)
-                c.setLineWidth(0.5)
-                c.rect(36 * mm, y - 1.5 * mm, 3 * mm, 3 * mm)
-                
-                # Date field - realistic format
-                c.setFont("Helvetica", 7)
-                c.drawString(45 * mm, y, "___/___/____")
-                
-                # Entregado por (dotted line)
-                c.setDash(1, 1)
-                c.line(65 * mm, y - 1 * mm, 85 * mm, y - 1 * mm)
-                
-                # Firma (dotted line)
-                c.line(90 * mm, y - 1 * mm, a6_width - 5 * mm, y - 1 * mm)
-                
-                # Row separator line (light gray)
-                c.setDash()
-                c.setStrokeColorRGB(0.75, 0.75, 0.75)
-                c.setLineWidth(0.3)
-                c.line(left_margin, y - 4.5 * mm, a6_width - 5 * mm, y - 4.5 * mm)
-                
-                y -= 8 * mm
-        
-        c.save()
-        buffer.seek(0)
-        
-        # Save to R2/local storage
-        file_name = f"{request.title}.pdf"
-        file_path = await save_file_from_bytes(buffer.read(), "fichas_bases", file_name)
-        
-        # Check if a ficha with this nombre already exists
-        fichas = item.fichas_archivos or []
-        nombres = item.fichas_nombres or []
-        
-        existing_index = None
-        for i, n in enumerate(nombres):
-            if n == request.title:
-                existing_index = i
-                break
-        
-        if existing_index is not None:
-            # Update existing - delete old file first (ignore if doesn't exist)
-            old_file = fichas[existing_index]
-            delete_r2_file(old_file)
-            # Create new list to ensure SQLAlchemy detects the change
-            new_fichas = list(fichas)
-            new_fichas[existing_index] = file_path
-            item.fichas_archivos = new_fichas
-        else:
-            # Add new
-            item.fichas_archivos = list(fichas) + [file_path]
-            item.fichas_nombres = list(nombres) + [request.title]
-        
-        item.updated_at = datetime.now(timezone.utc)
+        file_path, existing, rendered = await save_checklist(session, item, request.title, request.items)
+        if rendered:
+            item.updated_at = datetime.now(timezone.utc)
         await session.commit()
-        await session.refresh(item)
-        return {"file_path": file_path, "nombre": request.title, "updated": existing_index is not None}
+        return {"file_path": file_path, "nombre": request.title, "updated": existing, "unchanged": not rendered}
+
+# Checklists are rendered in worker processes so ReportLab doesn't block the
+# event loop and bulk regeneration scales with the number of cores
+CHECKLIST_RENDER_WORKERS = int(os.environ.get('CHECKLIST_RENDER_WORKERS', '0')) or os.cpu_count() or 1
+# Rendered checklists uploaded at the same time during regeneration
+CHECKLIST_UPLOAD_CONCURRENCY = int(os.environ.get('CHECKLIST_UPLOAD_CONCURRENCY', '8'))
+# Bases regenerated (and committed) per transaction
+CHECKLIST_REGEN_BATCH_SIZE = int(os.environ.get('CHECKLIST_REGEN_BATCH_SIZE', '50'))
+
+checklist_pool: Optional[ProcessPoolExecutor] = None
+
+async def render_checklist(title: str, base_name: str, items: List[str]) -> bytes:
+    global checklist_pool
+    if checklist_pool is None:
+        # spawn: forking a process with the event loop's threads running isn't safe
+        checklist_pool = ProcessPoolExecutor(
+            CHECKLIST_RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=init_render_worker
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(checklist_pool, render_checklist_pdf, title, base_name, items)
 
-async def save_file_from_bytes(content: bytes, folder: str, filename: str) -> str:
-    """Save bytes content to R2 or local storage"""
-    unique_suffix = uuid.uuid4().hex[:8]
-    safe_filename = filename.replace(" ", "_")
-    new_filename = f"{Path(safe_filename).stem}_{unique_suffix}{Path(safe_filename).suffix}"
+def checklist_is_current(base: BaseDB, title: str, render_hash: str, cached: Optional[ChecklistPdfDB]) -> bool:
+    """True if the base's ficha named title is the file rendered for render_hash"""
+    if cached is None or cached.render_hash != render_hash:
+        return False
+    fichas = base.fichas_archivos or []
+    nombres = base.fichas_nombres or []
+    return title in nombres and nombres.index(title) < len(fichas) and fichas[nombres.index(title)] == cached.file_path
+
+def apply_checklist(session: AsyncSession, base: BaseDB, title: str, render_hash: str, file_path: str,
+                    cached: Optional[ChecklistPdfDB], catalogo_version: Optional[datetime] = None) -> bool:
+    """Point the base ficha named title at a newly stored checklist.
+    Returns whether an existing ficha was replaced. The caller commits."""
+    fichas = list(base.fichas_archivos or [])
+    nombres = list(base.fichas_nombres or [])
+    existing_index = nombres.index(title) if title in nombres else None
     
-    # Try R2 first
-    if r2_client:
-        try:
-            key = f"{folder}/{new_filename}"
-            logging.info(f"Uploading to R2: {key}")
-            r2_client.put_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=key,
-                Body=content,
-                ContentType='application/pdf'
-            )
-            logging.info(f"Successfully uploaded to R2: {key}")
-            return f"r2://{key}"
-        except Exception as e:
-            logging.error(f"R2 upload failed for {new_filename}: {e}")
+    if existing_index is not None and existing_index < len(fichas):
+        # Replace existing - old file is released after commit
+        schedule_file_deletion(session, fichas[existing_index])
+        fichas[existing_index] = file_path
+        # New list so SQLAlchemy detects the change
+        base.fichas_archivos = fichas
+    else:
+        base.fichas_archivos = fichas + [file_path]
+        base.fichas_nombres = nombres + [title]
+        existing_index = None
+    
+    if cached is None:
+        session.add(ChecklistPdfDB(
+            base_id=base.id, nombre=title, render_hash=render_hash,
+            file_path=file_path, catalogo_version=catalogo_version
+        ))
     else:
-        logging.warning("R2 client not available, using local storage")
+        cached.render_hash = render_hash
+        cached.file_path = file_path
+        cached.catalogo_version = catalogo_version
+        cached.updated_at = datetime.now(timezone.utc)
+    return existing_index is not None
+
+async def remove_checklist(session: AsyncSession, base: BaseDB, title: str, cached: ChecklistPdfDB) -> bool:
+    """Drop the checklist of a base that no longer has any item of its catalog.
+    
+    The base ficha named title is removed (and its file released after
+    commit) only while it is the stored checklist; fichas uploaded by hand
+    under that name are kept. Returns whether a ficha was removed. The
+    caller commits.
+    """
+    fichas = list(base.fichas_archivos or [])
+    nombres = list(base.fichas_nombres or [])
+    removed = False
+    if title in nombres:
+        index = nombres.index(title)
+        if index < len(fichas) and fichas[index] == cached.file_path:
+            schedule_file_deletion(session, fichas[index])
+            base.fichas_archivos = fichas[:index] + fichas[index + 1:]
+            base.fichas_nombres = nombres[:index] + nombres[index + 1:]
+            removed = True
+    await session.delete(cached)
+    return removed
+
+async def save_checklist(session: AsyncSession, base: BaseDB, title: str, items: List[str]) -> Tuple[str, bool, bool]:
+    """Render a checklist and store it as the base ficha named title.
+    
+    Returns (file_path, replaced an existing ficha, rendered). When the
+    render hash matches the one stored for the ficha currently in the base,
+    the existing file is kept: nothing is rendered, uploaded or deleted.
+    The caller commits.
+    """
+    base_name = base.nombre or "Base"
+    render_hash = checklist_render_hash(title, base_name, items)
+    cached = await session.get(ChecklistPdfDB, (base.id, title))
+    if checklist_is_current(base, title, render_hash, cached):
+        return cached.file_path, True, False
+    
+    content = await render_checklist(title, base_name, items)
+    file_path = await save_file_from_bytes(content, "fichas_bases", f"{title}.pdf", session=session)
+    replaced = apply_checklist(session, base, title, render_hash, file_path, cached)
+    return file_path, replaced, True
+
+async def save_file_from_bytes(content: bytes, folder: str, filename: str, content_type: str = 'application/pdf', session: Optional[AsyncSession] = None) -> str:
+    """Save generated bytes to storage, content-addressed like uploads
+    
+    Returns the stored path (same format as save_upload_file, and session is
+    handled the same way). Storage errors are raised as HTTP 500 instead of
+    silently falling back to another backend.
+    """
+    file_path, guard_id = await store_bytes(content, folder, filename, content_type, session is not None)
+    if session is not None:
+        await keep_stored_files(session, [guard_id])
+    return file_path
+
+async def store_bytes(content: bytes, folder: str, filename: str, content_type: str, guarded: bool) -> Tuple[str, Optional[str]]:
+    """Store bytes content-addressed. Returns (file_path, guard entry id)"""
+    sha256 = hashlib.sha256(content).hexdigest()
+    key = content_addressed_key(sha256, filename)
+    
+    async def write_object():
+        await storage.put_bytes(key, content, content_type)
+        logging.info(f"Saved {folder} file to {storage.name} storage: {key}")
+    
+    try:
+        guard_id = await store_content_addressed(key, sha256, len(content), content_type, write_object, guarded)
+    except Exception as e:
+        logging.error(f"Error saving {filename} to storage: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al guardar archivo: {str(e)}")
+    return storage.to_path(key), guard_id
+
+@api_router.get("/bases/checklists/imprimir")
+async def print_checklists(base_ids: str, tipos: Optional[str] = None, token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))):
+    """One merged PDF with the checklists of several bases, ready to print
+    
+    base_ids is a comma-separated list (pages follow its order) and tipos a
+    comma-separated list of checklist titles, both by default. Stored
+    checklists are reused while current; missing or stale ones are rendered
+    on the fly (without being stored). Bases without items for a type are
+    skipped.
+    """
+    verify_download_token(token, credentials)
+    if pdfium is None:
+        raise HTTPException(status_code=503, detail="La impresión de checklists no está disponible")
+    
+    ids = list(dict.fromkeys(i.strip() for i in base_ids.split(",") if i.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="Se requiere base_ids")
+    titles = list(dict.fromkeys(t.strip().upper() for t in (tipos or "").split(",") if t.strip())) or list(CHECKLIST_CATALOGS)
+    unknown = [t for t in titles if t not in CHECKLIST_CATALOGS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Tipo de checklist desconocido: {', '.join(unknown)}")
+    
+    async with async_session() as session:
+        result = await session.execute(select(BaseDB).where(BaseDB.id.in_(ids)))
+        bases = {b.id: b for b in result.scalars().all()}
+        if len(bases) < len(ids):
+            raise HTTPException(status_code=404, detail="Base no encontrada")
+        result = await session.execute(
+            select(ChecklistPdfDB).where(ChecklistPdfDB.base_id.in_(ids), ChecklistPdfDB.nombre.in_(titles))
+        )
+        cache = {(c.base_id, c.nombre): c for c in result.scalars().all()}
+        lookups = {}
+        for title in titles:
+            model = CHECKLIST_CATALOGS[title][1]
+            result = await session.execute(select(model.id, model.nombre))
+            lookups[title] = dict(result.all())
     
-    # Fallback to local storage
-    folder_path = UPLOADS_DIR / folder
-    folder_path.mkdir(parents=True, exist_ok=True)
-    file_path = folder_path / new_filename
-    with open(file_path, 'wb') as f:
-        f.write(content)
-    logging.info(f"Saved locally: {file_path}")
-    return str(file_path)
+    # (stored file if current, title, base name, items) per checklist, in print order
+    sources = []
+    for base_id in ids:
+        base = bases[base_id]
+        base_name = base.nombre or "Base"
+        for title in titles:
+            lookup = lookups[title]
+            items = [lookup[cid] for cid in (getattr(base, CHECKLIST_CATALOGS[title][0]) or []) if cid in lookup]
+            if not items:
+                continue
+            cached = cache.get((base_id, title))
+            current = checklist_is_current(base, title, checklist_render_hash(title, base_name, items), cached)
+            sources.append((cached.file_path if current else None, title, base_name, items))
+    if not sources:
+        raise HTTPException(status_code=404, detail="No hay checklists para imprimir")
+    
+    fetch_slots = asyncio.Semaphore(CHECKLIST_PRINT_CONCURRENCY)
+    
+    async def load(file_path: Optional[str], title: str, base_name: str, items: List[str]) -> bytes:
+        if file_path:
+            try:
+                async with fetch_slots:
+                    return await storage.get_bytes(storage_key_from_path(file_path))
+            except FileNotFoundError:
+                logging.warning(f"Stored checklist missing, rendering it again: {file_path}")
+        return await render_checklist(title, base_name, items)
+    
+    documents = await asyncio.gather(*(load(*source) for source in sources))
+    merged = tempfile.SpooledTemporaryFile(max_size=CHECKLIST_PRINT_SPOOL_SIZE)
+    try:
+        await asyncio.to_thread(merge_pdfs, documents, merged)
+        size = merged.tell()
+    except Exception:
+        merged.close()
+        raise
+    
+    async def merged_chunks():
+        try:
+            await asyncio.to_thread(merged.seek, 0)
+            while True:
+                chunk = await asyncio.to_thread(merged.read, CHECKLIST_PRINT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            merged.close()
+    
+    return StreamingResponse(
+        merged_chunks(),
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": 'inline; filename="Checklists.pdf"',
+            "Content-Length": str(size)
+        }
+    )
 
 @api_router.post("/bases/regenerar-pdfs")
 async def regenerar_todos_pdfs(current_user: UsuarioDB = Depends(get_current_user)):
-    """Regenerate all Estados Costura and Avios Costura PDFs for all bases"""
-    from reportlab.lib.pagesizes import A4
-    import zipfile
-    
-    async with async_session() as session:
-        result = await session.execute(select(BaseDB))
-        all_bases = result.scalars().all()
-        
-        # Get all estados and avios for name lookup
-        estados_result = await session.execute(select(EstadoCosturaDB))
-        all_estados = {e.id: e.nombre for e in estados_result.scalars().all()}
-        avios_result = await session.execute(select(AvioCosturaDB))
-        all_avios = {a.id: a.nombre for a in avios_result.scalars().all()}
-        
-        generated = 0
-        errors = []
-        
-        for base in all_bases:
-            for pdf_type, ids_field, lookup in [
-                ("ESTADOS COSTURA", base.estados_costura_ids, all_estados),
-                ("AVIOS COSTURA", base.avios_costura_ids, all_avios),
-            ]:
-                ids_list = ids_field or []
-                if not ids_list:
-                    continue
-                
-                item_names = [lookup[eid] for eid in ids_list if eid in lookup]
-                if not item_names:
+    """Queue the regeneration of every checklist PDF; poll GET /api/jobs/{id}.
+    If a regeneration is already queued or running, that job is returned."""
+    job, created = await enqueue_job("regenerar_pdfs", usuario_id=current_user.id)
+    return {"job_id": job.id, "estado": job.estado, "created": created}
+
+# Checklists generated from catalogs: title -> (BaseDB array column, catalog model)
+CHECKLIST_CATALOGS = {
+    "ESTADOS COSTURA": ("estados_costura_ids", EstadoCosturaDB),
+    "AVIOS COSTURA": ("avios_costura_ids", AvioCosturaDB),
+}
+
+async def regenerate_checklists(base_ids: List[str], progress, titles: Optional[List[str]] = None) -> dict:
+    """Regenerate the catalog checklists (all, or only titles) of base_ids
+    
+    Bases are processed in batches of CHECKLIST_REGEN_BATCH_SIZE, each
+    committed on its own. Checklists whose title, base name and items are
+    unchanged keep their stored file and are counted as unchanged. Stored
+    checklists of bases left without items (their last one was deleted) are
+    removed.
+    """
+    titles = titles or list(CHECKLIST_CATALOGS)
+    lookups = {}
+    async with async_session() as session:
+        # Catalog names with their version (updated_at) for each checklist type
+        for title in titles:
+            model = CHECKLIST_CATALOGS[title][1]
+            result = await session.execute(select(model.id, model.nombre, model.updated_at))
+            lookups[title] = {row.id: (row.nombre, row.updated_at) for row in result.all()}
+    
+    generated = 0
+    unchanged = 0
+    removed = 0
+    errors = []
+    upload_slots = asyncio.Semaphore(CHECKLIST_UPLOAD_CONCURRENCY)
+    
+    async def produce(title: str, base_name: str, items: List[str]) -> Tuple[str, Optional[str]]:
+        content = await render_checklist(title, base_name, items)
+        async with upload_slots:
+            return await store_bytes(content, "fichas_bases", f"{title}.pdf", 'application/pdf', True)
+    
+    # Each batch of bases is rendered in the process pool, uploaded
+    # concurrently and committed on its own
+    await progress(0, len(base_ids))
+    for offset in range(0, len(base_ids), CHECKLIST_REGEN_BATCH_SIZE):
+        batch_ids = base_ids[offset:offset + CHECKLIST_REGEN_BATCH_SIZE]
+        async with async_session() as session:
+            result = await session.execute(select(BaseDB).where(BaseDB.id.in_(batch_ids)))
+            bases = result.scalars().all()
+            result = await session.execute(select(ChecklistPdfDB).where(ChecklistPdfDB.base_id.in_(batch_ids)))
+            cache = {(c.base_id, c.nombre): c for c in result.scalars().all()}
+            
+            jobs = []
+            for base in bases:
+                base_name = base.nombre or "Base"
+                for title in titles:
+                    lookup = lookups[title]
+                    used = [lookup[cid] for cid in (getattr(base, CHECKLIST_CATALOGS[title][0]) or []) if cid in lookup]
+                    if not used:
+                        cached = cache.get((base.id, title))
+                        if cached is not None:
+                            if await remove_checklist(session, base, title, cached):
+                                base.updated_at = datetime.now(timezone.utc)
+                                removed += 1
+                        continue
+                    item_names = [nombre for nombre, _ in used]
+                    version = max((updated_at for _, updated_at in used if updated_at), default=None)
+                    render_hash = checklist_render_hash(title, base_name, item_names)
+                    cached = cache.get((base.id, title))
+                    if checklist_is_current(base, title, render_hash, cached):
+                        # Same output: only record that it matches this catalog version
+                        cached.catalogo_version = version
+                        unchanged += 1
+                        continue
+                    jobs.append((base, title, render_hash, version, produce(title, base_name, item_names)))
+            
+            results = await asyncio.gather(*(job[4] for job in jobs), return_exceptions=True)
+            # Stored references are kept only if the batch commits
+            await keep_stored_files(session, [result[1] for result in results if not isinstance(result, BaseException)])
+            for (base, title, render_hash, version, _), result in zip(jobs, results):
+                if isinstance(result, BaseException):
+                    detail = result.detail if isinstance(result, HTTPException) else str(result)
+                    errors.append(f"{base.nombre} - {title}: {detail}")
+                    logging.error(f"Error generating PDF for base {base.id} ({title}): {detail}")
                     continue
-                
+                file_path = result[0]
+                apply_checklist(session, base, title, render_hash, file_path, cache.get((base.id, title)), version)
+                base.updated_at = datetime.now(timezone.utc)
+                generated += 1
+            await session.commit()
+        await progress(min(offset + CHECKLIST_REGEN_BATCH_SIZE, len(base_ids)), len(base_ids))
+    
+    return {
+        "message": f"Se regeneraron {generated} PDFs" + (f" ({unchanged} sin cambios)" if unchanged else "")
+            + (f", {removed} eliminados" if removed else ""),
+        "generated": generated,
+        "unchanged": unchanged,
+        "removed": removed,
+        "errors": errors
+    }
+
+async def regenerate_all_checklists(params: dict, progress) -> dict:
+    """Job: regenerate all Estados Costura and Avios Costura PDFs for all bases"""
+    async with async_session() as session:
+        result = await session.execute(select(BaseDB.id).order_by(BaseDB.id))
+        base_ids = result.scalars().all()
+    return await regenerate_checklists(base_ids, progress)
+
+async def regenerate_catalog_checklists(params: dict, progress) -> dict:
+    """Job: after an estado/avío changed, regenerate the checklists of the
+    bases that include it (GIN-indexed @> lookup on the base's id array).
+    Bases whose checklist was already rendered from this catalog version or
+    a later one are skipped."""
+    title = params["titulo"]
+    column_name, model = CHECKLIST_CATALOGS[title]
+    column = getattr(BaseDB, column_name)
+    async with async_session() as session:
+        version = await session.scalar(select(model.updated_at).where(model.id == params["item_id"]))
+        query = select(BaseDB.id).where(column.contains([params["item_id"]]))
+        if version is not None:
+            up_to_date = select(ChecklistPdfDB.base_id).where(
+                ChecklistPdfDB.base_id == BaseDB.id,
+                ChecklistPdfDB.nombre == title,
+                ChecklistPdfDB.catalogo_version >= version
+            )
+            query = query.where(~up_to_date.exists())
+        result = await session.execute(query.order_by(BaseDB.id))
+        base_ids = result.scalars().all()
+    return await regenerate_checklists(base_ids, progress, [title])
+
+# Stored checklists read from storage at the same time when printing
+CHECKLIST_PRINT_CONCURRENCY = int(os.environ.get('CHECKLIST_PRINT_CONCURRENCY', '8'))
+# Merged print files stay in memory up to this size, then spill to disk
+CHECKLIST_PRINT_SPOOL_SIZE = 8 * 1024 * 1024
+CHECKLIST_PRINT_CHUNK_SIZE = 256 * 1024
+
+def merge_pdfs(documents: List[bytes], dest):
+    """Write the pages of documents, in order, as one PDF into dest (runs in a thread)"""
+    with pdfium_lock:
+        merged = pdfium.PdfDocument.new()
+        try:
+            for data in documents:
+                source = pdfium.PdfDocument(data)
                 try:
-                    is_avios = "AVIOS" in pdf_type
-                    base_name = base.nombre or "Base"
-                    
-                    buf = BytesIO()
-                    page_width_a4 = A4[0]
-                    page_height_a4 = A4[1]
-                    c = canvas.Canvas(buf, pagesize=A4)
-                    a6_width = 105 * mm
-                    a6_height = 148 * mm
-                    left_margin = 5 * mm
-                    top_start = page_height_a4 - 8 * mm
-                    
-                    c.setFont("Helvetica-Bold", 12)
-                    c.drawCentredString(a6_width / 2, top_start, pdf_type)
-                    c.setFont("Helvetica", 8)
-                    c.drawString(left_margin, top_start - 8 * mm, f"Modelo: {base_name}")
-                    
-                    if is_avios:
-                        c.drawString(left_margin, top_start - 14 * mm, "Cantidad: ____________________")
-                        y = top_start - 24 * mm
-                        c.setFont("Helvetica-Bold", 8)
-                        c.drawString(left_margin, y, "AVIOS")
-                        c.drawString(70 * mm, y, "CHECK")
-                        c.setStrokeColorRGB(0.4, 0.4, 0.4)
-                        c.setLineWidth(0.5)
-                        c.line(left_margin, y - 2 * mm, a6_width - 5 * mm, y - 2 * mm)
-                        y -= 7 * mm
-                        a6_bottom = page_height_a4 - a6_height
-                        footer_y = a6_bottom + 20 * mm
-                        for item_name in item_names:
-                            if y < footer_y + 15 * mm:
-                                c.showPage()
-                                y = page_height_a4 - 15 * mm
-                            c.setFont("Helvetica-Bold", 8)
-                            c.setFillColorRGB(0, 0, 0)
-                            c.drawString(left_margin, y, item_name[:35])
-                            c.setStrokeColorRGB(0, 0, 0)
-                            c.setLineWidth(0.5)
-                            c.rect(71 * mm, y - 1.5 * mm, 3.5 * mm, 3.5 * mm)
-                            c.setStrokeColorRGB(0.75, 0.75, 0.75)
-                            c.setLineWidth(0.3)
-                            c.line(left_margin, y - 4.5 * mm, a6_width - 5 * mm, y - 4.5 * mm)
-                            y -= 8 * mm
-                        c.setFont("Helvetica", 7)
-                        c.setFillColorRGB(0, 0, 0)
-                        c.drawString(left_margin, footer_y, "Recibido por:")
-                        c.setDash(1, 1)
-                        c.setStrokeColorRGB(0, 0, 0)
-                        c.line(22 * mm, footer_y - 1 * mm, 55 * mm, footer_y - 1 * mm)
-                        c.setDash()
-                        c.drawString(left_margin, footer_y - 10 * mm, "Fecha: ___/___/____")
-                        c.drawString(50 * mm, footer_y - 10 * mm, "Firma:")
-                        c.setDash(1, 1)
-                        c.line(62 * mm, footer_y - 11 * mm, a6_width - 5 * mm, footer_y - 11 * mm)
-                    else:
-                        y = top_start - 14 * mm
-                        c.setFont("Helvetica-Bold", 7)
-                        c.drawString(left_margin, y, "ITEM")
-                        c.drawString(35 * mm, y, "CHECK")
-                        c.drawString(45 * mm, y, "FECHA")
-                        c.drawString(65 * mm, y, "ENTREGADO POR")
-                        c.drawString(90 * mm, y, "FIRMA")
-                        c.setStrokeColorRGB(0.4, 0.4, 0.4)
-                        c.setLineWidth(0.5)
-                        c.line(left_margin, y - 2 * mm, a6_width - 5 * mm, y - 2 * mm)
-                        y -= 7 * mm
-                        a6_bottom = page_height_a4 - a6_height
-                        for item_name in item_names:
-                            if y < a6_bottom + 5 * mm:
-                                c.showPage()
-                                y = page_height_a4 - 15 * mm
-                            c.setFont("Helvetica-Bold", 8)
-                            c.setFillColorRGB(0, 0, 0)
-                            c.drawString(left_margin, y, item_name[:18])
-                            c.setStrokeColorRGB(0, 0, 0)
-                            c.setLineWidth(0.5)
-                            c.rect(36 * mm, y - 1.5 * mm, 3 * mm, 3 * mm)
-                            c.setFont("Helvetica", 7)
-                            c.drawString(45 * mm, y, "___/___/____")
-                            c.setDash(1, 1)
-                            c.line(65 * mm, y - 1 * mm, 85 * mm, y - 1 * mm)
-                            c.line(90 * mm, y - 1 * mm, a6_width - 5 * mm, y - 1 * mm)
-                            c.setDash()
-                            c.setStrokeColorRGB(0.75, 0.75, 0.75)
-                            c.setLineWidth(0.3)
-                            c.line(left_margin, y - 4.5 * mm, a6_width - 5 * mm, y - 4.5 * mm)
-                            y -= 8 * mm
-                    
-                    c.save()
-                    buf.seek(0)
-                    file_name = f"{pdf_type}.pdf"
-                    file_path = await save_file_from_bytes(buf.read(), "fichas_bases", file_name)
-                    
-                    fichas = list(base.fichas_archivos or [])
-                    nombres = list(base.fichas_nombres or [])
-                    existing_index = None
-                    for i, n in enumerate(nombres):
-                        if n == pdf_type:
-                            existing_index = i
-                            break
-                    
-                    if existing_index is not None:
-                        old_file = fichas[existing_index]
-                        delete_r2_file(old_file)
-                        fichas[existing_index] = file_path
-                        base.fichas_archivos = fichas
-                    else:
-                        base.fichas_archivos = fichas + [file_path]
-                        base.fichas_nombres = nombres + [pdf_type]
-                    
-                    base.updated_at = datetime.now(timezone.utc)
-                    generated += 1
-                except Exception as e:
-                    errors.append(f"{base.nombre} - {pdf_type}: {str(e)}")
-                    logging.error(f"Error generating PDF for base {base.id} ({pdf_type}): {e}")
-        
-        await session.commit()
-        
-        return {
-            "message": f"Se regeneraron {generated} PDFs",
-            "generated": generated,
-            "errors": errors
-        }
+                    merged.import_pages(source)
+                finally:
+                    source.close()
+            merged.save(dest)
+        finally:
+            merged.close()
+
+async def queue_catalog_regeneration(title: str, item_id: str):
+    """Queue regeneration of the checklists that use a catalog item"""
+    await enqueue_job("regenerar_pdfs_catalogo", {"titulo": title, "item_id": item_id}, reuse_running=False)
+
+JOB_HANDLERS["regenerar_pdfs"] = regenerate_all_checklists
+JOB_HANDLERS["regenerar_pdfs_catalogo"] = regenerate_catalog_checklists
 
 @api_router.post("/bases/{base_id}/tizados")
 async def upload_tizados(base_id: str, files: List[UploadFile] = File(...), nombres: List[str] = Form(default=[])):
@@ -2162,20 +3452,8 @@ async def upload_tizados(base_id: str, files: List[UploadFile] = File(...), nomb
         if not files:
             raise HTTPException(status_code=400, detail="Se requiere al menos un archivo")
         
-        file_paths = []
-        new_nombres = []
-        for i, file in enumerate(files):
-            # Use custom name if provided, otherwise use original filename
-            custom_name = nombres[i] if i < len(nombres) and nombres[i] else None
-            file_path = await save_upload_file(file, "tizados_bases", custom_name)
-            file_paths.append(file_path)
-            
-            # Store the display name
-            if custom_name:
-                new_nombres.append(custom_name)
-            else:
-                # Use original filename as display name
-                new_nombres.append(file.filename or file_path.split('/')[-1])
+        # Custom names are used when provided, otherwise the original filename
+        file_paths, new_nombres = await save_upload_files(files, "tizados_bases", nombres, session)
         
         item.tizados_archivos = (item.tizados_archivos or []) + file_paths
         item.tizados_nombres = (item.tizados_nombres or []) + new_nombres
@@ -2197,9 +3475,8 @@ async def delete_tizado(base_id: str, file_index: int):
         if file_index < 0 or file_index >= len(tizados):
             raise HTTPException(status_code=400, detail="Índice inválido")
         
-        # Delete file from R2
-        file_to_delete = tizados[file_index]
-        delete_r2_file(file_to_delete)
+        # Delete file from storage once the change commits
+        schedule_file_deletion(session, tizados[file_index])
         
         tizados.pop(file_index)
         if file_index < len(nombres):
@@ -2336,6 +3613,16 @@ async def get_modelos(search: str = "", activo: Optional[bool] = None):
             
             response.append(modelo_dict)
         
+        def modelo_file_paths(modelo_dict):
+            return [
+                *modelo_dict["fichas_archivos"], *modelo_dict["base_fichas_archivos"],
+                modelo_dict["base_patron_archivo"], *(t["archivo_tizado"] for t in modelo_dict["base_tizados"]),
+            ]
+        
+        previews = await load_previews(session, [p for d in response for p in modelo_file_paths(d)])
+        for modelo_dict in response:
+            modelo_dict["previews"] = {p: previews[p] for p in modelo_file_paths(modelo_dict) if p in previews}
+        
         return response
 
 @api_router.post("/modelos", response_model=Modelo)
@@ -2406,9 +3693,9 @@ async def delete_modelo(item_id: str, current_user: UsuarioDB = Depends(get_curr
         # Log audit before delete with full data
         await log_audit(session, current_user, "ELIMINAR", "Modelo", item.id, item.nombre, detalles={"datos_completos": serialize_db_item(item)})
         
-        # Delete associated files from R2
-        if item.fichas_archivos:
-            delete_multiple_r2_files(item.fichas_archivos)
+        # Delete associated files from storage once the delete commits
+        schedule_file_deletion(session, *(item.fichas_archivos or []))
+        await drop_bundle_cache(session, f"modelo:{item.id}")
         
         await session.delete(item)
         await session.commit()
@@ -2420,13 +3707,234 @@ async def count_modelos():
         result = await session.execute(select(func.count(ModeloDB.id)))
         return {"total": result.scalar()}
 
-@api_router.get("/modelos/{item_id}/descargar")
-async def download_modelo_files(item_id: str, token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))):
-    """Download all model files as ZIP: patron, fichas generales (base), fichas modelo"""
-    import zipfile
-    from fastapi.responses import StreamingResponse
+ZIP_READ_CHUNK_SIZE = 1024 * 1024
+# Files fetched concurrently (ahead of the one being written) for ZIP bundles
+ZIP_FETCH_CONCURRENCY = int(os.environ.get('ZIP_FETCH_CONCURRENCY', '4'))
+
+def bundle_folder_name(nombre: Optional[str], item_id: str) -> str:
+    """Folder name for a modelo inside a ZIP bundle"""
+    folder_name = nombre or f"Modelo_{item_id[:8]}"
+    safe_folder = "".join(c for c in folder_name if c.isalnum() or c in (' ', '-', '_', '.')).strip()
+    return safe_folder or f"Modelo_{item_id[:8]}"
+
+def bundle_file_name(nombre: str, archivo: str) -> str:
+    ext = archivo.split('.')[-1] if '.' in archivo else ''
+    return f"{nombre}.{ext}" if ext and not nombre.endswith(f".{ext}") else nombre
+
+def modelo_bundle_files(modelo: ModeloDB, base: Optional[BaseDB], folder: str) -> List[Tuple[str, str]]:
+    """(zip path, stored file path) for everything in a modelo bundle:
+    patron, fichas generales (base) and fichas modelo"""
+    files = []
+    
+    # 1. Patron (from Base)
+    if base and base.patron_archivo:
+        ext = base.patron_archivo.split('.')[-1] if '.' in base.patron_archivo else ''
+        patron_name = f"patron.{ext}" if ext else "patron"
+        files.append((f"{folder}/Patron/{patron_name}", base.patron_archivo))
+    
+    # 2. Fichas Generales (from Base)
+    if base and base.fichas_archivos:
+        for i, archivo in enumerate(base.fichas_archivos):
+            nombre = base.fichas_nombres[i] if i < len(base.fichas_nombres or []) else f"ficha_{i+1}"
+            files.append((f"{folder}/Fichas_Generales/{bundle_file_name(nombre, archivo)}", archivo))
+    
+    # 3. Fichas Modelo
+    if modelo.fichas_archivos:
+        for i, archivo in enumerate(modelo.fichas_archivos):
+            nombre = modelo.fichas_nombres[i] if i < len(modelo.fichas_nombres or []) else f"ficha_{i+1}"
+            files.append((f"{folder}/Fichas_Modelo/{bundle_file_name(nombre, archivo)}", archivo))
+    
+    return [(zip_path, file_path) for zip_path, file_path in files if file_path]
+
+def storage_zip_entries(files: List[Tuple[str, str]]) -> List[ZipEntry]:
+    """ZIP entries that read each stored file in chunks when written. The
+    storage key is the source id, so a file placed in several folders (the
+    base patron of many modelos) is fetched once."""
+    return [
+        ZipEntry(
+            zip_path,
+            lambda key=storage_key_from_path(file_path): storage.iter_chunks(key, ZIP_READ_CHUNK_SIZE),
+            source_id=storage_key_from_path(file_path)
+        )
+        for zip_path, file_path in files
+    ]
+
+async def stored_sizes(keys: List[str]) -> dict:
+    """Sizes of the stored objects that exist, asking the storage backend
+    (at most ZIP_FETCH_CONCURRENCY at a time); missing keys are left out"""
+    keys = list(set(keys))
+    slots = asyncio.Semaphore(ZIP_FETCH_CONCURRENCY)
+    
+    async def size(key: str) -> Optional[int]:
+        async with slots:
+            try:
+                return await storage.size(key)
+            except Exception as e:
+                logging.warning(f"Could not get the size of {key}: {e}")
+                return None
     
-    # Accept token from query param or Authorization header
+    sizes = await asyncio.gather(*(size(key) for key in keys))
+    return {key: size for key, size in zip(keys, sizes) if size is not None}
+
+def zip_length(entries: List[ZipEntry], sizes: dict) -> Optional[int]:
+    """Exact archive size when every entry will be stored uncompressed
+    (PDFs, spreadsheets, images...) and exists in storage, filling in entry
+    sizes; None otherwise.
+    
+    sizes must come from the storage backend (stored_sizes) rather than
+    storage_objects: a row doesn't prove the object is still there, and
+    stream_zip skipping an entry would leave the body shorter than the
+    declared length. Once sizes are filled in, stream_zip raises instead of
+    skipping.
+    """
+    if any(compression_for_name(entry.arcname) is None for entry in entries):
+        return None
+    if any(entry.source_id not in sizes for entry in entries):
+        return None
+    for entry in entries:
+        entry.size = sizes[entry.source_id]
+    return archive_size(entries)
+
+# ============ BUNDLE CACHE ============
+# Built ZIP bundles are kept in storage under bundles/<manifest hash>.zip.
+# The manifest lists every zip path with the storage key it comes from, so
+# any change to a file array or display name produces a new hash (a miss);
+# the previous bundle of the same scope is then dropped.
+
+BUNDLE_CACHE_PREFIX = "bundles"
+BUNDLE_LAYOUT_VERSION = 2
+BUNDLE_SPOOL_SIZE = 8 * 1024 * 1024
+BUNDLE_TOUCH_INTERVAL = timedelta(hours=1)
+
+# Keeps references to background bundle uploads so they aren't garbage collected
+bundle_store_tasks: set = set()
+
+def bundle_manifest_hash(files: List[Tuple[str, str]]) -> str:
+    manifest = [BUNDLE_LAYOUT_VERSION] + [[zip_path, storage_key_from_path(file_path)] for zip_path, file_path in files]
+    return hashlib.sha256(json.dumps(manifest, ensure_ascii=False).encode()).hexdigest()
+
+async def drop_bundle_cache(session: AsyncSession, scope: str, keep: Optional[str] = None):
+    """Remove a scope's cached bundles (except `keep`) once the session commits"""
+    query = select(BundleCacheDB).where(BundleCacheDB.scope == scope)
+    if keep is not None:
+        query = query.where(BundleCacheDB.manifest_hash != keep)
+    result = await session.execute(query)
+    for stale in result.scalars().all():
+        schedule_file_deletion(session, stale.file_path)
+        await session.delete(stale)
+
+async def serve_cached_bundle(manifest_hash: str, filename: str, request: Request) -> Optional[Response]:
+    """Response for a cached bundle, or None if there is no usable entry"""
+    async with async_session() as session:
+        result = await session.execute(select(BundleCacheDB).where(BundleCacheDB.manifest_hash == manifest_hash))
+        entry = result.scalar_one_or_none()
+        if entry is None:
+            return None
+        now = datetime.now(timezone.utc)
+        if now - entry.last_used_at > BUNDLE_TOUCH_INTERVAL:
+            entry.last_used_at = now
+            await session.commit()
+    
+    key = storage_key_from_path(entry.file_path)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-cache"}
+    try:
+        if storage.supports_presigned_urls:
+            if await storage.exists(key):
+                url = await storage.presigned_get_url(key, PRESIGNED_URL_EXPIRATION, filename=filename)
+                return RedirectResponse(url=url, headers={"Cache-Control": "no-store"})
+            return None
+        file_path = storage.local_path(key)
+        if file_path is None:
+            return Response(content=await storage.get_bytes(key), media_type="application/zip", headers=headers)
+        if not file_path.is_file():
+            return None
+        response = LocalFileResponse(file_path, request)
+        response.headers.update(headers)
+        return response
+    except (StorageError, FileNotFoundError):
+        return None
+
+async def store_bundle(scope: str, manifest_hash: str, spool, size: int):
+    """Upload a freshly built bundle and make it the scope's cache entry"""
+    key = f"{BUNDLE_CACHE_PREFIX}/{manifest_hash}.zip"
+    
+    async def spool_chunks():
+        while True:
+            chunk = await asyncio.to_thread(spool.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    
+    try:
+        spool.seek(0)
+        await storage.put_stream(key, spool_chunks(), "application/zip")
+        file_path = storage.to_path(key)
+        now = datetime.now(timezone.utc)
+        async with async_session() as session:
+            await drop_bundle_cache(session, scope, keep=manifest_hash)
+            await session.execute(
+                pg_insert(BundleCacheDB).values(
+                    manifest_hash=manifest_hash, scope=scope, file_path=file_path,
+                    size=size, created_at=now, last_used_at=now
+                ).on_conflict_do_nothing(index_elements=[BundleCacheDB.manifest_hash])
+            )
+            await session.commit()
+    except Exception as e:
+        logging.error(f"Error caching bundle {manifest_hash}: {e}")
+    finally:
+        spool.close()
+
+async def cache_bundle_stream(chunks: AsyncIterator[bytes], scope: str, manifest_hash: str, skipped: List[str]) -> AsyncIterator[bytes]:
+    """Pass a ZIP stream through while spooling a copy; complete bundles
+    (nothing skipped, client got everything) are stored in the cache."""
+    spool = tempfile.SpooledTemporaryFile(max_size=BUNDLE_SPOOL_SIZE)
+    size = 0
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(spool.write, chunk)
+            size += len(chunk)
+            yield chunk
+    except BaseException:
+        spool.close()
+        raise
+    if skipped:
+        spool.close()
+        return
+    task = asyncio.create_task(store_bundle(scope, manifest_hash, spool, size))
+    bundle_store_tasks.add(task)
+    task.add_done_callback(bundle_store_tasks.discard)
+
+async def bundle_response(scope: str, files: List[Tuple[str, str]], filename: str, request: Request,
+                          empty_detail: str = "No hay archivos para descargar") -> Response:
+    """Serve a ZIP bundle from the cache, or stream it and cache the result.
+    404 with empty_detail when there are no files or none is in storage."""
+    if not files:
+        raise HTTPException(status_code=404, detail=empty_detail)
+    manifest_hash = bundle_manifest_hash(files)
+    cached = await serve_cached_bundle(manifest_hash, filename, request)
+    if cached is not None:
+        return cached
+    
+    entries = storage_zip_entries(files)
+    sizes = await stored_sizes([entry.source_id for entry in entries])
+    if not sizes:
+        raise HTTPException(status_code=404, detail=empty_detail)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    # Known length lets clients show download progress
+    length = zip_length(entries, sizes)
+    if length is not None:
+        headers["Content-Length"] = str(length)
+    
+    skipped: List[str] = []
+    chunks = stream_zip(entries, concurrency=ZIP_FETCH_CONCURRENCY, skipped=skipped)
+    return StreamingResponse(
+        cache_bundle_stream(chunks, scope, manifest_hash, skipped),
+        media_type="application/zip",
+        headers=headers
+    )
+
+def verify_download_token(token: Optional[str], credentials: Optional[HTTPAuthorizationCredentials]):
+    """Downloads accept the token as a query param (plain links) or a Bearer header"""
     auth_token = token
     if not auth_token and credentials:
         auth_token = credentials.credentials
@@ -2440,6 +3948,68 @@ async def download_modelo_files(item_id: str, token: Optional[str] = None, crede
             raise HTTPException(status_code=401, detail="Token inválido")
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido o expirado")
+
+@api_router.get("/modelos/descargar")
+async def download_modelos_files(request: Request, modelo_ids: Optional[str] = None, base_id: Optional[str] = None, token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))):
+    """Download several modelos as one ZIP, with a folder per modelo
+    
+    modelo_ids is a comma-separated list of ids; base_id alone means every
+    modelo of that base (both together narrow the list to that base).
+    Files shared by several modelos, like the base patron, are fetched from
+    storage once.
+    """
+    verify_download_token(token, credentials)
+    
+    ids = [i.strip() for i in (modelo_ids or "").split(",") if i.strip()]
+    if not ids and not base_id:
+        raise HTTPException(status_code=400, detail="Se requiere modelo_ids o base_id")
+    
+    async with async_session() as session:
+        query = select(ModeloDB)
+        if ids:
+            query = query.where(ModeloDB.id.in_(ids))
+        if base_id:
+            query = query.where(ModeloDB.base_id == base_id)
+        result = await session.execute(query.order_by(ModeloDB.orden, ModeloDB.nombre))
+        modelos = result.scalars().all()
+        if ids and len(modelos) < len(set(ids)) and not base_id:
+            raise HTTPException(status_code=404, detail="Modelo no encontrado")
+        if not modelos:
+            raise HTTPException(status_code=404, detail="No hay modelos para descargar")
+        
+        base_ids = {m.base_id for m in modelos if m.base_id} | ({base_id} if base_id else set())
+        result = await session.execute(select(BaseDB).where(BaseDB.id.in_(base_ids)))
+        bases = {b.id: b for b in result.scalars().all()}
+    
+    files = []
+    folders = set()
+    for modelo in modelos:
+        folder = bundle_folder_name(modelo.nombre, modelo.id)
+        if folder in folders:
+            folder = f"{folder}_{modelo.id[:8]}"
+        folders.add(folder)
+        files.extend(modelo_bundle_files(modelo, bases.get(modelo.base_id), folder))
+    
+    if base_id and not ids:
+        scope = f"base:{base_id}"
+        base = bases.get(base_id)
+        archive_name = bundle_folder_name(base.nombre if base else None, base_id)
+    else:
+        scope = "modelos:" + hashlib.sha256(",".join(sorted(m.id for m in modelos)).encode()).hexdigest()
+        archive_name = "Modelos"
+    return await bundle_response(scope, files, f"{archive_name}.zip", request,
+                                 "No hay archivos para descargar en estos modelos")
+
+@api_router.get("/modelos/{item_id}/descargar")
+async def download_modelo_files(item_id: str, request: Request, token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))):
+    """Download all model files as ZIP: patron, fichas generales (base), fichas modelo
+    
+    The archive is streamed: files are fetched from storage concurrently
+    (ZIP_FETCH_CONCURRENCY at a time) and written into the ZIP, in order,
+    while the response is already being sent. Built bundles are cached until
+    the modelo's (or its base's) files change.
+    """
+    verify_download_token(token, credentials)
     
     async with async_session() as session:
         result = await session.execute(select(ModeloDB).where(ModeloDB.id == item_id))
@@ -2451,69 +4021,11 @@ async def download_modelo_files(item_id: str, token: Optional[str] = None, crede
         if modelo.base_id:
             result = await session.execute(select(BaseDB).where(BaseDB.id == modelo.base_id))
             base = result.scalar_one_or_none()
-        
-        # Build folder name from modelo nombre
-        folder_name = modelo.nombre or f"Modelo_{item_id[:8]}"
-        safe_folder = "".join(c for c in folder_name if c.isalnum() or c in (' ', '-', '_', '.')).strip()
-        if not safe_folder:
-            safe_folder = f"Modelo_{item_id[:8]}"
-        
-        buffer = BytesIO()
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            files_added = 0
-            
-            def download_and_add(file_path, zip_path):
-                nonlocal files_added
-                if not file_path:
-                    return
-                try:
-                    key = file_path
-                    if key.startswith("r2://"):
-                        key = key[5:]
-                    if r2_client:
-                        response = r2_client.get_object(Bucket=R2_BUCKET_NAME, Key=key)
-                        file_bytes = response['Body'].read()
-                    else:
-                        local_path = UPLOADS_DIR / key
-                        if not local_path.exists():
-                            return
-                        file_bytes = local_path.read_bytes()
-                    zf.writestr(zip_path, file_bytes)
-                    files_added += 1
-                except Exception as e:
-                    logging.error(f"Error downloading file {file_path}: {e}")
-            
-            # 1. Patron (from Base)
-            if base and base.patron_archivo:
-                ext = base.patron_archivo.split('.')[-1] if '.' in base.patron_archivo else ''
-                patron_name = f"patron.{ext}" if ext else "patron"
-                download_and_add(base.patron_archivo, f"{safe_folder}/Patron/{patron_name}")
-            
-            # 2. Fichas Generales (from Base)
-            if base and base.fichas_archivos:
-                for i, archivo in enumerate(base.fichas_archivos):
-                    nombre = base.fichas_nombres[i] if i < len(base.fichas_nombres or []) else f"ficha_{i+1}"
-                    ext = archivo.split('.')[-1] if '.' in archivo else ''
-                    filename = f"{nombre}.{ext}" if ext and not nombre.endswith(f".{ext}") else nombre
-                    download_and_add(archivo, f"{safe_folder}/Fichas_Generales/{filename}")
-            
-            # 3. Fichas Modelo
-            if modelo.fichas_archivos:
-                for i, archivo in enumerate(modelo.fichas_archivos):
-                    nombre = modelo.fichas_nombres[i] if i < len(modelo.fichas_nombres or []) else f"ficha_{i+1}"
-                    ext = archivo.split('.')[-1] if '.' in archivo else ''
-                    filename = f"{nombre}.{ext}" if ext and not nombre.endswith(f".{ext}") else nombre
-                    download_and_add(archivo, f"{safe_folder}/Fichas_Modelo/{filename}")
-            
-            if files_added == 0:
-                raise HTTPException(status_code=404, detail="No hay archivos para descargar en este modelo")
-        
-        buffer.seek(0)
-        return StreamingResponse(
-            buffer,
-            media_type="application/zip",
-            headers={"Content-Disposition": f'attachment; filename="{safe_folder}.zip"'}
-        )
+    
+    safe_folder = bundle_folder_name(modelo.nombre, item_id)
+    files = modelo_bundle_files(modelo, base, safe_folder)
+    return await bundle_response(f"modelo:{item_id}", files, f"{safe_folder}.zip", request,
+                                 "No hay archivos para descargar en este modelo")
 
 @api_router.post("/modelos/{modelo_id}/fichas")
 async def upload_fichas_modelo(modelo_id: str, files: List[UploadFile] = File(...), nombres: List[str] = Form(default=[])):
@@ -2525,17 +4037,7 @@ async def upload_fichas_modelo(modelo_id: str, files: List[UploadFile] = File(..
         if not files:
             raise HTTPException(status_code=400, detail="Se requiere al menos un archivo")
         
-        file_paths = []
-        new_nombres = []
-        for i, file in enumerate(files):
-            custom_name = nombres[i] if i < len(nombres) and nombres[i] else None
-            file_path = await save_upload_file(file, "fichas_modelos", custom_name)
-            file_paths.append(file_path)
-            
-            if custom_name:
-                new_nombres.append(custom_name)
-            else:
-                new_nombres.append(file.filename or file_path.split('/')[-1])
+        file_paths, new_nombres = await save_upload_files(files, "fichas_modelos", nombres, session)
         
         item.fichas_archivos = (item.fichas_archivos or []) + file_paths
         item.fichas_nombres = (item.fichas_nombres or []) + new_nombres
@@ -2557,9 +4059,8 @@ async def delete_ficha_modelo(modelo_id: str, file_index: int):
         if file_index < 0 or file_index >= len(fichas):
             raise HTTPException(status_code=400, detail="Índice inválido")
         
-        # Delete file from R2
-        file_to_delete = fichas[file_index]
-        delete_r2_file(file_to_delete)
+        # Delete file from storage once the change commits
+        schedule_file_deletion(session, fichas[file_index])
         
         fichas.pop(file_index)
         if file_index < len(nombres):
@@ -2629,9 +4130,8 @@ async def delete_ficha_item(item_id: str):
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
         
-        # Delete associated file from R2
-        if item.archivo:
-            delete_r2_file(item.archivo)
+        # Delete associated file from storage once the delete commits
+        schedule_file_deletion(session, item.archivo)
         
         await session.delete(item)
         await session.commit()
@@ -2651,7 +4151,9 @@ async def upload_ficha_archivo(item_id: str, file: UploadFile = File(...)):
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
         # Use original filename
-        file_path = await save_upload_file(file, "fichas", None)
+        file_path = await save_upload_file(file, "fichas", None, session)
+        # Delete the replaced file once the change commits
+        schedule_file_deletion(session, item.archivo)
         item.archivo = file_path
         item.updated_at = datetime.now(timezone.utc)
         await session.commit()
@@ -2708,9 +4210,8 @@ async def delete_tizado_item(item_id: str, current_user: UsuarioDB = Depends(get
         
         await log_audit(session, current_user, "ELIMINAR", "Tizado", item.id, item.nombre, detalles={"datos_completos": serialize_db_item(item)})
         
-        # Delete associated file from R2
-        if item.archivo_tizado:
-            delete_r2_file(item.archivo_tizado)
+        # Delete associated file from storage once the delete commits
+        schedule_file_deletion(session, item.archivo_tizado)
         
         await session.delete(item)
         await session.commit()
@@ -2730,12 +4231,25 @@ async def upload_tizado_archivo(item_id: str, file: UploadFile = File(...)):
         if not item:
             raise HTTPException(status_code=404, detail="No encontrado")
         # Use original filename
-        file_path = await save_upload_file(file, "tizados", None)
+        file_path = await save_upload_file(file, "tizados", None, session)
+        # Delete the replaced file once the change commits
+        schedule_file_deletion(session, item.archivo_tizado)
         item.archivo_tizado = file_path
         item.updated_at = datetime.now(timezone.utc)
         await session.commit()
         return {"file_path": file_path}
 
+# ============ JOBS ROUTES ============
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: UsuarioDB = Depends(get_current_user)):
+    """Status, progress, result or error of a queued job"""
+    async with async_session() as session:
+        job = await session.get(JobDB, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+        return serialize_job(job)
+
 # ============ AUDIT LOG ROUTES ============
 
 @api_router.get("/audit-logs")
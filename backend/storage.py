@@ -0,0 +1,450 @@
+"""Storage backends for uploaded and generated files.
+
+server.py talks to a single StorageBackend instance; which implementation is
+used depends on configuration:
+
+- S3Storage: any S3-compatible service (Cloudflare R2 in production, a moto
+  or MinIO server for offline tests and benchmarks).
+- LocalStorage: files under a directory on disk (development without R2).
+- MemoryStorage: a dict, for unit tests.
+
+Keys look like "category/filename". Each backend also knows how its keys are
+written into the database (S3 keys keep the historical "r2://" prefix).
+"""
+import asyncio
+import os
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session as get_aiobotocore_session
+from botocore.exceptions import ClientError
+
+S3_PATH_PREFIX = "r2://"
+S3_DELETE_BATCH = 1000
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+class StorageError(Exception):
+    """Raised when a storage operation fails"""
+
+def key_from_path(file_path: str) -> str:
+    """Strip the "r2://" prefix stored in the database, if any"""
+    if file_path.startswith(S3_PATH_PREFIX):
+        return file_path[len(S3_PATH_PREFIX):]
+    return file_path
+
+async def iter_bytes(data: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
+
+class StorageBackend(ABC):
+    """Interface every storage backend implements"""
+
+    name = "abstract"
+    # Whether browsers can upload/download directly with presigned URLs
+    supports_presigned_urls = False
+
+    async def start(self):
+        """Open connections (called on app startup)"""
+
+    async def close(self):
+        """Release connections (called on app shutdown)"""
+
+    def to_path(self, key: str) -> str:
+        """Value written into the database for a stored key"""
+        return key
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool: ...
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """Size in bytes, or None if the object does not exist"""
+
+    @abstractmethod
+    async def put_bytes(self, key: str, data: bytes, content_type: str = "application/octet-stream",
+                        cache_control: Optional[str] = None):
+        """Store bytes; cache_control is kept as object metadata where supported"""
+
+    @abstractmethod
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str = "application/octet-stream"):
+        """Store an async stream of chunks, holding at most one chunk in memory"""
+
+    @abstractmethod
+    async def get_bytes(self, key: str) -> bytes:
+        """Read a whole object. Raises FileNotFoundError if it is missing"""
+
+    @abstractmethod
+    async def iter_chunks(self, key: str, chunk_size: int = DEFAULT_PART_SIZE) -> AsyncIterator[bytes]:
+        """Read an object in chunks. Raises FileNotFoundError if it is missing"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Delete an object; deleting a missing object is not an error"""
+
+    async def delete_many(self, keys: Iterable[str]) -> List[str]:
+        """Delete several objects, returning the keys that could not be deleted"""
+        keys = list(keys)
+        results = await asyncio.gather(*(self.delete(key) for key in keys), return_exceptions=True)
+        return [key for key, result in zip(keys, results) if isinstance(result, Exception)]
+
+    @abstractmethod
+    def list_objects(self, prefix: str = "") -> AsyncIterator[Tuple[str, datetime]]:
+        """Yield (key, last_modified) for every object under prefix"""
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path on disk for backends that keep files locally"""
+        return None
+
+    async def presigned_get_url(self, key: str, expires_in: int, filename: Optional[str] = None) -> Optional[str]:
+        """Temporary download URL; filename makes it download as an attachment"""
+        return None
+
+    async def presigned_put_url(self, key: str, content_type: str, expires_in: int,
+                                checksum_sha256: Optional[str] = None) -> str:
+        """Temporary upload URL. With checksum_sha256 (base64) the URL only
+        accepts that content, sent with an x-amz-checksum-sha256 header"""
+        raise StorageError(f"{self.name} storage does not support presigned uploads")
+
+    async def create_multipart_upload(self, key: str, content_type: str) -> str:
+        raise StorageError(f"{self.name} storage does not support multipart uploads")
+
+    async def presigned_part_url(self, key: str, upload_id: str, part_number: int, expires_in: int) -> str:
+        raise StorageError(f"{self.name} storage does not support multipart uploads")
+
+    async def complete_multipart_upload(self, key: str, upload_id: str, parts: List[Dict]):
+        raise StorageError(f"{self.name} storage does not support multipart uploads")
+
+    async def abort_multipart_upload(self, key: str, upload_id: str):
+        raise StorageError(f"{self.name} storage does not support multipart uploads")
+
+# ============ S3 / R2 ============
+
+class S3Storage(StorageBackend):
+    """S3-compatible object storage through a shared aiobotocore client"""
+
+    name = "s3"
+    supports_presigned_urls = True
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str], access_key_id: str, secret_access_key: str,
+                 region: str = "auto", max_pool_connections: int = 50, connect_timeout: float = 5,
+                 read_timeout: float = 60, max_attempts: int = 3, part_size: int = DEFAULT_PART_SIZE):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.max_pool_connections = max_pool_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self.part_size = part_size
+        self.client = None
+        self._client_context = None
+
+    async def start(self):
+        if self.client is not None:
+            return
+        self._client_context = get_aiobotocore_session().create_client(
+            's3',
+            endpoint_url=self.endpoint_url,
+            aws_access_key_id=self.access_key_id,
+            aws_secret_access_key=self.secret_access_key,
+            config=AioConfig(
+                signature_version='s3v4',
+                max_pool_connections=self.max_pool_connections,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                retries={'max_attempts': self.max_attempts, 'mode': 'standard'},
+            ),
+            region_name=self.region
+        )
+        self.client = await self._client_context.__aenter__()
+
+    async def close(self):
+        if self._client_context is not None:
+            await self._client_context.__aexit__(None, None, None)
+        self.client = None
+        self._client_context = None
+
+    def to_path(self, key: str) -> str:
+        return f"{S3_PATH_PREFIX}{key}"
+
+    @staticmethod
+    def _is_not_found(error: ClientError) -> bool:
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            head = await self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return head['ContentLength']
+
+    async def put_bytes(self, key: str, data: bytes, content_type: str = "application/octet-stream",
+                        cache_control: Optional[str] = None):
+        extra = {'CacheControl': cache_control} if cache_control else {}
+        await self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type, **extra)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str = "application/octet-stream"):
+        """Streams that fit in a single part use put_object; larger ones use a
+        multipart upload that is aborted if anything fails midway.
+
+        Chunks are buffered into parts of at least part_size (S3 rejects
+        smaller parts except the last), whatever size the source yields."""
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer.extend(chunk)
+            if len(buffer) >= self.part_size:
+                break
+        else:
+            await self.put_bytes(key, bytes(buffer), content_type)
+            return
+
+        upload_id = await self.create_multipart_upload(key, content_type)
+        parts = []
+
+        async def upload_part(data: bytearray):
+            part_number = len(parts) + 1
+            response = await self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=bytes(data)
+            )
+            parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+        try:
+            async for chunk in chunks:
+                if len(buffer) >= self.part_size:
+                    await upload_part(buffer)
+                    buffer = bytearray()
+                buffer.extend(chunk)
+            if buffer:
+                await upload_part(buffer)
+            await self.complete_multipart_upload(key, upload_id, parts)
+        except BaseException:
+            try:
+                await self.abort_multipart_upload(key, upload_id)
+            except Exception:
+                pass
+            raise
+
+    async def _get_object(self, key: str):
+        try:
+            return await self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self._is_not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    async def get_bytes(self, key: str) -> bytes:
+        response = await self._get_object(key)
+        async with response['Body'] as stream:
+            return await stream.read()
+
+    async def iter_chunks(self, key: str, chunk_size: int = DEFAULT_PART_SIZE) -> AsyncIterator[bytes]:
+        response = await self._get_object(key)
+        body = response['Body']
+        try:
+            async for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete(self, key: str):
+        await self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    async def delete_many(self, keys: Iterable[str]) -> List[str]:
+        """Delete in batches of up to 1000 keys per DeleteObjects request"""
+        keys = list(keys)
+        failed = []
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            batch = keys[start:start + S3_DELETE_BATCH]
+            response = await self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            failed.extend(error['Key'] for error in response.get('Errors', []))
+        return failed
+
+    async def list_objects(self, prefix: str = "") -> AsyncIterator[Tuple[str, datetime]]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['LastModified']
+
+    async def presigned_get_url(self, key: str, expires_in: int, filename: Optional[str] = None) -> Optional[str]:
+        params = {'Bucket': self.bucket, 'Key': key}
+        if filename:
+            params['ResponseContentDisposition'] = f'attachment; filename="{filename}"'
+        return await self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires_in)
+
+    async def presigned_put_url(self, key: str, content_type: str, expires_in: int,
+                                checksum_sha256: Optional[str] = None) -> str:
+        params = {'Bucket': self.bucket, 'Key': key, 'ContentType': content_type}
+        if checksum_sha256:
+            params['ChecksumSHA256'] = checksum_sha256
+        return await self.client.generate_presigned_url('put_object', Params=params, ExpiresIn=expires_in)
+
+    async def create_multipart_upload(self, key: str, content_type: str) -> str:
+        upload = await self.client.create_multipart_upload(Bucket=self.bucket, Key=key, ContentType=content_type)
+        return upload['UploadId']
+
+    async def presigned_part_url(self, key: str, upload_id: str, part_number: int, expires_in: int) -> str:
+        return await self.client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': self.bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+            ExpiresIn=expires_in
+        )
+
+    async def complete_multipart_upload(self, key: str, upload_id: str, parts: List[Dict]):
+        await self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+
+    async def abort_multipart_upload(self, key: str, upload_id: str):
+        await self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+# ============ LOCAL DISK ============
+
+class LocalStorage(StorageBackend):
+    """Files under a root directory; blocking filesystem calls run in threads"""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise StorageError(f"Invalid storage key: {key}")
+        return path
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self.local_path(key).is_file)
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            stat_result = await asyncio.to_thread(self.local_path(key).stat)
+        except FileNotFoundError:
+            return None
+        return stat_result.st_size
+
+    async def put_bytes(self, key: str, data: bytes, content_type: str = "application/octet-stream",
+                        cache_control: Optional[str] = None):
+        await self.put_stream(key, iter_bytes(data, DEFAULT_PART_SIZE), content_type)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str = "application/octet-stream"):
+        """Write atomically (temp file + rename) so readers never see partial files"""
+        path = self.local_path(key)
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.part")
+        buffer = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(buffer.write, chunk)
+            buffer.close()
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            buffer.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    async def get_bytes(self, key: str) -> bytes:
+        return await asyncio.to_thread(self.local_path(key).read_bytes)
+
+    async def iter_chunks(self, key: str, chunk_size: int = DEFAULT_PART_SIZE) -> AsyncIterator[bytes]:
+        file = await asyncio.to_thread(open, self.local_path(key), "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(file.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            file.close()
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.local_path(key).unlink, missing_ok=True)
+
+    async def list_objects(self, prefix: str = "") -> AsyncIterator[Tuple[str, datetime]]:
+        def scan(directory: Path) -> List[Tuple[str, datetime, bool]]:
+            entries = []
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append((entry.path, None, True))
+                    elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(".part"):
+                        mtime = datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc)
+                        entries.append((entry.path, mtime, False))
+            return entries
+
+        pending = [self.root]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = await asyncio.to_thread(scan, directory)
+            except FileNotFoundError:
+                continue
+            for path, mtime, is_dir in sorted(entries):
+                if is_dir:
+                    pending.append(Path(path))
+                    continue
+                key = Path(path).relative_to(self.root).as_posix()
+                if key.startswith(prefix):
+                    yield key, mtime
+
+# ============ IN MEMORY ============
+
+class MemoryStorage(StorageBackend):
+    """Objects kept in a dict; for tests"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.objects: Dict[str, Tuple[bytes, str, datetime]] = {}
+
+    async def exists(self, key: str) -> bool:
+        return key in self.objects
+
+    async def size(self, key: str) -> Optional[int]:
+        obj = self.objects.get(key)
+        return len(obj[0]) if obj else None
+
+    async def put_bytes(self, key: str, data: bytes, content_type: str = "application/octet-stream",
+                        cache_control: Optional[str] = None):
+        self.objects[key] = (bytes(data), content_type, datetime.now(timezone.utc))
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str = "application/octet-stream"):
+        data = bytearray()
+        async for chunk in chunks:
+            data.extend(chunk)
+        await self.put_bytes(key, bytes(data), content_type)
+
+    async def get_bytes(self, key: str) -> bytes:
+        if key not in self.objects:
+            raise FileNotFoundError(key)
+        return self.objects[key][0]
+
+    async def iter_chunks(self, key: str, chunk_size: int = DEFAULT_PART_SIZE) -> AsyncIterator[bytes]:
+        data = await self.get_bytes(key)
+        async for chunk in iter_bytes(data, chunk_size):
+            yield chunk
+
+    async def delete(self, key: str):
+        self.objects.pop(key, None)
+
+    async def list_objects(self, prefix: str = "") -> AsyncIterator[Tuple[str, datetime]]:
+        for key in sorted(self.objects):
+            if key.startswith(prefix):
+                yield key, self.objects[key][2]
@@ -0,0 +1,184 @@
+"""
+Test suite for ZIP bundle downloads (needs DATABASE_URL, skipped without it).
+Runs against a throwaway schema with the in-memory storage backend.
+Tests:
+1. Content-Length is declared when every file exists and matches the body
+2. No Content-Length when a file is missing from storage, even with its storage_objects row
+3. 404 when none of the files is in storage
+4. Built bundles are cached and served again while the manifest is unchanged
+5. A changed manifest misses and replaces the scope's previous bundle
+6. Deleting a base drops its cached bundles
+"""
+import asyncio
+import io
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL not set")
+
+if DATABASE_URL:
+    os.environ["DB_SCHEMA"] = "muestra_test"
+    os.environ["STORAGE_BACKEND"] = "memory"
+    import server
+    from fastapi import HTTPException
+    from sqlalchemy import delete, select, text
+    from starlette.requests import Request
+    from storage import MemoryStorage
+
+def run(test):
+    """Run test() in a fresh event loop, closing pooled connections after"""
+    async def main():
+        try:
+            return await test()
+        finally:
+            await server.engine.dispose()
+    return asyncio.run(main())
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    run(lambda: server.run_migrations(server.engine, server.DB_SCHEMA, server.Base.metadata))
+    yield
+    async def drop():
+        async with server.engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {server.DB_SCHEMA} CASCADE"))
+    run(drop)
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch):
+    async def clean():
+        async with server.async_session() as session:
+            for model in (server.BundleCacheDB, server.StorageDeletionDB, server.StorageObjectDB):
+                await session.execute(delete(model))
+            await session.commit()
+    run(clean)
+    memory = MemoryStorage()
+    monkeypatch.setattr(server, "storage", memory)
+    return memory
+
+def request() -> "Request":
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+async def download(scope: str, files) -> tuple:
+    """(response, body) of a bundle, waiting for it to be cached"""
+    response = await server.bundle_response(scope, files, "Modelo.zip", request())
+    if hasattr(response, "body_iterator"):
+        body = b"".join([chunk async for chunk in response.body_iterator])
+    else:
+        body = response.body
+    await asyncio.gather(*server.bundle_store_tasks)
+    return response, body
+
+FILES = [
+    ("Modelo/Patron/patron.pdf", "patrones/patron.pdf"),
+    ("Modelo/Fichas_Modelo/ficha.xlsx", "fichas_modelos/ficha.xlsx"),
+]
+
+class TestBundleResponse:
+    """Streaming bundles with a declared length"""
+
+    def test_content_length_matches_body(self, storage):
+        async def test():
+            for _, key in FILES:
+                await storage.put_bytes(key, os.urandom(5000))
+            return await download("modelo:1", FILES)
+
+        response, body = run(test)
+        assert int(response.headers["Content-Length"]) == len(body)
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            assert zf.namelist() == [zip_path for zip_path, _ in FILES]
+
+    def test_no_content_length_with_missing_files(self, storage):
+        async def test():
+            await storage.put_bytes("patrones/patron.pdf", b"%PDF patron")
+            # A reference row without its object
+            async with server.async_session() as session:
+                session.add(server.StorageObjectDB(
+                    key="fichas_modelos/ficha.xlsx", sha256="0" * 64, size=1234,
+                    content_type="application/vnd.ms-excel", ref_count=1
+                ))
+                await session.commit()
+            return await download("modelo:1", FILES)
+
+        response, body = run(test)
+        assert "Content-Length" not in response.headers
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            assert zf.namelist() == ["Modelo/Patron/patron.pdf"]
+
+    def test_all_files_missing_is_404(self, storage):
+        async def test():
+            with pytest.raises(HTTPException) as error:
+                await download("modelo:1", FILES)
+            return error.value
+
+        error = run(test)
+        assert error.status_code == 404
+        assert error.detail == "No hay archivos para descargar"
+
+async def cached_bundles():
+    async with server.async_session() as session:
+        bundles = (await session.execute(select(server.BundleCacheDB))).scalars().all()
+        pending = (await session.execute(select(server.StorageDeletionDB.file_path))).scalars().all()
+        return bundles, pending
+
+class TestBundleCache:
+    """Bundles kept in storage, keyed by their manifest"""
+
+    def test_unchanged_manifest_is_served_from_cache(self, storage):
+        async def test():
+            for _, key in FILES:
+                await storage.put_bytes(key, os.urandom(5000))
+            _, first = await download("modelo:1", FILES)
+            # Not read again: the cached bundle still has it
+            await storage.delete("fichas_modelos/ficha.xlsx")
+            response, second = await download("modelo:1", FILES)
+            return first, response, second, await cached_bundles()
+
+        first, response, second, (bundles, _) = run(test)
+        assert not hasattr(response, "body_iterator")
+        assert second == first
+        [bundle] = bundles
+        assert (bundle.scope, bundle.manifest_hash) == ("modelo:1", server.bundle_manifest_hash(FILES))
+
+    def test_changed_manifest_replaces_previous_bundle(self, storage):
+        renamed = [FILES[0], ("Modelo/Fichas_Modelo/medidas.xlsx", FILES[1][1])]
+
+        async def test():
+            for _, key in FILES:
+                await storage.put_bytes(key, os.urandom(5000))
+            await download("modelo:1", FILES)
+            previous, _ = await cached_bundles()
+            response, body = await download("modelo:1", renamed)
+            return previous, response, body, await cached_bundles()
+
+        [previous], response, body, (bundles, pending) = run(test)
+        assert hasattr(response, "body_iterator")
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            assert zf.namelist() == [zip_path for zip_path, _ in renamed]
+        [bundle] = bundles
+        assert bundle.manifest_hash == server.bundle_manifest_hash(renamed)
+        assert pending == [previous.file_path]
+
+    def test_delete_base_drops_its_bundles(self, storage):
+        async def test():
+            for _, key in FILES:
+                await storage.put_bytes(key, os.urandom(5000))
+            async with server.async_session() as session:
+                base = server.BaseDB(nombre="Base")
+                session.add(base)
+                await session.commit()
+            await download(f"base:{base.id}", FILES)
+            cached, _ = await cached_bundles()
+            await server.delete_base(base.id, current_user=None)
+            return cached, await cached_bundles()
+
+        [cached], (bundles, pending) = run(test)
+        assert bundles == []
+        assert cached.file_path in pending
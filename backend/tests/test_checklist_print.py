@@ -0,0 +1,73 @@
+"""
+Test suite for batch printing of checklists.
+Tests:
+1. GET /api/bases/checklists/imprimir merges the checklists of several bases
+2. tipos limits the checklist types, in the given order
+3. Unknown types, unknown bases and bases without items are rejected
+4. Requires a token
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "username": "admin",
+        "password": "admin123"
+    })
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+@pytest.fixture(scope="module")
+def bases(auth_headers):
+    """Three bases: with estados and avios, with estados only, without items"""
+    estado = requests.post(f"{BASE_URL}/api/estados-costura", json={"nombre": "TEST_Print_Estado"}, headers=auth_headers).json()
+    avio = requests.post(f"{BASE_URL}/api/avios-costura", json={"nombre": "TEST_Print_Avio"}, headers=auth_headers).json()
+    created = [
+        requests.post(f"{BASE_URL}/api/bases", json=data, headers=auth_headers).json()
+        for data in [
+            {"nombre": "TEST_Print_1", "estados_costura_ids": [estado["id"]], "avios_costura_ids": [avio["id"]]},
+            {"nombre": "TEST_Print_2", "estados_costura_ids": [estado["id"]]},
+            {"nombre": "TEST_Print_3"},
+        ]
+    ]
+    # One checklist already stored, the others rendered on the fly
+    requests.post(f"{BASE_URL}/api/bases/{created[1]['id']}/generate-checklist", json={
+        "title": "ESTADOS COSTURA", "items": ["TEST_Print_Estado"]
+    }, headers=auth_headers).raise_for_status()
+    yield [b["id"] for b in created]
+    for base in created:
+        requests.delete(f"{BASE_URL}/api/bases/{base['id']}", headers=auth_headers)
+    requests.delete(f"{BASE_URL}/api/estados-costura/{estado['id']}", headers=auth_headers)
+    requests.delete(f"{BASE_URL}/api/avios-costura/{avio['id']}", headers=auth_headers)
+
+def print_checklists(headers, **params):
+    return requests.get(f"{BASE_URL}/api/bases/checklists/imprimir", params=params, headers=headers)
+
+class TestChecklistPrint:
+    """Merged checklist PDF for several bases"""
+    
+    def test_merges_all_checklists(self, auth_headers, bases):
+        response = print_checklists(auth_headers, base_ids=",".join(bases))
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/pdf"
+        assert response.content.startswith(b"%PDF")
+        assert int(response.headers["content-length"]) == len(response.content)
+    
+    def test_tipos_limit_the_checklists(self, auth_headers, bases):
+        pdfium = pytest.importorskip("pypdfium2")
+        all_pages = len(pdfium.PdfDocument(print_checklists(auth_headers, base_ids=",".join(bases)).content))
+        estados = len(pdfium.PdfDocument(print_checklists(auth_headers, base_ids=",".join(bases), tipos="estados costura").content))
+        avios = len(pdfium.PdfDocument(print_checklists(auth_headers, base_ids=",".join(bases), tipos="AVIOS COSTURA").content))
+        assert (all_pages, estados, avios) == (3, 2, 1)
+    
+    def test_invalid_requests(self, auth_headers, bases):
+        assert print_checklists(auth_headers, base_ids=bases[0], tipos="FICHA").status_code == 400
+        assert print_checklists(auth_headers, base_ids=f"{bases[0]},no-existe").status_code == 404
+        assert print_checklists(auth_headers, base_ids=bases[2]).status_code == 404
+    
+    def test_requires_token(self, bases):
+        assert print_checklists({}, base_ids=bases[0]).status_code in (401, 403)
@@ -0,0 +1,53 @@
+"""
+Test suite for the checklist PDF renderer (no server needed).
+Tests:
+1. Rendering is deterministic for the same input
+2. The render hash covers title, base name, items and layout version
+3. Long item lists spill onto extra pages
+4. The row skeleton is one form XObject placed once per item
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from reportlab import rl_config
+
+import checklists
+from checklists import checklist_render_hash, render_checklist_pdf
+
+ITEMS = ["Pegado de etiqueta", "Remallado", "Basta", "Ojal y botón"]
+
+class TestChecklists:
+    """Checklist rendering and render hashes"""
+
+    def test_rendering_is_deterministic(self):
+        for title in ["ESTADOS COSTURA", "AVIOS COSTURA"]:
+            first = render_checklist_pdf(title, "Base Jean", ITEMS)
+            assert first.startswith(b"%PDF")
+            assert render_checklist_pdf(title, "Base Jean", ITEMS) == first
+        assert render_checklist_pdf("ESTADOS COSTURA", "Base Jean", ITEMS) != render_checklist_pdf("AVIOS COSTURA", "Base Jean", ITEMS)
+
+    def test_render_hash_covers_inputs(self, monkeypatch):
+        reference = checklist_render_hash("ESTADOS COSTURA", "Base Jean", ITEMS)
+        assert checklist_render_hash("ESTADOS COSTURA", "Base Jean", list(ITEMS)) == reference
+        assert checklist_render_hash("AVIOS COSTURA", "Base Jean", ITEMS) != reference
+        assert checklist_render_hash("ESTADOS COSTURA", "Base Polo", ITEMS) != reference
+        assert checklist_render_hash("ESTADOS COSTURA", "Base Jean", ITEMS[::-1]) != reference
+
+        monkeypatch.setattr(checklists, "CHECKLIST_LAYOUT_VERSION", checklists.CHECKLIST_LAYOUT_VERSION + 1)
+        assert checklist_render_hash("ESTADOS COSTURA", "Base Jean", ITEMS) != reference
+
+    def test_long_lists_add_pages(self):
+        short = render_checklist_pdf("ESTADOS COSTURA", "Base", ITEMS)
+        long = render_checklist_pdf("ESTADOS COSTURA", "Base", [f"Item {i}" for i in range(40)])
+        assert short.count(b"/Type /Page\n") == 1
+        assert long.count(b"/Type /Page\n") > 1
+
+    def test_row_skeleton_is_a_shared_form(self, monkeypatch):
+        monkeypatch.setattr(rl_config, "pageCompression", 0)
+        items = [f"Item {i}" for i in range(40)]
+        for title in ["ESTADOS COSTURA", "AVIOS COSTURA"]:
+            pdf = render_checklist_pdf(title, "Base", items)
+            assert pdf.count(b"/Subtype /Form") == 1
+            assert pdf.count(b"/FormXob.checklist_row Do") == len(items)
@@ -0,0 +1,77 @@
+"""
+Test suite for the metrics connection pool (no server needed).
+Tests:
+1. Checkouts are counted and their waits summarized
+2. Pool timeouts are counted and re-raised
+3. pool_status() reports occupancy and settings
+"""
+import asyncio
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.util import greenlet_spawn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db_pool import MetricsQueuePool, PoolMetrics, pool_status
+
+def make_pool(**kwargs) -> MetricsQueuePool:
+    MetricsQueuePool.metrics = PoolMetrics()
+    return MetricsQueuePool(lambda: sqlite3.connect(":memory:"), **kwargs)
+
+def run_in_greenlet(fn):
+    """Async pools block through greenlets, as they do under an AsyncEngine"""
+    return asyncio.run(greenlet_spawn(fn))
+
+class TestPoolMetrics:
+    """Checkout metrics and pool status"""
+
+    def test_checkouts_are_timed(self):
+        metrics = PoolMetrics()
+        for seconds in [0.001, 0.002, 0.010]:
+            metrics.record(seconds)
+        snapshot = metrics.snapshot()
+        assert snapshot["checkouts"] == 3
+        assert snapshot["timeouts"] == 0
+        assert snapshot["wait_ms"]["max"] == 10.0
+        assert snapshot["wait_ms"]["p50"] == 2.0
+        assert snapshot["wait_ms"]["avg"] == pytest.approx(13 / 3, abs=0.01)
+
+        empty = PoolMetrics().snapshot()
+        assert empty["wait_ms"]["avg"] is None and empty["wait_ms"]["p95"] is None
+
+    def test_timeouts_are_counted(self):
+        pool = make_pool(pool_size=1, max_overflow=0, timeout=0.05)
+
+        def exhaust():
+            held = pool.connect()
+            with pytest.raises(exc.TimeoutError):
+                pool.connect()
+            held.close()
+            pool.connect().close()
+
+        run_in_greenlet(exhaust)
+        snapshot = pool.metrics.snapshot()
+        assert snapshot["checkouts"] == 2
+        assert snapshot["timeouts"] == 1
+        assert snapshot["wait_ms"]["max"] >= 50
+
+    def test_pool_status(self):
+        pool = make_pool(pool_size=2, max_overflow=3, timeout=5, recycle=600, pre_ping=True)
+
+        def check():
+            first, second = pool.connect(), pool.connect()
+            status = pool_status(pool)
+            first.close()
+            second.close()
+            return status
+
+        status = run_in_greenlet(check)
+        assert status["size"] == 2
+        assert status["checked_out"] == 2
+        assert status["idle"] == 0
+        assert (status["max_overflow"], status["timeout"], status["recycle"], status["pre_ping"]) == (3, 5, 600, True)
+        assert pool_status(pool)["idle"] == 2
@@ -0,0 +1,164 @@
+"""
+Test suite for direct uploads (needs DATABASE_URL, skipped without it).
+Runs against a throwaway schema with an in-memory storage that presigns URLs.
+Tests:
+1. Completing an upload attaches the file and schedules deletion of the one it replaces
+2. Completing the same upload again is rejected and keeps the attached file
+3. Content already stored is not uploaded again, only referenced
+4. Content that doesn't match the declared hash is rejected and deleted
+"""
+import asyncio
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import MemoryStorage
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL not set")
+
+if DATABASE_URL:
+    os.environ["DB_SCHEMA"] = "muestra_test"
+    os.environ["STORAGE_BACKEND"] = "memory"
+    import server
+    from fastapi import HTTPException
+    from sqlalchemy import delete, select, text
+
+class PresigningStorage(MemoryStorage):
+    """In-memory storage pretending to hand out presigned PUT URLs"""
+    supports_presigned_urls = True
+
+    async def presigned_put_url(self, key: str, content_type: str, expires_in: int,
+                                checksum_sha256: str = None) -> str:
+        return f"https://storage.test/{key}"
+
+def run(test):
+    """Run test() in a fresh event loop, closing pooled connections after"""
+    async def main():
+        try:
+            return await test()
+        finally:
+            await server.engine.dispose()
+    return asyncio.run(main())
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    run(lambda: server.run_migrations(server.engine, server.DB_SCHEMA, server.Base.metadata))
+    yield
+    async def drop():
+        async with server.engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {server.DB_SCHEMA} CASCADE"))
+    run(drop)
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch):
+    async def clean():
+        async with server.async_session() as session:
+            for model in (server.FichaDB, server.StorageDeletionDB, server.StorageObjectDB, server.FilePreviewDB):
+                await session.execute(delete(model))
+            await session.commit()
+    run(clean)
+    presigning = PresigningStorage()
+    monkeypatch.setattr(server, "storage", presigning)
+    return presigning
+
+async def create_ficha(archivo=None) -> str:
+    async with server.async_session() as session:
+        ficha = server.FichaDB(nombre="Ficha", archivo=archivo)
+        session.add(ficha)
+        await session.commit()
+        return ficha.id
+
+async def upload(ficha_id: str, content: bytes, declared: bytes = None) -> dict:
+    """Upload content as the ficha's file the way the browser does"""
+    intent = await server.create_upload_intent(
+        server.UploadIntentRequest(
+            entidad="ficha", entidad_id=ficha_id, campo="archivo", filename="ficha.pdf", size=len(content),
+            sha256=hashlib.sha256(declared or content).hexdigest()
+        ),
+        current_user=None,
+    )
+    assert intent["direct"]
+    if not intent.get("stored"):
+        await server.storage.put_bytes(server.storage_key_from_path(intent["file_path"]), content)
+    return intent
+
+async def complete(intent: dict) -> dict:
+    return await server.complete_upload(
+        server.UploadCompleteRequest(upload_token=intent["upload_token"]), current_user=None
+    )
+
+async def state(ficha_id: str):
+    async with server.async_session() as session:
+        ficha = await session.get(server.FichaDB, ficha_id)
+        pending = (await session.execute(select(server.StorageDeletionDB.file_path))).scalars().all()
+        return ficha.archivo, pending
+
+async def ref_counts():
+    async with server.async_session() as session:
+        result = await session.execute(select(server.StorageObjectDB.key, server.StorageObjectDB.ref_count))
+        return dict(result.all())
+
+class TestCompleteUpload:
+    """Attaching direct uploads to their entity"""
+
+    def test_replaces_single_file(self, storage):
+        async def test():
+            ficha_id = await create_ficha(archivo="fichas/anterior.pdf")
+            intent = await upload(ficha_id, b"%PDF nueva")
+            result = await complete(intent)
+            return intent, result, await state(ficha_id)
+
+        intent, result, (archivo, pending) = run(test)
+        assert result["file_path"] == intent["file_path"] == archivo
+        assert archivo.startswith(f"{server.CAS_PREFIX}/")
+        assert pending == ["fichas/anterior.pdf"]
+
+    def test_replayed_token_is_rejected(self, storage):
+        async def test():
+            ficha_id = await create_ficha()
+            intent = await upload(ficha_id, b"%PDF una vez")
+            await complete(intent)
+            with pytest.raises(HTTPException) as error:
+                await complete(intent)
+            return intent, error.value, await state(ficha_id)
+
+        intent, error, (archivo, pending) = run(test)
+        assert error.status_code == 409
+        assert archivo == intent["file_path"]
+        assert pending == []
+        assert intent["file_path"] in storage.objects
+        assert run(ref_counts) == {intent["file_path"]: 1}
+
+    def test_stored_content_is_only_referenced(self, storage):
+        async def test():
+            first = await upload(await create_ficha(), b"%PDF repetida")
+            await complete(first)
+            second = await upload(await create_ficha(), b"%PDF repetida")
+            await complete(second)
+            return first, second
+
+        first, second = run(test)
+        assert "url" in first and second["stored"] and "url" not in second
+        assert second["file_path"] == first["file_path"]
+        assert run(ref_counts) == {first["file_path"]: 2}
+
+    def test_content_not_matching_hash_is_rejected(self, storage):
+        async def test():
+            ficha_id = await create_ficha()
+            intent = await upload(ficha_id, b"%PDF cambiada", declared=b"%PDF declarada")
+            with pytest.raises(HTTPException) as error:
+                await complete(intent)
+            return intent, error.value, await state(ficha_id)
+
+        intent, error, (archivo, pending) = run(test)
+        assert error.status_code == 400
+        assert archivo is None and pending == []
+        assert intent["file_path"] not in storage.objects
+        assert run(ref_counts) == {}
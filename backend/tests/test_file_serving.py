@@ -0,0 +1,80 @@
+"""
+Test suite for local file serving.
+Tests:
+1. Strong ETag, immutable Cache-Control and Accept-Ranges on GET /api/files/...
+2. If-None-Match returns 304
+3. Single byte ranges return 206, unsatisfiable ranges return 416
+4. If-Range with a stale validator falls back to the full file
+5. HEAD returns the GET headers without a body
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+CONTENT = bytes(range(256)) * 40
+
+@pytest.fixture(scope="module")
+def file_url():
+    """Upload a file and return its URL, skipping when files are served from R2"""
+    response = requests.post(
+        f"{BASE_URL}/api/upload/patrones",
+        files={"file": ("test_rango.pdf", CONTENT, "application/pdf")}
+    )
+    assert response.status_code == 200, f"Upload failed: {response.text}"
+    file_path = response.json()["file_path"]
+    if file_path.startswith("r2://"):
+        pytest.skip("Files are served from R2 via presigned redirects")
+    return f"{BASE_URL}/api/files/{file_path}"
+
+class TestLocalFileServing:
+    """Validators, caching and Range support for local storage"""
+    
+    def test_full_response_headers(self, file_url):
+        response = requests.get(file_url)
+        assert response.status_code == 200
+        assert response.content == CONTENT
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert "immutable" in response.headers["Cache-Control"]
+        assert response.headers["ETag"].startswith('"')
+        assert response.headers["Content-Type"] == "application/pdf"
+    
+    def test_if_none_match_returns_304(self, file_url):
+        etag = requests.get(file_url).headers["ETag"]
+        response = requests.get(file_url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+    
+    def test_byte_ranges(self, file_url):
+        response = requests.get(file_url, headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.content == CONTENT[100:200]
+        assert response.headers["Content-Range"] == f"bytes 100-199/{len(CONTENT)}"
+        
+        response = requests.get(file_url, headers={"Range": "bytes=-10"})
+        assert response.status_code == 206
+        assert response.content == CONTENT[-10:]
+        
+        response = requests.get(file_url, headers={"Range": "bytes=10000-"})
+        assert response.status_code == 206
+        assert response.content == CONTENT[10000:]
+    
+    def test_unsatisfiable_range(self, file_url):
+        response = requests.get(file_url, headers={"Range": f"bytes={len(CONTENT)}-"})
+        assert response.status_code == 416
+        assert response.headers["Content-Range"] == f"bytes */{len(CONTENT)}"
+    
+    def test_stale_if_range_sends_full_file(self, file_url):
+        response = requests.get(file_url, headers={"Range": "bytes=0-9", "If-Range": '"otro"'})
+        assert response.status_code == 200
+        assert response.content == CONTENT
+    
+    def test_head_returns_headers_only(self, file_url):
+        get = requests.get(file_url)
+        response = requests.head(file_url)
+        assert response.status_code == 200
+        assert response.content == b""
+        assert response.headers["Content-Length"] == str(len(CONTENT))
+        assert response.headers["ETag"] == get.headers["ETag"]
+        assert response.headers["Accept-Ranges"] == "bytes"
@@ -0,0 +1,85 @@
+"""
+Test suite for `manage.py gc-storage` (needs DATABASE_URL, skipped without it).
+Runs against a throwaway schema with the in-memory storage backend.
+Tests:
+1. Legacy absolute paths map to their category/filename key
+2. Unreferenced objects are deleted, referenced ones (legacy paths included) kept
+3. Objects named like a reference without a category are never deleted
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import MemoryStorage
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL not set")
+
+if DATABASE_URL:
+    os.environ["DB_SCHEMA"] = "muestra_test"
+    os.environ["STORAGE_BACKEND"] = "memory"
+    import manage
+    import server
+    from sqlalchemy import delete, text
+
+def run(test):
+    """Run test() in a fresh event loop, closing pooled connections after"""
+    async def main():
+        try:
+            return await test()
+        finally:
+            await server.engine.dispose()
+    return asyncio.run(main())
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    run(lambda: server.run_migrations(server.engine, server.DB_SCHEMA, server.Base.metadata))
+    yield
+    async def drop():
+        async with server.engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {server.DB_SCHEMA} CASCADE"))
+    run(drop)
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch):
+    async def clean():
+        async with server.async_session() as session:
+            for model in (server.FichaDB, server.StorageObjectDB, server.FilePreviewDB, server.BundleCacheDB):
+                await session.execute(delete(model))
+            await session.commit()
+    run(clean)
+    memory = MemoryStorage()
+    monkeypatch.setattr(server, "storage", memory)
+    monkeypatch.setattr(manage, "storage", memory)
+    return memory
+
+async def gc(storage, references, objects):
+    async with server.async_session() as session:
+        session.add_all(server.FichaDB(nombre="Ficha", archivo=archivo) for archivo in references)
+        await session.commit()
+    for key in objects:
+        await storage.put_bytes(key, b"contenido")
+    await manage.gc_storage(dry_run=False, grace_hours=0, batch_size=100, bundle_max_age_days=30)
+
+def test_legacy_absolute_paths_keep_their_category():
+    assert server.storage_key_from_path("/app/backend/uploads/patrones/patron_x.pdf") == "patrones/patron_x.pdf"
+    assert server.storage_key_from_path(str(server.UPLOADS_DIR / "fichas" / "f.pdf")) == "fichas/f.pdf"
+    assert server.storage_key_from_path("r2://tizados/t.pdf") == "tizados/t.pdf"
+
+def test_deletes_only_unreferenced_objects(storage):
+    run(lambda: gc(
+        storage,
+        ["fichas/actual.pdf", "/srv/viejo/uploads/patrones/patron_x.pdf"],
+        ["fichas/actual.pdf", "patrones/patron_x.pdf", "fichas/huerfana.pdf"],
+    ))
+    assert sorted(storage.objects) == ["fichas/actual.pdf", "patrones/patron_x.pdf"]
+
+def test_references_without_category_are_kept(storage):
+    run(lambda: gc(storage, ["/suelta.pdf"], ["fichas/suelta.pdf", "fichas/otra.pdf"]))
+    assert sorted(storage.objects) == ["fichas/suelta.pdf"]
@@ -0,0 +1,137 @@
+"""
+Test suite for background jobs.
+Tests:
+1. POST /api/bases/regenerar-pdfs queues a job and returns its id
+2. GET /api/jobs/{id} reports progress and the result once finished
+3. A second request while one is active returns the same job
+4. Unknown job ids return 404
+5. Renaming an estado de costura regenerates the checklist of bases using it
+6. Deleting a base's only estado de costura removes its checklist
+"""
+import pytest
+import requests
+import os
+import time
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "username": "admin",
+        "password": "admin123"
+    })
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def wait_for_job(job_id, headers, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/api/jobs/{job_id}", headers=headers)
+        assert response.status_code == 200
+        job = response.json()
+        if job["estado"] in ("COMPLETADO", "ERROR"):
+            return job
+        time.sleep(0.5)
+    pytest.fail(f"Job {job_id} did not finish in {timeout}s")
+
+def find_base(base_id, headers):
+    bases = requests.get(f"{BASE_URL}/api/bases", headers=headers).json()
+    return next(b for b in bases if b["id"] == base_id)
+
+def wait_for_checklist(base_id, headers, previous=None, timeout=60):
+    """File of the base's ESTADOS COSTURA ficha once it differs from previous"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        base = find_base(base_id, headers)
+        if "ESTADOS COSTURA" in base["fichas_nombres"]:
+            file_path = base["fichas_archivos"][base["fichas_nombres"].index("ESTADOS COSTURA")]
+            if file_path != previous:
+                return file_path
+        time.sleep(0.5)
+    pytest.fail(f"Checklist of base {base_id} was not regenerated in {timeout}s")
+
+def wait_for_no_checklist(base_id, headers, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if "ESTADOS COSTURA" not in find_base(base_id, headers)["fichas_nombres"]:
+            return
+        time.sleep(0.5)
+    pytest.fail(f"Checklist of base {base_id} was not removed in {timeout}s")
+
+class TestJobs:
+    """Queued regeneration of checklist PDFs"""
+    
+    def test_regeneration_runs_as_job(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/bases/regenerar-pdfs", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["job_id"]
+        assert data["estado"] in ("PENDIENTE", "EN_PROCESO")
+        
+        # Still queued or running: the same job is returned
+        again = requests.post(f"{BASE_URL}/api/bases/regenerar-pdfs", headers=auth_headers).json()
+        if not again["created"]:
+            assert again["job_id"] == data["job_id"]
+        
+        job = wait_for_job(data["job_id"], auth_headers)
+        assert job["tipo"] == "regenerar_pdfs"
+        assert job["estado"] == "COMPLETADO", job["error"]
+        assert job["progreso_actual"] == job["progreso_total"]
+        assert set(job["resultado"]) >= {"message", "generated", "unchanged", "errors"}
+        assert job["finished_at"] is not None
+        if again["created"]:
+            wait_for_job(again["job_id"], auth_headers)
+    
+    def test_unknown_job_returns_404(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/jobs/no-existe", headers=auth_headers)
+        assert response.status_code == 404
+    
+    def test_requires_auth(self):
+        response = requests.get(f"{BASE_URL}/api/jobs/no-existe")
+        assert response.status_code in (401, 403)
+
+class TestCatalogRegeneration:
+    """Catalog edits regenerate only the checklists that use the edited item"""
+    
+    def test_rename_regenerates_checklist(self, auth_headers):
+        estado = requests.post(f"{BASE_URL}/api/estados-costura", json={
+            "nombre": "TEST_Remallado"
+        }, headers=auth_headers).json()
+        base = requests.post(f"{BASE_URL}/api/bases", json={
+            "nombre": "TEST_Base_Catalogo",
+            "estados_costura_ids": [estado["id"]]
+        }, headers=auth_headers).json()
+        try:
+            requests.put(f"{BASE_URL}/api/estados-costura/{estado['id']}", json={
+                "nombre": "TEST_Remallado 2", "activo": True
+            }, headers=auth_headers).raise_for_status()
+            first = wait_for_checklist(base["id"], auth_headers)
+            
+            requests.put(f"{BASE_URL}/api/estados-costura/{estado['id']}", json={
+                "nombre": "TEST_Remallado 3", "activo": True
+            }, headers=auth_headers).raise_for_status()
+            assert wait_for_checklist(base["id"], auth_headers, previous=first) != first
+        finally:
+            requests.delete(f"{BASE_URL}/api/bases/{base['id']}", headers=auth_headers)
+            requests.delete(f"{BASE_URL}/api/estados-costura/{estado['id']}", headers=auth_headers)
+    
+    def test_deleting_only_item_removes_checklist(self, auth_headers):
+        estado = requests.post(f"{BASE_URL}/api/estados-costura", json={
+            "nombre": "TEST_Unico"
+        }, headers=auth_headers).json()
+        base = requests.post(f"{BASE_URL}/api/bases", json={
+            "nombre": "TEST_Base_Sin_Items",
+            "estados_costura_ids": [estado["id"]]
+        }, headers=auth_headers).json()
+        try:
+            requests.put(f"{BASE_URL}/api/estados-costura/{estado['id']}", json={
+                "nombre": "TEST_Unico 2", "activo": True
+            }, headers=auth_headers).raise_for_status()
+            wait_for_checklist(base["id"], auth_headers)
+            
+            requests.delete(f"{BASE_URL}/api/estados-costura/{estado['id']}", headers=auth_headers).raise_for_status()
+            wait_for_no_checklist(base["id"], auth_headers)
+        finally:
+            requests.delete(f"{BASE_URL}/api/bases/{base['id']}", headers=auth_headers)
+            requests.delete(f"{BASE_URL}/api/estados-costura/{estado['id']}", headers=auth_headers)
@@ -0,0 +1,86 @@
+"""
+Test suite for schema migrations (needs DATABASE_URL, skipped without it).
+Tests:
+1. Pending migrations are applied once, in order, and recorded
+2. Concurrent runs wait for each other instead of applying twice
+3. Concurrent index builds replace an invalid index left by a failed build
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from sqlalchemy import MetaData, text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from migrations import Migration, create_index_concurrently, migration_status, run_migrations
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '').replace('postgres://', 'postgresql+asyncpg://', 1)
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL not set")
+
+def with_schema(test):
+    """Run test(engine, schema) against a throwaway schema"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    async def run():
+        engine = create_async_engine(DATABASE_URL)
+        schema = f"test_migrations_{uuid.uuid4().hex[:8]}"
+        try:
+            return await test(engine, schema)
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+            await engine.dispose()
+    return asyncio.run(run())
+
+async def create_table(conn, schema, metadata):
+    await conn.execute(text(f"CREATE TABLE {schema}.items (id INTEGER PRIMARY KEY, orden INTEGER)"))
+
+async def add_index(conn, schema, metadata):
+    await asyncio.sleep(0.2)  # keep the lock long enough for runs to overlap
+    await create_index_concurrently(conn, schema, "ix_items_orden", "items", "orden")
+
+MIGRATIONS = [
+    Migration(2, "index", add_index, transactional=False),
+    Migration(1, "table", create_table),
+]
+
+class TestMigrations:
+    """Versioned migrations with an advisory lock"""
+
+    def test_applies_pending_once(self):
+        async def test(engine, schema):
+            assert await run_migrations(engine, schema, MetaData(), MIGRATIONS) == [1, 2]
+            assert await run_migrations(engine, schema, MetaData(), MIGRATIONS) == []
+            return await migration_status(engine, schema, MIGRATIONS)
+
+        assert with_schema(test) == [(1, "table", True), (2, "index", True)]
+
+    def test_concurrent_runs_apply_once(self):
+        async def test(engine, schema):
+            return await asyncio.gather(*(run_migrations(engine, schema, MetaData(), MIGRATIONS) for _ in range(3)))
+
+        results = with_schema(test)
+        assert sorted(results) == [[], [], [1, 2]]
+
+    def test_invalid_index_is_rebuilt(self):
+        async def test(engine, schema):
+            await run_migrations(engine, schema, MetaData(), MIGRATIONS[1:])
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.execute(text(f"INSERT INTO {schema}.items VALUES (1, 5), (2, 5)"))
+                # A failed concurrent build leaves an invalid index behind
+                with pytest.raises(Exception):
+                    await conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY ix_items_orden ON {schema}.items (orden)"))
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await create_index_concurrently(conn, schema, "ix_items_orden", "items", "orden")
+                return await conn.scalar(text(
+                    f"SELECT indisvalid FROM pg_index WHERE indexrelid = '{schema}.ix_items_orden'::regclass"
+                ))
+
+        assert with_schema(test) is True
@@ -0,0 +1,202 @@
+"""
+Test suite for file previews (needs DATABASE_URL, skipped without it).
+Runs against a throwaway schema with the in-memory storage backend.
+Tests:
+1. render_previews() renders PDFs (first page) and images at every variant size
+2. Image previews follow the EXIF orientation
+3. Queued files get their previews stored and listed by load_previews()
+4. Failed renders are retried up to PREVIEW_MAX_ATTEMPTS, then marked ERROR
+5. Claimed rows are committed EN_PROCESO before rendering; stale claims are taken again
+6. Previews of a file deleted while rendering are not kept
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL not set")
+
+if DATABASE_URL:
+    os.environ["DB_SCHEMA"] = "muestra_test"
+    os.environ["STORAGE_BACKEND"] = "memory"
+    import server
+    from sqlalchemy import delete, select, text, update
+    from storage import MemoryStorage
+
+def run(test):
+    """Run test() in a fresh event loop, closing pooled connections after"""
+    async def main():
+        try:
+            return await test()
+        finally:
+            await server.engine.dispose()
+    return asyncio.run(main())
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    run(lambda: server.run_migrations(server.engine, server.DB_SCHEMA, server.Base.metadata))
+    yield
+    async def drop():
+        async with server.engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {server.DB_SCHEMA} CASCADE"))
+    run(drop)
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch):
+    async def clean():
+        async with server.async_session() as session:
+            await session.execute(delete(server.FilePreviewDB))
+            await session.commit()
+    run(clean)
+    memory = MemoryStorage()
+    monkeypatch.setattr(server, "storage", memory)
+    return memory
+
+def image_bytes(size, fmt="PNG", **save_args) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, fmt, **save_args)
+    return buffer.getvalue()
+
+def pdf_bytes(width: float, height: float) -> bytes:
+    from reportlab.pdfgen import canvas
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(width, height))
+    pdf.drawString(20, height / 2, "Ficha")
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+def sizes(previews: dict) -> dict:
+    return {variant: Image.open(BytesIO(data)).size for variant, data in previews.items()}
+
+async def row(key: str):
+    async with server.async_session() as session:
+        return await session.get(server.FilePreviewDB, key)
+
+class TestRenderPreviews:
+    """WebP variants rendered from a source file"""
+
+    def test_image(self):
+        previews = server.render_previews(image_bytes((2000, 1000)), ".png")
+        assert all(data[8:12] == b"WEBP" for data in previews.values())
+        assert sizes(previews) == {"thumb": (320, 160), "medium": (1024, 512)}
+
+    def test_exif_orientation(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90° clockwise
+        previews = server.render_previews(image_bytes((400, 200), "JPEG", exif=exif), ".jpg")
+        assert sizes(previews)["thumb"] == (160, 320)
+
+    def test_pdf_first_page(self):
+        if server.pdfium is None:
+            pytest.skip("pypdfium2 not installed")
+        previews = server.render_previews(pdf_bytes(200, 400), ".pdf")
+        assert sizes(previews) == {"thumb": (160, 320), "medium": (512, 1024)}
+
+class TestPreviewQueue:
+    """Queueing, rendering and retries"""
+
+    def test_queued_file_gets_previews(self, storage):
+        async def test():
+            await storage.put_bytes("objetos/foto.png", image_bytes((800, 600)))
+            await server.enqueue_preview("objetos/foto.png")
+            await server.enqueue_preview("objetos/notas.txt")
+            assert await server.process_previews() == 1
+            async with server.async_session() as session:
+                return await server.load_previews(session, ["objetos/foto.png", "objetos/notas.txt"])
+
+        previews = run(test)
+        assert previews == {"objetos/foto.png": {
+            "thumb": "objetos/foto.png.thumb.webp", "medium": "objetos/foto.png.medium.webp"
+        }}
+        assert "objetos/foto.png.medium.webp" in storage.objects
+
+    def test_failed_render_is_retried_then_error(self, storage):
+        async def test():
+            await storage.put_bytes("objetos/roto.png", b"no es una imagen")
+            await server.enqueue_preview("objetos/roto.png")
+            states = []
+            for _ in range(server.PREVIEW_MAX_ATTEMPTS):
+                await server.process_previews()
+                item = await row("objetos/roto.png")
+                states.append((item.estado, item.attempts))
+            assert await server.process_previews() == 0
+            return states, item
+
+        states, item = run(test)
+        assert states == [("PENDIENTE", 1), ("PENDIENTE", 2), ("ERROR", 3)]
+        assert item.last_error
+
+    def test_rendering_runs_outside_the_claim_transaction(self, storage, monkeypatch):
+        seen = []
+        get_bytes = storage.get_bytes
+
+        async def checking_get_bytes(key):
+            # Another session sees the claim and can lock the row right away
+            async with server.async_session() as session:
+                result = await session.execute(
+                    select(server.FilePreviewDB).where(server.FilePreviewDB.source_key == key)
+                    .with_for_update(nowait=True)
+                )
+                seen.append(result.scalar_one().estado)
+            return await get_bytes(key)
+
+        monkeypatch.setattr(storage, "get_bytes", checking_get_bytes)
+
+        async def test():
+            await storage.put_bytes("objetos/foto.png", image_bytes((100, 100)))
+            await server.enqueue_preview("objetos/foto.png")
+            await server.process_previews()
+            return await row("objetos/foto.png")
+
+        assert run(test).estado == "LISTO"
+        assert seen == ["EN_PROCESO"]
+
+    def test_stale_claim_is_taken_again(self, storage):
+        async def test():
+            await storage.put_bytes("objetos/foto.png", image_bytes((100, 100)))
+            await server.enqueue_preview("objetos/foto.png")
+            await server.claim_previews()
+            # Claimed recently: still owned by its worker
+            assert await server.process_previews() == 0
+            async with server.async_session() as session:
+                await session.execute(
+                    update(server.FilePreviewDB).values(
+                        updated_at=datetime.now(timezone.utc) - timedelta(seconds=server.PREVIEW_STALE_SECONDS + 1)
+                    )
+                )
+                await session.commit()
+            assert await server.process_previews() == 1
+            return await row("objetos/foto.png")
+
+        item = run(test)
+        assert (item.estado, item.attempts) == ("LISTO", 2)
+
+    def test_file_deleted_while_rendering(self, storage, monkeypatch):
+        get_bytes = storage.get_bytes
+
+        async def deleting_get_bytes(key):
+            async with server.async_session() as session:
+                await server.delete_file_previews(session, key)
+                await session.commit()
+            return await get_bytes(key)
+
+        monkeypatch.setattr(storage, "get_bytes", deleting_get_bytes)
+
+        async def test():
+            await storage.put_bytes("objetos/foto.png", image_bytes((100, 100)))
+            await server.enqueue_preview("objetos/foto.png")
+            await server.process_previews()
+            return await row("objetos/foto.png")
+
+        assert run(test) is None
+        assert list(storage.objects) == ["objetos/foto.png"]
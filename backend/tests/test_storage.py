@@ -0,0 +1,159 @@
+"""
+Test suite for the storage backends (no server needed).
+Tests:
+1. put/get/exists/size/delete on the in-memory and local-disk backends
+2. Streaming writes and chunked reads
+3. Listing by prefix and batch deletes
+4. Local keys can't escape the storage root
+5. The S3 backend against a local moto server (skipped without moto)
+6. S3 streams of small chunks are buffered into parts, not truncated
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import LocalStorage, MemoryStorage, S3Storage, StorageError, iter_bytes, key_from_path
+
+@pytest.fixture(params=["memory", "local"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStorage()
+    return LocalStorage(tmp_path / "uploads")
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+class TestStorageBackends:
+    """Behaviour shared by every backend"""
+
+    def test_put_get_delete(self, backend):
+        run(backend.put_bytes("patrones/a.pdf", b"hola", "application/pdf"))
+        assert run(backend.exists("patrones/a.pdf"))
+        assert run(backend.size("patrones/a.pdf")) == 4
+        assert run(backend.get_bytes("patrones/a.pdf")) == b"hola"
+
+        run(backend.delete("patrones/a.pdf"))
+        assert not run(backend.exists("patrones/a.pdf"))
+        assert run(backend.size("patrones/a.pdf")) is None
+        # Deleting a missing object is not an error
+        run(backend.delete("patrones/a.pdf"))
+
+    def test_missing_object_raises(self, backend):
+        with pytest.raises(FileNotFoundError):
+            run(backend.get_bytes("patrones/no_existe.pdf"))
+
+    def test_stream_roundtrip(self, backend):
+        data = bytes(range(256)) * 100
+        run(backend.put_stream("objetos/x.bin", iter_bytes(data, 1000)))
+        chunks = run(collect(backend.iter_chunks("objetos/x.bin", chunk_size=4096)))
+        assert b"".join(chunks) == data
+        assert max(len(c) for c in chunks) <= 4096
+
+    def test_list_and_delete_many(self, backend):
+        for key in ["objetos/1.pdf", "objetos/2.pdf", "costos/3.xlsx"]:
+            run(backend.put_bytes(key, b"x"))
+
+        async def list_keys(prefix):
+            return sorted([key async for key, _ in backend.list_objects(prefix)])
+
+        assert run(list_keys("objetos/")) == ["objetos/1.pdf", "objetos/2.pdf"]
+        assert len(run(list_keys(""))) == 3
+
+        assert run(backend.delete_many(["objetos/1.pdf", "objetos/2.pdf"])) == []
+        assert run(list_keys("")) == ["costos/3.xlsx"]
+
+    def test_stored_path(self, backend):
+        assert backend.to_path("objetos/a.pdf") == "objetos/a.pdf"
+        assert key_from_path("r2://objetos/a.pdf") == "objetos/a.pdf"
+
+class TestLocalStorage:
+    """Local-disk specifics"""
+
+    def test_rejects_keys_outside_root(self, tmp_path):
+        backend = LocalStorage(tmp_path / "uploads")
+        with pytest.raises(StorageError):
+            run(backend.put_bytes("../fuera.txt", b"x"))
+
+    def test_failed_stream_leaves_no_file(self, tmp_path):
+        backend = LocalStorage(tmp_path / "uploads")
+
+        async def failing_chunks():
+            yield b"parcial"
+            raise RuntimeError("conexión cortada")
+
+        with pytest.raises(RuntimeError):
+            run(backend.put_stream("objetos/roto.bin", failing_chunks()))
+        assert not run(backend.exists("objetos/roto.bin"))
+        assert list((tmp_path / "uploads" / "objetos").iterdir()) == []
+
+class TestS3Storage:
+    """S3Storage against an in-process moto server"""
+
+    @pytest.fixture(scope="class")
+    def endpoint(self):
+        pytest.importorskip("moto")
+        import boto3
+        from moto.server import ThreadedMotoServer
+
+        server = ThreadedMotoServer(port=5099, verbose=False)
+        server.start()
+        endpoint = "http://127.0.0.1:5099"
+        boto3.client(
+            "s3", endpoint_url=endpoint, region_name="us-east-1",
+            aws_access_key_id="test", aws_secret_access_key="test"
+        ).create_bucket(Bucket="pruebas")
+        yield endpoint
+        server.stop()
+
+    def test_roundtrip(self, endpoint):
+        backend = S3Storage(
+            bucket="pruebas", endpoint_url=endpoint, region="us-east-1",
+            access_key_id="test", secret_access_key="test", part_size=5 * 1024 * 1024
+        )
+        data = os.urandom(6 * 1024 * 1024)
+
+        async def scenario():
+            await backend.start()
+            try:
+                # Larger than part_size: goes through a multipart upload
+                await backend.put_stream("objetos/grande.bin", iter_bytes(data, 5 * 1024 * 1024))
+                assert await backend.size("objetos/grande.bin") == len(data)
+                assert b"".join(await collect(backend.iter_chunks("objetos/grande.bin", 1024 * 1024))) == data
+                with pytest.raises(FileNotFoundError):
+                    await backend.get_bytes("objetos/no_existe.bin")
+                assert [key async for key, _ in backend.list_objects("objetos/")] == ["objetos/grande.bin"]
+                assert await backend.delete_many(["objetos/grande.bin"]) == []
+                assert not await backend.exists("objetos/grande.bin")
+            finally:
+                await backend.close()
+
+        run(scenario())
+        assert backend.to_path("objetos/a.pdf") == "r2://objetos/a.pdf"
+
+    def test_small_chunks_are_buffered(self, endpoint):
+        backend = S3Storage(
+            bucket="pruebas", endpoint_url=endpoint, region="us-east-1",
+            access_key_id="test", secret_access_key="test", part_size=5 * 1024 * 1024
+        )
+        small = os.urandom(1024 * 1024)
+        large = os.urandom(11 * 1024 * 1024)
+
+        async def scenario():
+            await backend.start()
+            try:
+                # Chunks much smaller than part_size, like an upload read in 256 KB pieces
+                await backend.put_stream("objetos/chico.bin", iter_bytes(small, 256 * 1024))
+                await backend.put_stream("objetos/grande.bin", iter_bytes(large, 256 * 1024))
+                return await backend.get_bytes("objetos/chico.bin"), await backend.get_bytes("objetos/grande.bin")
+            finally:
+                await backend.close()
+
+        assert run(scenario()) == (small, large)
@@ -0,0 +1,277 @@
+"""
+Test suite for the storage deletion outbox (needs DATABASE_URL, skipped without it).
+Runs against a throwaway schema with the in-memory storage backend.
+Tests:
+1. Due entries are claimed and their objects deleted with the last reference
+2. Shared objects only lose a reference
+3. Failed deletes are retried with backoff, without releasing the reference again
+4. Content uploaded again before the retry is kept
+5. Entries are dropped after STORAGE_DELETION_MAX_ATTEMPTS
+6. Deletions of a batch run at most STORAGE_DELETION_CONCURRENCY at a time
+7. A release that doesn't commit with its outbox entry is undone, not repeated
+8. An upload whose row is saved keeps its reference
+9. An upload whose row never commits is released after UPLOAD_GUARD_SECONDS
+"""
+import asyncio
+import hashlib
+import io
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import MemoryStorage
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL not set")
+
+if DATABASE_URL:
+    os.environ["DB_SCHEMA"] = "muestra_test"
+    os.environ["STORAGE_BACKEND"] = "memory"
+    import server
+    from fastapi import UploadFile
+    from sqlalchemy import delete, select, text, update
+
+class FlakyStorage(MemoryStorage):
+    """In-memory storage whose deletes can fail or be slow"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail_deletes = False
+        self.delete_delay = 0.0
+        self.active = 0
+        self.max_active = 0
+
+    async def delete(self, key: str):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delete_delay)
+            if self.fail_deletes:
+                raise ConnectionError("storage unavailable")
+            await super().delete(key)
+        finally:
+            self.active -= 1
+
+def run(test):
+    """Run test() in a fresh event loop, closing pooled connections after"""
+    async def main():
+        try:
+            return await test()
+        finally:
+            await server.engine.dispose()
+    return asyncio.run(main())
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    run(lambda: server.run_migrations(server.engine, server.DB_SCHEMA, server.Base.metadata))
+    yield
+    async def drop():
+        async with server.engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {server.DB_SCHEMA} CASCADE"))
+    run(drop)
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch):
+    async def clean():
+        async with server.async_session() as session:
+            for model in (server.FichaDB, server.StorageDeletionDB, server.StorageObjectDB, server.FilePreviewDB):
+                await session.execute(delete(model))
+            await session.commit()
+    run(clean)
+    flaky = FlakyStorage()
+    monkeypatch.setattr(server, "storage", flaky)
+    return flaky
+
+async def store(content: bytes) -> str:
+    """Store content with one more reference; returns its key"""
+    sha256 = hashlib.sha256(content).hexdigest()
+    key = server.content_addressed_key(sha256, "archivo.bin")
+    await server.store_content_addressed(
+        key, sha256, len(content), "application/octet-stream",
+        lambda: server.storage.put_bytes(key, content)
+    )
+    return key
+
+async def schedule(*keys: str):
+    async with server.async_session() as session:
+        server.schedule_file_deletion(session, *keys)
+        await session.commit()
+
+async def make_due():
+    async with server.async_session() as session:
+        await session.execute(update(server.StorageDeletionDB).values(next_attempt_at=datetime.now(timezone.utc)))
+        await session.commit()
+
+async def rows(model):
+    async with server.async_session() as session:
+        return (await session.execute(select(model))).scalars().all()
+
+class TestStorageDeletions:
+    """Outbox claim, retry and give-up"""
+
+    def test_claims_and_deletes(self, storage):
+        async def test():
+            keys = [await store(f"archivo {i}".encode()) for i in range(3)]
+            await schedule(*keys)
+            assert await server.process_storage_deletions() == 3
+            assert await server.process_storage_deletions() == 0
+            return keys
+
+        keys = run(test)
+        assert not any(key in storage.objects for key in keys)
+        assert run(lambda: rows(server.StorageObjectDB)) == []
+        assert run(lambda: rows(server.StorageDeletionDB)) == []
+
+    def test_shared_object_loses_one_reference(self, storage):
+        async def test():
+            key = await store(b"compartido")
+            await store(b"compartido")
+            await schedule(key)
+            await server.process_storage_deletions()
+            return key, await rows(server.StorageObjectDB)
+
+        key, objects = run(test)
+        assert key in storage.objects
+        assert [obj.ref_count for obj in objects] == [1]
+
+    def test_failed_delete_is_retried_with_backoff(self, storage):
+        async def fail():
+            key = await store(b"reintento")
+            await schedule(key)
+            storage.fail_deletes = True
+            await server.process_storage_deletions()
+            return key, await rows(server.StorageDeletionDB), await rows(server.StorageObjectDB)
+
+        key, entries, objects = run(fail)
+        assert key in storage.objects
+        assert [obj.ref_count for obj in objects] == [0]
+        [entry] = entries
+        assert (entry.attempts, entry.reference_released) == (1, True)
+        assert entry.next_attempt_at > datetime.now(timezone.utc) + timedelta(seconds=3)
+
+        async def retry():
+            # Not due yet
+            assert await server.process_storage_deletions() == 0
+            await make_due()
+            storage.fail_deletes = False
+            assert await server.process_storage_deletions() == 1
+
+        run(retry)
+        assert key not in storage.objects
+        assert run(lambda: rows(server.StorageObjectDB)) == []
+        assert run(lambda: rows(server.StorageDeletionDB)) == []
+
+    def test_content_uploaded_again_before_retry_is_kept(self, storage):
+        async def test():
+            key = await store(b"subido otra vez")
+            await schedule(key)
+            storage.fail_deletes = True
+            await server.process_storage_deletions()
+            storage.fail_deletes = False
+            # Same content uploaded again: the kept object is reused (0 -> 1)
+            assert await store(b"subido otra vez") == key
+            await make_due()
+            assert await server.process_storage_deletions() == 1
+            return key, await rows(server.StorageObjectDB), await rows(server.StorageDeletionDB)
+
+        key, objects, entries = run(test)
+        assert key in storage.objects
+        assert [obj.ref_count for obj in objects] == [1]
+        assert entries == []
+
+    def test_gives_up_after_max_attempts(self, storage):
+        async def test():
+            key = await store(b"sin remedio")
+            await schedule(key)
+            storage.fail_deletes = True
+            async with server.async_session() as session:
+                await session.execute(
+                    update(server.StorageDeletionDB).values(attempts=server.STORAGE_DELETION_MAX_ATTEMPTS - 1)
+                )
+                await session.commit()
+            await server.process_storage_deletions()
+            return await rows(server.StorageDeletionDB)
+
+        assert run(test) == []
+
+    def test_batch_concurrency_is_bounded(self, storage):
+        async def test():
+            keys = [await store(f"lote {i}".encode()) for i in range(12)]
+            storage.delete_delay = 0.05
+            await schedule(*keys)
+            assert await server.process_storage_deletions() == 12
+
+        run(test)
+        assert 1 < storage.max_active <= server.STORAGE_DELETION_CONCURRENCY
+        assert storage.objects == {}
+
+    def test_uncommitted_release_is_not_repeated(self, storage, monkeypatch):
+        release = server.release_stored_file
+
+        async def release_then_fail(session, file_path, reference_released=False):
+            await release(session, file_path, reference_released)
+            raise ConnectionError("conexión perdida")
+
+        async def test():
+            key = await store(b"compartido")
+            await store(b"compartido")
+            await schedule(key)
+            monkeypatch.setattr(server, "release_stored_file", release_then_fail)
+            await server.process_storage_deletions()
+            [entry] = await rows(server.StorageDeletionDB)
+            assert (entry.attempts, entry.reference_released) == (1, False)
+            monkeypatch.setattr(server, "release_stored_file", release)
+            await make_due()
+            await server.process_storage_deletions()
+            return key, await rows(server.StorageObjectDB), await rows(server.StorageDeletionDB)
+
+        key, objects, entries = run(test)
+        assert key in storage.objects
+        assert [obj.ref_count for obj in objects] == [1]
+        assert entries == []
+
+class TestUploadGuard:
+    """References taken for rows that are saved afterwards"""
+
+    async def upload(self, content: bytes, commit: bool) -> str:
+        """Upload content as a new ficha's file the way the handlers do"""
+        async with server.async_session() as session:
+            file = UploadFile(io.BytesIO(content), size=len(content), filename="ficha.pdf")
+            file_path = await server.save_upload_file(file, "fichas", None, session)
+            session.add(server.FichaDB(nombre="Ficha", archivo=file_path))
+            if commit:
+                await session.commit()
+        return file_path
+
+    def test_saved_upload_keeps_its_reference(self, storage):
+        async def test():
+            key = await self.upload(b"%PDF guardada", commit=True)
+            await make_due()
+            assert await server.process_storage_deletions() == 0
+            return key, await rows(server.StorageObjectDB)
+
+        key, objects = run(test)
+        assert key in storage.objects
+        assert [obj.ref_count for obj in objects] == [1]
+
+    def test_unsaved_upload_is_released(self, storage):
+        async def test():
+            await self.upload(b"%PDF compartida", commit=True)
+            key = await self.upload(b"%PDF compartida", commit=False)
+            [entry] = await rows(server.StorageDeletionDB)
+            assert entry.next_attempt_at > datetime.now(timezone.utc) + timedelta(seconds=server.UPLOAD_GUARD_SECONDS - 60)
+            assert await server.process_storage_deletions() == 0
+            await make_due()
+            assert await server.process_storage_deletions() == 1
+            return key, await rows(server.StorageObjectDB), await rows(server.StorageDeletionDB)
+
+        key, objects, entries = run(test)
+        assert key in storage.objects
+        assert [obj.ref_count for obj in objects] == [1]
+        assert entries == []
@@ -0,0 +1,165 @@
+"""
+Test suite for the streaming ZIP writer (no server needed).
+Tests:
+1. Entries are written in order and the archive is valid
+2. Sources are read chunk by chunk and output is produced incrementally
+3. Missing sources are skipped
+4. Concurrent prefetch keeps entry order and overlaps slow sources
+5. Entries sharing a source_id are fetched once
+6. Compression is chosen per entry (by extension, then by probe)
+7. archive_size() matches the written archive when every entry is stored
+8. Missing sources of entries with a size raise instead of being skipped
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from zip_stream import OUTPUT_CHUNK_SIZE, ZipEntry, archive_size, stream_zip
+
+def source(data: bytes, chunk_size: int = 64 * 1024):
+    async def chunks():
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+    return chunks
+
+def missing():
+    async def chunks():
+        raise FileNotFoundError("no existe")
+        yield b""
+    return chunks
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+class TestStreamZip:
+    """Archives produced by stream_zip"""
+
+    def test_entries_roundtrip_in_order(self):
+        files = {
+            "Modelo/Patron/patron.pdf": os.urandom(300 * 1024),
+            "Modelo/Fichas_Generales/ficha.txt": b"medidas " * 10000,
+            "Modelo/Fichas_Modelo/vacio.txt": b"",
+        }
+        entries = [ZipEntry(name, source(data)) for name, data in files.items()]
+        archive = b"".join(asyncio.run(collect(stream_zip(entries))))
+
+        with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+            assert zf.testzip() is None
+            assert zf.namelist() == list(files)
+            for name, data in files.items():
+                assert zf.read(name) == data
+
+    def test_output_is_incremental(self):
+        data = os.urandom(4 * OUTPUT_CHUNK_SIZE)
+        chunks = asyncio.run(collect(stream_zip([ZipEntry("grande.bin", source(data))])))
+        assert len(chunks) > 2
+        assert max(len(c) for c in chunks) < 2 * OUTPUT_CHUNK_SIZE
+
+    def test_missing_sources_are_skipped(self):
+        entries = [
+            ZipEntry("a.txt", source(b"a")),
+            ZipEntry("falta.pdf", missing()),
+            ZipEntry("b.txt", source(b"b")),
+        ]
+        archive = b"".join(asyncio.run(collect(stream_zip(entries))))
+        with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+            assert zf.namelist() == ["a.txt", "b.txt"]
+
+    def test_prefetch_is_concurrent_and_ordered(self):
+        def slow(data: bytes, delay: float):
+            async def chunks():
+                await asyncio.sleep(delay)
+                yield data
+            return chunks
+
+        def broken():
+            async def chunks():
+                yield b"parcial"
+                raise ConnectionError("cortado")
+            return chunks
+
+        entries = [ZipEntry(f"{i}.txt", slow(str(i).encode() * 100, 0.3)) for i in range(4)]
+        entries.insert(2, ZipEntry("roto.txt", broken()))
+
+        start = time.perf_counter()
+        archive = b"".join(asyncio.run(collect(stream_zip(entries, concurrency=4))))
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 1.0  # sequential would take 1.2s
+        with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+            assert zf.namelist() == ["0.txt", "1.txt", "2.txt", "3.txt"]
+            assert zf.read("3.txt") == b"3" * 100
+
+    @pytest.mark.parametrize("concurrency", [1, 3])
+    def test_shared_sources_are_fetched_once(self, concurrency):
+        fetches = []
+
+        def counted(name: str, data: bytes):
+            async def chunks():
+                fetches.append(name)
+                yield data
+            return chunks
+
+        patron = os.urandom(1000)
+        entries = []
+        for modelo in ["A", "B", "C"]:
+            entries.append(ZipEntry(f"{modelo}/Patron/patron.pdf", counted("patron", patron), source_id="patron"))
+            entries.append(ZipEntry(f"{modelo}/ficha.txt", counted(modelo, modelo.encode()), source_id=modelo))
+
+        archive = b"".join(asyncio.run(collect(stream_zip(entries, concurrency=concurrency))))
+        assert sorted(fetches) == ["A", "B", "C", "patron"]
+        with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+            assert zf.namelist() == [entry.arcname for entry in entries]
+            for modelo in ["A", "B", "C"]:
+                assert zf.read(f"{modelo}/Patron/patron.pdf") == patron
+
+    def test_compression_is_chosen_per_entry(self):
+        files = {
+            "ficha.pdf": b"%PDF " * 20000,  # compressible, but stored by extension
+            "medidas.txt": b"medidas " * 20000,
+            "aleatorio.bin": os.urandom(100 * 1024),
+        }
+        entries = [ZipEntry(name, source(data)) for name, data in files.items()]
+        archive = b"".join(asyncio.run(collect(stream_zip(entries))))
+
+        with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+            types = {info.filename: info.compress_type for info in zf.infolist()}
+            assert types == {
+                "ficha.pdf": zipfile.ZIP_STORED,
+                "medidas.txt": zipfile.ZIP_DEFLATED,
+                "aleatorio.bin": zipfile.ZIP_STORED,
+            }
+            for name, data in files.items():
+                assert zf.read(name) == data
+
+    def test_archive_size_is_exact_for_stored_entries(self):
+        files = {
+            "Modelo/Patron/patron.pdf": os.urandom(300 * 1024),
+            "Modelo/Fichas_Generales/Diseño ñandú.xlsx": os.urandom(1234),
+            "Modelo/Fichas_Modelo/vacía.jpg": b"",
+        }
+        entries = [ZipEntry(name, source(data), size=len(data)) for name, data in files.items()]
+        archive = b"".join(asyncio.run(collect(stream_zip(entries, concurrency=2))))
+        assert archive_size(entries) == len(archive)
+
+        # Unknown when a size is missing or an entry may be deflated
+        assert archive_size([ZipEntry("a.pdf", source(b"a"))]) is None
+        assert archive_size([ZipEntry("a.txt", source(b"a"), size=1)]) is None
+
+    @pytest.mark.parametrize("concurrency", [1, 2])
+    def test_sized_entries_are_not_skipped(self, concurrency):
+        # Their size went into a declared length: a shorter archive would break it
+        entries = [
+            ZipEntry("a.pdf", source(b"a"), size=1),
+            ZipEntry("falta.pdf", missing(), size=10),
+        ]
+        with pytest.raises(FileNotFoundError):
+            asyncio.run(collect(stream_zip(entries, concurrency=concurrency)))
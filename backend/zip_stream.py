@@ -0,0 +1,289 @@
+"""Streaming ZIP writer.
+
+Builds a ZIP archive incrementally and yields it as byte chunks, so bundles
+can be sent while they are being assembled: each source is read in chunks and
+only a small output buffer is kept in memory, whatever the archive size.
+
+Sources can be prefetched concurrently: up to `concurrency` upcoming entries
+are downloaded into spooled temporary files (memory, spilling to disk) while
+the archive is written strictly in entry order. Entries sharing a source_id
+are downloaded once and their spool is reused until its last entry.
+
+Compression is chosen per entry: formats that are already compressed (PDF,
+Office files, images, archives) are STORED, anything else is DEFLATEd only
+if a quick probe of its first chunk shows it actually shrinks. When every
+entry is STORED and its size known, archive_size() gives the exact length
+of the archive before it is written.
+"""
+import asyncio
+import io
+import logging
+import struct
+import tempfile
+import zipfile
+import zlib
+from contextlib import aclosing
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Output is handed to the response once this much has accumulated
+OUTPUT_CHUNK_SIZE = 256 * 1024
+# Prefetched sources stay in memory up to this size, then spill to disk
+PREFETCH_SPOOL_SIZE = 2 * 1024 * 1024
+SPOOL_READ_CHUNK_SIZE = 1024 * 1024
+
+# Already compressed formats: deflating them again costs CPU for ~0% gain
+STORED_EXTENSIONS = {
+    "pdf", "xlsx", "xlsm", "docx", "pptx", "odt", "ods",
+    "zip", "gz", "7z", "rar",
+    "jpg", "jpeg", "png", "gif", "webp", "heic",
+    "mp3", "mp4", "mov",
+}
+# Other entries are deflated only if this much of their first chunk
+# compresses (at level 1) below MIN_DEFLATE_RATIO of its size
+COMPRESSION_PROBE_SIZE = 64 * 1024
+MIN_DEFLATE_RATIO = 0.9
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable file object collecting what zipfile writes.
+
+    zipfile detects that it can't seek and writes data descriptors after
+    each entry instead of patching local headers, which is what makes
+    streaming possible.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer.extend(data)
+        return len(data)
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+@dataclass
+class ZipEntry:
+    """One file of the archive.
+
+    source is called when the entry is written and must return an async
+    iterator of chunks. If it fails before yielding its first chunk (e.g.
+    FileNotFoundError) the entry is skipped and logged, unless its size was
+    given: the archive length may have been computed from it (see
+    archive_size), so the error is raised instead. Entries with the
+    same source_id have the same content (e.g. one storage key placed in
+    several folders) and are fetched only once. compression forces
+    ZIP_STORED/ZIP_DEFLATED instead of choosing it from name and content.
+    """
+    arcname: str
+    source: Callable[[], AsyncIterator[bytes]]
+    size: Optional[int] = None
+    source_id: Optional[str] = None
+    compression: Optional[int] = None
+
+def compression_for_name(arcname: str) -> Optional[int]:
+    """ZIP_STORED for already compressed formats, None if content decides"""
+    ext = arcname.rsplit(".", 1)[-1].lower() if "." in arcname else ""
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else None
+
+def probe_compression(sample: bytes) -> int:
+    """ZIP_DEFLATED if a sample of the content compresses well enough"""
+    sample = sample[:COMPRESSION_PROBE_SIZE]
+    if not sample:
+        return zipfile.ZIP_STORED
+    compressed = len(zlib.compress(sample, 1))
+    return zipfile.ZIP_DEFLATED if compressed < len(sample) * MIN_DEFLATE_RATIO else zipfile.ZIP_STORED
+
+def archive_size(entries: Iterable[ZipEntry]) -> Optional[int]:
+    """Exact size of the archive stream_zip writes for entries, or None if it
+    can't be known in advance (a size is missing or an entry may be deflated).
+
+    Mirrors zipfile's layout for an unseekable output: local header, data and
+    data descriptor per entry (ZIP64 extra and descriptor for large entries),
+    then the central directory and end record (plus the ZIP64 end records
+    when offsets or counts overflow). Assumes every entry gets written.
+    """
+    offset = 0
+    central = 0
+    count = 0
+    for entry in entries:
+        compression = entry.compression if entry.compression is not None else compression_for_name(entry.arcname)
+        if entry.size is None or compression != zipfile.ZIP_STORED:
+            return None
+        name = len(zipfile.ZipInfo(entry.arcname)._encodeFilenameFlags()[0])
+        zip64 = entry.size * 1.05 > zipfile.ZIP64_LIMIT
+        header_offset = offset
+        offset += 30 + name + (20 if zip64 else 0) + entry.size + (24 if zip64 else 16)
+        zip64_fields = (2 if entry.size > zipfile.ZIP64_LIMIT else 0) + (1 if header_offset > zipfile.ZIP64_LIMIT else 0)
+        central += 46 + name + (4 + 8 * zip64_fields if zip64_fields else 0)
+        count += 1
+    end = 22
+    if count > zipfile.ZIP_FILECOUNT_LIMIT or offset > zipfile.ZIP64_LIMIT or central > zipfile.ZIP64_LIMIT:
+        end += struct.calcsize(zipfile.structEndArchive64) + struct.calcsize(zipfile.structEndArchive64Locator)
+    return offset + central + end
+
+class ZipStreamWriter:
+    """Thin wrapper around zipfile.ZipFile writing into a _ChunkSink"""
+
+    def __init__(self, compression: int = zipfile.ZIP_DEFLATED, date_time: Optional[datetime] = None):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, "w", compression=compression, allowZip64=True)
+        self.compression = compression
+        self.date_time = (date_time or datetime.now()).timetuple()[:6]
+
+    def open(self, arcname: str, size: Optional[int] = None, compression: Optional[int] = None):
+        info = zipfile.ZipInfo(arcname, date_time=self.date_time)
+        info.compress_type = self.compression if compression is None else compression
+        info.external_attr = 0o644 << 16
+        if size is not None:
+            info.file_size = size
+        return self._zip.open(info, "w", force_zip64=size is not None and size >= zipfile.ZIP64_LIMIT)
+
+    def pending(self) -> int:
+        return self._sink.pending()
+
+    def drain(self) -> bytes:
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._sink.drain()
+
+    def discard(self):
+        """Abandon an unfinished archive: nothing more gets written, not even
+        when the ZipFile is garbage collected"""
+        self._zip.fp = None
+
+class _Spool:
+    """A source downloaded into a SpooledTemporaryFile (or the error it raised)"""
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=PREFETCH_SPOOL_SIZE)
+        self.size = 0
+        self.error: Optional[BaseException] = None
+
+    async def fill(self, entry: ZipEntry) -> "_Spool":
+        try:
+            async for chunk in entry.source():
+                await asyncio.to_thread(self.file.write, chunk)
+                self.size += len(chunk)
+            self.file.seek(0)
+        except Exception as e:
+            self.error = e
+        return self
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        if self.error is not None:
+            raise self.error
+        await asyncio.to_thread(self.file.seek, 0)
+        while True:
+            chunk = await asyncio.to_thread(self.file.read, SPOOL_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+async def _prefetched(entries: List[ZipEntry], concurrency: int) -> AsyncIterator[Tuple[ZipEntry, Callable[[], AsyncIterator[bytes]], Optional[int]]]:
+    """Yield entries in order with a source reading their spooled download,
+    keeping up to `concurrency` downloads running ahead. Each distinct
+    source_id is downloaded once; its spool is closed after its last entry."""
+    ids = [entry.source_id if entry.source_id is not None else f"#{index}" for index, entry in enumerate(entries)]
+    remaining: Dict[str, int] = {}
+    for source_id in ids:
+        remaining[source_id] = remaining.get(source_id, 0) + 1
+    tasks: Dict[str, asyncio.Task] = {}
+    try:
+        for index, entry in enumerate(entries):
+            for ahead in range(index, min(index + concurrency, len(entries))):
+                if ids[ahead] not in tasks:
+                    tasks[ids[ahead]] = asyncio.create_task(_Spool().fill(entries[ahead]))
+            source_id = ids[index]
+            spool = await tasks[source_id]
+            yield entry, spool.chunks, spool.size if spool.error is None else None
+            remaining[source_id] -= 1
+            if not remaining[source_id]:
+                tasks.pop(source_id)
+                spool.close()
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        for task in tasks.values():
+            try:
+                (await task).close()
+            except asyncio.CancelledError:
+                pass
+
+async def _direct(entries: List[ZipEntry]) -> AsyncIterator[Tuple[ZipEntry, Callable[[], AsyncIterator[bytes]], Optional[int]]]:
+    for entry in entries:
+        yield entry, entry.source, entry.size
+
+async def stream_zip(entries: Iterable[ZipEntry], compression: Optional[int] = None,
+                     concurrency: int = 1, skipped: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+    """Yield a ZIP archive of entries, in order, as it is written.
+
+    With concurrency > 1, sources are fetched concurrently (at most that many
+    at a time) so the total time approaches that of the slowest file rather
+    than the sum. Compression runs in a worker thread so the event loop keeps
+    serving other requests while large entries are deflated. Names of entries
+    that had to be skipped are appended to `skipped` if given; entries with a
+    size are never skipped.
+
+    compression applies to every entry without its own; by default each one
+    is chosen from the entry name and a probe of its first chunk.
+
+    Entries sharing a source_id always go through the prefetcher, even with
+    concurrency 1, so their content is fetched once.
+    """
+    entries = list(entries)
+    source_ids = [entry.source_id for entry in entries if entry.source_id is not None]
+    shared = len(set(source_ids)) < len(source_ids)
+    sources = _prefetched(entries, concurrency) if concurrency > 1 or shared else _direct(entries)
+    writer = ZipStreamWriter()
+    async with aclosing(sources):
+        async for entry, source, size in sources:
+            try:
+                chunks = source()
+                first = await anext(chunks, b"")
+            except Exception as e:
+                if entry.size is not None:
+                    writer.discard()
+                    raise
+                if isinstance(e, FileNotFoundError):
+                    logging.warning(f"Skipping missing file in ZIP: {entry.arcname}")
+                else:
+                    logging.error(f"Skipping file in ZIP {entry.arcname}: {e}")
+                if skipped is not None:
+                    skipped.append(entry.arcname)
+                continue
+
+            entry_compression = entry.compression if entry.compression is not None else compression
+            if entry_compression is None:
+                entry_compression = compression_for_name(entry.arcname)
+            if entry_compression is None:
+                entry_compression = probe_compression(first)
+            async with aclosing(chunks):
+                with writer.open(entry.arcname, size, entry_compression) as dest:
+                    chunk = first
+                    while chunk:
+                        await asyncio.to_thread(dest.write, chunk)
+                        if writer.pending() >= OUTPUT_CHUNK_SIZE:
+                            yield writer.drain()
+                        chunk = await anext(chunks, None)
+            if writer.pending() >= OUTPUT_CHUNK_SIZE:
+                yield writer.drain()
+
+    tail = writer.close()
+    if tail:
+        yield tail
@@ -0,0 +1,35 @@
+import { useEffect, useState } from 'react';
+import { getFileUrl, presignFiles } from '../lib/api';
+
+// Download URLs for a list of stored files, fetched with one request instead
+// of one /files redirect per link and refreshed before they expire. The
+// returned function falls back to getFileUrl until they arrive (or if the
+// request fails).
+export function usePresignedUrls(paths) {
+    const [urls, setUrls] = useState({});
+    const key = [...new Set(paths.filter(Boolean))].join('\n');
+
+    useEffect(() => {
+        setUrls({});
+        if (!key) return undefined;
+        let cancelled = false;
+        let timer;
+        const load = async () => {
+            try {
+                const { urls: resolved, expires_in } = await presignFiles(key.split('\n'));
+                if (cancelled) return;
+                setUrls(resolved);
+                timer = setTimeout(load, Math.max(expires_in - 60, 30) * 1000);
+            } catch (error) {
+                console.error('Error presigning files:', error);
+            }
+        };
+        load();
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [key]);
+
+    return (path) => urls[path] || getFileUrl(path);
+}
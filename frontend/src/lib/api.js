@@ -31,6 +31,66 @@ api.interceptors.response.use(
     }
 );
 
+const sha256Hex = async (file) => {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+// Direct uploads: the browser PUTs the file straight to R2 using presigned
+// URLs, then asks the API to attach it. Files are stored by content hash, so
+// content that is already stored isn't uploaded again. Returns null when the
+// backend has no R2 bucket configured so callers can fall back to
+// multipart/form-data.
+const uploadDirect = async (entidad, entidadId, campo, file, customName) => {
+    const { data: intent } = await api.post('/uploads/intent', {
+        entidad,
+        entidad_id: entidadId,
+        campo,
+        filename: file.name,
+        size: file.size,
+        sha256: await sha256Hex(file),
+        content_type: file.type || 'application/octet-stream',
+        custom_name: customName || null,
+    });
+    if (!intent.direct) return null;
+
+    const parts = [];
+    if (intent.stored) {
+        // Same content already stored: only the reference is added
+    } else if (intent.upload_id) {
+        for (const part of intent.parts) {
+            const start = (part.part_number - 1) * intent.part_size;
+            const res = await axios.put(part.url, file.slice(start, start + intent.part_size));
+            parts.push({ part_number: part.part_number, etag: res.headers.etag });
+        }
+    } else {
+        await axios.put(intent.url, file, { headers: intent.headers });
+    }
+    const { data } = await api.post('/uploads/complete', { upload_token: intent.upload_token, parts });
+    return data;
+};
+
+const uploadSingleDirect = async (entidad, entidadId, campo, file, fallback) => {
+    const result = await uploadDirect(entidad, entidadId, campo, file);
+    if (!result) return fallback();
+    return { data: { file_path: result.file_path } };
+};
+
+const uploadManyDirect = async (entidad, entidadId, campo, files, nombres, fallback) => {
+    const results = [];
+    for (let i = 0; i < files.length; i++) {
+        const result = await uploadDirect(entidad, entidadId, campo, files[i], nombres[i]);
+        if (!result) return fallback();
+        results.push(result);
+    }
+    return {
+        data: {
+            file_paths: results.map(r => r.file_path),
+            nombres: results.map(r => r.nombre),
+        }
+    };
+};
+
 // Auth
 export const login = async (username, password) => {
     const response = await api.post('/auth/login', { username, password });
@@ -119,13 +179,13 @@ export const getMuestraBase = (id) => api.get(`/muestras-base/${id}`);
 export const createMuestraBase = (data) => api.post('/muestras-base', data);
 export const updateMuestraBase = (id, data) => api.put(`/muestras-base/${id}`, data);
 export const deleteMuestraBase = (id) => api.delete(`/muestras-base/${id}`);
-export const uploadArchivoCostos = (id, file) => {
+export const uploadArchivoCostos = (id, file) => uploadSingleDirect('muestra_base', id, 'costos', file, () => {
     const formData = new FormData();
     formData.append('file', file);
     return api.post(`/muestras-base/${id}/archivo`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
-};
+});
 export const deleteArchivoCostos = (id) => api.delete(`/muestras-base/${id}/archivo`);
 
 // Fichas
@@ -135,13 +195,13 @@ export const getFicha = (id) => api.get(`/fichas/${id}`);
 export const createFicha = (data) => api.post('/fichas', data);
 export const updateFicha = (id, data) => api.put(`/fichas/${id}`, data);
 export const deleteFicha = (id) => api.delete(`/fichas/${id}`);
-export const uploadArchivoFicha = (id, file) => {
+export const uploadArchivoFicha = (id, file) => uploadSingleDirect('ficha', id, 'archivo', file, () => {
     const formData = new FormData();
     formData.append('file', file);
     return api.post(`/fichas/${id}/archivo`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
-};
+});
 
 // Tizados
 export const getTizados = (params) => api.get('/tizados', { params });
@@ -150,13 +210,13 @@ export const getTizado = (id) => api.get(`/tizados/${id}`);
 export const createTizado = (data) => api.post('/tizados', data);
 export const updateTizado = (id, data) => api.put(`/tizados/${id}`, data);
 export const deleteTizado = (id) => api.delete(`/tizados/${id}`);
-export const uploadArchivoTizado = (id, file) => {
+export const uploadArchivoTizado = (id, file) => uploadSingleDirect('tizado', id, 'archivo', file, () => {
     const formData = new FormData();
     formData.append('file', file);
     return api.post(`/tizados/${id}/archivo`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
-};
+});
 
 // Bases
 export const getBases = (params) => api.get('/bases', { params });
@@ -165,13 +225,13 @@ export const getBase = (id) => api.get(`/bases/${id}`);
 export const createBase = (data) => api.post('/bases', data);
 export const updateBase = (id, data) => api.put(`/bases/${id}`, data);
 export const deleteBase = (id) => api.delete(`/bases/${id}`);
-export const uploadPatron = (id, file) => {
+export const uploadPatron = (id, file) => uploadSingleDirect('base', id, 'patron', file, () => {
     const formData = new FormData();
     formData.append('file', file);
     return api.post(`/bases/${id}/patron`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
-};
+});
 export const uploadImagen = (id, file) => {
     const formData = new FormData();
     formData.append('file', file);
@@ -179,14 +239,14 @@ export const uploadImagen = (id, file) => {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
 };
-export const uploadFichasBase = (id, files, nombres = []) => {
+export const uploadFichasBase = (id, files, nombres = []) => uploadManyDirect('base', id, 'fichas', files, nombres, () => {
     const formData = new FormData();
     files.forEach(file => formData.append('files', file));
     nombres.forEach(nombre => formData.append('nombres', nombre));
     return api.post(`/bases/${id}/fichas`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
-};
+});
 export const uploadFichaChecklist = (id, file, nombre) => {
     const formData = new FormData();
     formData.append('file', file);
@@ -199,15 +259,27 @@ export const generateChecklistPdf = (baseId, items, title) => {
     return api.post(`/bases/${baseId}/generate-checklist`, { items, title });
 };
 export const regenerarTodosPdfs = () => api.post('/bases/regenerar-pdfs');
+
+// Background jobs: long operations return a job id to poll
+export const getJob = (id) => api.get(`/jobs/${id}`);
+export const waitForJob = async (id, onProgress, intervalMs = 1500) => {
+    for (;;) {
+        const { data } = await getJob(id);
+        if (data.estado === 'COMPLETADO' || data.estado === 'ERROR') return data;
+        if (onProgress) onProgress(data);
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+};
+
 export const deleteFichaBase = (id, fileIndex) => api.delete(`/bases/${id}/fichas/${fileIndex}`);
-export const uploadTizadosBase = (id, files, nombres = []) => {
+export const uploadTizadosBase = (id, files, nombres = []) => uploadManyDirect('base', id, 'tizados', files, nombres, () => {
     const formData = new FormData();
     files.forEach(file => formData.append('files', file));
     nombres.forEach(nombre => formData.append('nombres', nombre));
     return api.post(`/bases/${id}/tizados`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
-};
+});
 export const deleteTizadoBase = (id, fileIndex) => api.delete(`/bases/${id}/tizados/${fileIndex}`);
 export const reorderBases = (items) => api.put('/reorder/bases', items);
 
@@ -219,14 +291,14 @@ export const createModelo = (data) => api.post('/modelos', data);
 export const updateModelo = (id, data) => api.put(`/modelos/${id}`, data);
 export const deleteModelo = (id) => api.delete(`/modelos/${id}`);
 export const reorderModelos = (items) => api.put('/reorder/modelos', items);
-export const uploadFichaModelo = (id, files, nombres = []) => {
+export const uploadFichaModelo = (id, files, nombres = []) => uploadManyDirect('modelo', id, 'fichas', files, nombres, () => {
     const formData = new FormData();
     files.forEach(file => formData.append('files', file));
     nombres.forEach(nombre => formData.append('nombres', nombre));
     return api.post(`/modelos/${id}/fichas`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
     });
-};
+});
 export const deleteFichaModelo = (id, fileIndex) => api.delete(`/modelos/${id}/fichas/${fileIndex}`);
 
 export const downloadModeloFiles = (id) => {
@@ -234,6 +306,23 @@ export const downloadModeloFiles = (id) => {
     return `${API_BASE}/modelos/${id}/descargar?token=${encodeURIComponent(token)}`;
 };
 
+// Several modelos in one ZIP: a list of modelo ids, or every modelo of a base
+export const downloadModelosFiles = ({ modeloIds = [], baseId } = {}) => {
+    const token = localStorage.getItem('token');
+    const params = new URLSearchParams({ token });
+    if (modeloIds.length) params.set('modelo_ids', modeloIds.join(','));
+    if (baseId) params.set('base_id', baseId);
+    return `${API_BASE}/modelos/descargar?${params}`;
+};
+
+// One merged PDF with the checklists of several bases (all types unless tipos is given)
+export const printChecklistsUrl = (baseIds, tipos = []) => {
+    const token = localStorage.getItem('token');
+    const params = new URLSearchParams({ token, base_ids: baseIds.join(',') });
+    if (tipos.length) params.set('tipos', tipos.join(','));
+    return `${API_BASE}/bases/checklists/imprimir?${params}`;
+};
+
 // File download URL helper - handles both local and R2 paths
 export const getFileUrl = (filePath) => {
     if (!filePath) return '';
@@ -248,4 +337,15 @@ export const getFileUrl = (filePath) => {
     return `${API_BASE}/files/${filePath}`;
 };
 
+// Resolve many stored paths to download URLs in one request.
+// Returns { urls: { [path]: url }, expires_in } with absolute URLs.
+export const presignFiles = async (paths) => {
+    const { data } = await api.post('/files/presign', { paths: paths.filter(Boolean) });
+    const urls = {};
+    Object.entries(data.urls).forEach(([path, url]) => {
+        urls[path] = url.startsWith('/') ? `${BACKEND_URL}${url}` : url;
+    });
+    return { urls, expires_in: data.expires_in };
+};
+
 export default api;
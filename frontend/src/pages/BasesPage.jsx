@@ -1,6 +1,7 @@
 import { useState, useEffect, useCallback, useRef } from 'react';
 import { toast } from 'sonner';
 import { DeleteConfirmDialog } from '../components/DeleteConfirmDialog';
+import { usePresignedUrls } from '../hooks/use-presigned-urls';
 import { 
     getBases, createBase, updateBase, deleteBase, 
     uploadPatron, uploadFichasBase, uploadTizadosBase,
@@ -8,7 +9,7 @@ import {
     getMuestrasBase, getMarcas, getTiposProducto, getEntalles, getTelas,
     getTizados, updateTizado, createTizado, uploadArchivoTizado,
     getEstadosCostura, getAviosCostura, generateChecklistPdf,
-    reorderBases, regenerarTodosPdfs
+    reorderBases, regenerarTodosPdfs, waitForJob, printChecklistsUrl
 } from '../lib/api';
 import {
     DndContext,
@@ -70,7 +71,7 @@ import { Checkbox } from '../components/ui/checkbox';
 import { 
     Search, Plus, Pencil, Trash2, Filter, X, Upload, 
     FileSpreadsheet, Download, Image, Check, Clock, File, FolderOpen, RotateCcw, Link2,
-    CheckSquare, Sparkles, FileText, GripVertical
+    CheckSquare, Sparkles, FileText, GripVertical, Printer
 } from 'lucide-react';
 
 const ApprovalBadge = ({ aprobado }) => (
@@ -764,6 +765,12 @@ export default function BasesPage() {
         tizado.nombre.toLowerCase().includes(tizadoSearch.toLowerCase())
     );
 
+    // Download links of the fichas and tizados dialogs, resolved in one request
+    const fileUrl = usePresignedUrls([
+        ...(currentBaseForFiles?.fichas_archivos || []),
+        ...getTizadosForCurrentBase().map(t => t.archivo_tizado),
+    ]);
+
     // Get other bases names for a tizado (excluding current base)
     const getOtherBasesNames = (tizado) => {
         if (!tizado.bases_ids || !currentBaseForFiles) return [];
@@ -980,16 +987,25 @@ export default function BasesPage() {
                     </Button>
                     <Button 
                         onClick={async () => {
-                            toast.info('Regenerando PDFs...');
+                            const toastId = toast.loading('Regenerando PDFs...');
                             try {
                                 const res = await regenerarTodosPdfs();
-                                toast.success(res.data.message);
-                                if (res.data.errors?.length) {
-                                    res.data.errors.forEach(e => toast.error(e));
+                                const job = await waitForJob(res.data.job_id, (j) => {
+                                    if (j.progreso_total) {
+                                        toast.loading(`Regenerando PDFs... ${j.progreso_actual}/${j.progreso_total} bases`, { id: toastId });
+                                    }
+                                });
+                                if (job.estado === 'ERROR') {
+                                    toast.error(job.error || 'Error al regenerar PDFs', { id: toastId });
+                                    return;
+                                }
+                                toast.success(job.resultado.message, { id: toastId });
+                                if (job.resultado.errors?.length) {
+                                    job.resultado.errors.forEach(e => toast.error(e));
                                 }
                                 fetchData();
                             } catch (err) {
-                                toast.error('Error al regenerar PDFs');
+                                toast.error('Error al regenerar PDFs', { id: toastId });
                             }
                         }}
                         variant="outline"
@@ -998,6 +1014,21 @@ export default function BasesPage() {
                     >
                         <FileText className="h-4 w-4 mr-2" />Regenerar PDFs
                     </Button>
+                    <Button 
+                        onClick={() => {
+                            if (!data.length) {
+                                toast.error('No hay bases para imprimir');
+                                return;
+                            }
+                            window.open(printChecklistsUrl(data.map(b => b.id)), '_blank');
+                        }}
+                        variant="outline"
+                        className="bg-white text-slate-700 border-slate-300"
+                        title="Un solo PDF con los checklists de las bases listadas"
+                        data-testid="imprimir-checklists-btn"
+                    >
+                        <Printer className="h-4 w-4 mr-2" />Imprimir checklists
+                    </Button>
                 </div>
             </div>
 
@@ -1386,7 +1417,7 @@ export default function BasesPage() {
                                                                 {getFileExtension(ficha.archivo)}
                                                             </Badge>
                                                             <a 
-                                                                href={getFileUrl(ficha.archivo)} 
+                                                                href={fileUrl(ficha.archivo)} 
                                                                 target="_blank" 
                                                                 rel="noreferrer"
                                                                 className="text-slate-400 hover:text-slate-600"
@@ -1618,7 +1649,7 @@ export default function BasesPage() {
                                                             <Button 
                                                                 variant="ghost" 
                                                                 size="sm"
-                                                                onClick={() => window.open(getFileUrl(tizado.archivo_tizado), '_blank')}
+                                                                onClick={() => window.open(fileUrl(tizado.archivo_tizado), '_blank')}
                                                                 className="h-7 text-xs text-blue-600 hover:text-blue-700 hover:bg-blue-50"
                                                             >
                                                                 <Download className="w-3 h-3 mr-1" />
@@ -1,5 +1,6 @@
 import { useState, useEffect, useRef } from 'react';
-import { getModelos, createModelo, updateModelo, deleteModelo, getBases, getHilos, uploadFichaModelo, deleteFichaModelo, getFileUrl, getMuestrasBase, getMarcas, getTiposProducto, getEntalles, getTelas, reorderModelos, downloadModeloFiles } from '../lib/api';
+import { getModelos, createModelo, updateModelo, deleteModelo, getBases, getHilos, uploadFichaModelo, deleteFichaModelo, getFileUrl, getMuestrasBase, getMarcas, getTiposProducto, getEntalles, getTelas, reorderModelos, downloadModeloFiles, downloadModelosFiles } from '../lib/api';
+import { usePresignedUrls } from '../hooks/use-presigned-urls';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
 import { Label } from '../components/ui/label';
@@ -157,6 +158,13 @@ function ModelosPage() {
                basesNames.includes(searchLower);
     });
 
+    // Download links of the fichas and tizados dialogs, resolved in one request
+    const fileUrl = usePresignedUrls([
+        ...(currentModelo?.fichas_archivos || []),
+        ...(viewingModelo?.base_fichas_archivos || []),
+        ...(viewingModelo?.base_tizados || []).map(t => t.archivo_tizado),
+    ]);
+
     // Get other bases names for a tizado (excluding current base)
     const getOtherBasesForTizado = (tizado) => {
         if (!tizado.bases_ids) return [];
@@ -328,6 +336,11 @@ function ModelosPage() {
         window.open(url, '_blank');
     };
 
+    const handleDownloadList = () => {
+        const url = downloadModelosFiles({ modeloIds: data.map(d => d.id) });
+        window.open(url, '_blank');
+    };
+
     return (
         <div className="space-y-6">
             <div className="flex flex-col sm:flex-row sm:items-center sm:justify-between gap-4">
@@ -335,9 +348,14 @@ function ModelosPage() {
                     <h1 className="text-2xl font-bold text-slate-800">Modelos</h1>
                     <p className="text-slate-500 text-sm mt-1">Gestiona los modelos vinculados a bases</p>
                 </div>
-                <Button onClick={handleAdd} className="bg-emerald-600 hover:bg-emerald-700 text-white">
-                    <Plus className="w-4 h-4 mr-2" />Nuevo Modelo
-                </Button>
+                <div className="flex gap-2">
+                    <Button variant="outline" onClick={handleDownloadList} disabled={data.length === 0}>
+                        <FolderDown className="w-4 h-4 mr-2" />Descargar todos
+                    </Button>
+                    <Button onClick={handleAdd} className="bg-emerald-600 hover:bg-emerald-700 text-white">
+                        <Plus className="w-4 h-4 mr-2" />Nuevo Modelo
+                    </Button>
+                </div>
             </div>
 
             <div className="relative max-w-md">
@@ -757,7 +775,7 @@ function ModelosPage() {
                                                             {getFileExtension(ficha.archivo)}
                                                         </Badge>
                                                         <a 
-                                                            href={getFileUrl(ficha.archivo)} 
+                                                            href={fileUrl(ficha.archivo)} 
                                                             target="_blank" 
                                                             rel="noreferrer"
                                                             className="text-slate-400 hover:text-slate-600"
@@ -813,7 +831,7 @@ function ModelosPage() {
                                     <Button 
                                         variant="ghost" 
                                         size="sm" 
-                                        onClick={() => window.open(getFileUrl(archivo), '_blank')}
+                                        onClick={() => window.open(fileUrl(archivo), '_blank')}
                                         className="text-purple-600 hover:text-purple-800"
                                     >
                                         <Download className="w-4 h-4 mr-1" />Descargar
@@ -909,7 +927,7 @@ function ModelosPage() {
                                                             <Button 
                                                                 variant="ghost" 
                                                                 size="sm"
-                                                                onClick={() => window.open(getFileUrl(tizado.archivo_tizado), '_blank')}
+                                                                onClick={() => window.open(fileUrl(tizado.archivo_tizado), '_blank')}
                                                                 className="h-7 text-xs text-orange-600 hover:text-orange-700 hover:bg-orange-50"
                                                             >
                                                                 <Download className="w-3 h-3 mr-1" />